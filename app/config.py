@@ -42,6 +42,106 @@ class Config:
     languages: tuple[str, ...] = SUPPORTED_LANGS
     default_lang: str = DEFAULT_LANG
 
+    # http: admission control (токен-бакеты и сброс нагрузки)
+    http_ip_rate: float = 20.0          # запросов/сек на один IP
+    http_ip_burst: int = 40
+    http_route_rate: float = 300.0      # запросов/сек на маршрут (все IP вместе)
+    http_route_burst: int = 600
+    http_max_inflight: int = 256        # одновременных запросов в обработке
+    http_db_queue_budget: int = 200     # операций в очереди aiosqlite
+    http_loop_lag_budget_ms: int = 250  # допустимая задержка event loop
+    http_trust_proxy: bool = False      # брать IP из X-Forwarded-For
+
+    # метрики (/metrics); пустой токен — без авторизации
+    metrics_token: str = ""
+
+    # хранилище: sqlite (DB_PATH) | memory (в памяти процесса — тесты и бенчмарки)
+    storage_backend: str = "sqlite"
+
+    # профилирование SQL
+    db_profile: bool = True
+    db_slow_query_ms: int = 100
+
+    # SQLite: PRAGMA на каждое соединение
+    db_mmap_size: int = 256 * 1024 * 1024   # байт файла БД, читаемых через mmap (0 — выключено)
+    db_cache_size_kb: int = 16 * 1024       # кэш страниц на соединение
+    db_temp_store: str = "memory"           # default | file | memory — где временные таблицы сортировок
+    db_busy_timeout_ms: int = 5000          # сколько ждать блокировку записи, прежде чем «database is locked»
+
+    # обслуживание БД (wal_checkpoint, optimize, incremental_vacuum): раз в N сек; 0 — выключено
+    db_maintenance_interval: float = 3600.0
+    db_vacuum_pages: int = 2000             # страниц за один incremental_vacuum
+
+    # онлайн-бэкап БД (sqlite3 backup API): раз в N сек; 0 — только вручную (/backup)
+    backup_dir: Path = Path("./data/backups")
+    backup_interval: float = 86400.0
+    backup_keep: int = 7                    # сколько последних копий хранить
+    backup_pages_per_step: int = 1000       # страниц за шаг копирования
+    backup_step_pause_ms: int = 10          # пауза между шагами — писатели успевают своё
+    backup_compress: bool = True            # gzip готовой копии
+
+    # снимок БД для отчётов админки (статистика, рефы, выгрузки, превью сегментов):
+    # пересобирается раз в N сек тем же backup API; 0 — отчёты читают живую БД
+    # через отдельное read-only соединение
+    analytics_snapshot_path: Path = Path("./data/analytics.db")
+    analytics_snapshot_interval: float = 300.0
+
+    # бюджет на обработку одного апдейта (дольше — warning в лог)
+    handler_budget_ms: int = 500
+
+    # как часто проверять app/locales на изменения (сек); 0 — не следить
+    locales_watch_interval: float = 5.0
+
+    # структурированный JSON-лог (пусто — выключен) и размер пачки записи
+    log_json_path: str = ""
+    log_json_batch: int = 256
+
+    # апдейты: сколько обрабатываем одновременно (у одного пользователя — строго по очереди)
+    update_concurrency: int = 32
+
+    # активность пользователей копится в памяти и пишется в БД пачкой раз в N сек
+    activity_flush_interval: float = 30.0
+
+    # отложенные рассылки: как часто проверять очередь (сек) и в каком поясе
+    # админ задаёт время старта и тихие часы (IANA, например Europe/Moscow)
+    broadcast_poll_interval: float = 15.0
+    broadcast_tz: str = "UTC"
+
+    # HTTP-выгрузки GET /export/{kind}: токен доступа; пусто — маршрут выключен
+    export_token: str = ""
+
+    # спул постбэков: /postback сначала дописывается в файл (fsync пачкой) и сразу
+    # подтверждается, в БД записи переносит фоновая задача; выключен — пишем в БД сразу
+    postback_spool: bool = True
+    postback_spool_dir: Path = Path("./data/spool")
+    postback_spool_fsync_ms: int = 2                    # окно группового fsync
+    postback_spool_interval: float = 1.0                # как часто переносить в БД (сек)
+    postback_spool_batch: int = 5000                    # строк в одной транзакции переноса
+    postback_spool_segment_bytes: int = 16 * 1024 * 1024
+    # уведомления о постбэках в канал: очередь (лишние отбрасываются) и сколько
+    # секунд досылать её на остановке
+    postback_notify_queue: int = 1000
+    postback_notify_drain: float = 10.0
+
+    # исходящие сообщения бота (app/services/outbound.py): общий бюджет на всех отправителей
+    tg_outbound_governor: bool = True
+    tg_global_rate: float = 30.0                        # сообщений/с на бота
+    tg_global_burst: int = 5
+    tg_chat_rate: float = 1.0                           # сообщений/с в личный чат
+    tg_chat_burst: int = 3
+    tg_group_per_minute: int = 20                       # сообщений/мин в группу или канал
+    tg_group_burst: int = 3
+    tg_retry_after_max: float = 60.0                    # RetryAfter дольше — не ждём, ошибка отправителю
+    tg_retry_attempts: int = 3                          # повторов после RetryAfter
+
+    # HTTP-сессия бота к Bot API (app/services/telegram_session.py)
+    tg_http_limit: int = 100                            # соединений в пуле всего
+    tg_http_limit_per_host: int = 100                   # из них к одному хосту (0 — без лимита)
+    tg_http_keepalive: float = 60.0                     # держать простаивающее соединение (сек)
+    tg_http_dns_ttl: int = 3600                         # кэш DNS (сек); 0 — без кэша
+    tg_http_timeout: float = 60.0                       # на запрос целиком (long polling — плюс ожидание)
+    tg_http_connect_timeout: float = 10.0               # на установку соединения
+
 
 def _req(name: str) -> str:
     val = os.getenv(name)
@@ -50,6 +150,23 @@ def _req(name: str) -> str:
     return val
 
 
+def _env_int(name: str, default: int) -> int:
+    val = os.getenv(name)
+    return int(val) if val else default
+
+
+def _env_float(name: str, default: float) -> float:
+    val = os.getenv(name)
+    return float(val) if val else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    val = os.getenv(name)
+    if not val:
+        return default
+    return val.strip().lower() in ("1", "true", "yes", "on")
+
+
 def _build_config() -> Config:
     cfg = Config(
         bot_token=_req("BOT_TOKEN"),
@@ -64,6 +181,64 @@ def _build_config() -> Config:
         log_level=os.getenv("LOG_LEVEL", "INFO"),
         domain=os.getenv("DOMAIN", ""),
         domain_ip=os.getenv("DOMAIN_IP", ""),
+        http_ip_rate=_env_float("HTTP_IP_RATE", 20.0),
+        http_ip_burst=_env_int("HTTP_IP_BURST", 40),
+        http_route_rate=_env_float("HTTP_ROUTE_RATE", 300.0),
+        http_route_burst=_env_int("HTTP_ROUTE_BURST", 600),
+        http_max_inflight=_env_int("HTTP_MAX_INFLIGHT", 256),
+        http_db_queue_budget=_env_int("HTTP_DB_QUEUE_BUDGET", 200),
+        http_loop_lag_budget_ms=_env_int("HTTP_LOOP_LAG_BUDGET_MS", 250),
+        http_trust_proxy=_env_bool("HTTP_TRUST_PROXY", False),
+        metrics_token=os.getenv("METRICS_TOKEN", ""),
+        storage_backend=os.getenv("STORAGE_BACKEND", "sqlite").strip().lower(),
+        db_profile=_env_bool("DB_PROFILE", True),
+        db_slow_query_ms=_env_int("DB_SLOW_QUERY_MS", 100),
+        db_mmap_size=_env_int("DB_MMAP_SIZE", 256 * 1024 * 1024),
+        db_cache_size_kb=_env_int("DB_CACHE_SIZE_KB", 16 * 1024),
+        db_temp_store=os.getenv("DB_TEMP_STORE", "memory"),
+        db_busy_timeout_ms=_env_int("DB_BUSY_TIMEOUT_MS", 5000),
+        db_maintenance_interval=_env_float("DB_MAINTENANCE_INTERVAL", 3600.0),
+        db_vacuum_pages=_env_int("DB_VACUUM_PAGES", 2000),
+        backup_dir=Path(os.getenv("BACKUP_DIR", "./data/backups")).resolve(),
+        backup_interval=_env_float("BACKUP_INTERVAL", 86400.0),
+        backup_keep=_env_int("BACKUP_KEEP", 7),
+        backup_pages_per_step=_env_int("BACKUP_PAGES_PER_STEP", 1000),
+        backup_step_pause_ms=_env_int("BACKUP_STEP_PAUSE_MS", 10),
+        backup_compress=_env_bool("BACKUP_COMPRESS", True),
+        analytics_snapshot_path=Path(os.getenv("ANALYTICS_SNAPSHOT_PATH", "./data/analytics.db")).resolve(),
+        analytics_snapshot_interval=_env_float("ANALYTICS_SNAPSHOT_INTERVAL", 300.0),
+        handler_budget_ms=_env_int("HANDLER_BUDGET_MS", 500),
+        locales_watch_interval=_env_float("LOCALES_WATCH_INTERVAL", 5.0),
+        log_json_path=os.getenv("LOG_JSON_PATH", ""),
+        log_json_batch=_env_int("LOG_JSON_BATCH", 256),
+        update_concurrency=_env_int("UPDATE_CONCURRENCY", 32),
+        activity_flush_interval=_env_float("ACTIVITY_FLUSH_INTERVAL", 30.0),
+        broadcast_poll_interval=_env_float("BROADCAST_POLL_INTERVAL", 15.0),
+        broadcast_tz=os.getenv("BROADCAST_TZ", "UTC"),
+        export_token=os.getenv("EXPORT_TOKEN", ""),
+        postback_spool=_env_bool("POSTBACK_SPOOL", True),
+        postback_spool_dir=Path(os.getenv("POSTBACK_SPOOL_DIR", "./data/spool")).resolve(),
+        postback_spool_fsync_ms=_env_int("POSTBACK_SPOOL_FSYNC_MS", 2),
+        postback_spool_interval=_env_float("POSTBACK_SPOOL_INTERVAL", 1.0),
+        postback_spool_batch=_env_int("POSTBACK_SPOOL_BATCH", 5000),
+        postback_spool_segment_bytes=_env_int("POSTBACK_SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024),
+        postback_notify_queue=_env_int("POSTBACK_NOTIFY_QUEUE", 1000),
+        postback_notify_drain=_env_float("POSTBACK_NOTIFY_DRAIN", 10.0),
+        tg_outbound_governor=_env_bool("TG_OUTBOUND_GOVERNOR", True),
+        tg_global_rate=_env_float("TG_GLOBAL_RATE", 30.0),
+        tg_global_burst=_env_int("TG_GLOBAL_BURST", 5),
+        tg_chat_rate=_env_float("TG_CHAT_RATE", 1.0),
+        tg_chat_burst=_env_int("TG_CHAT_BURST", 3),
+        tg_group_per_minute=_env_int("TG_GROUP_PER_MINUTE", 20),
+        tg_group_burst=_env_int("TG_GROUP_BURST", 3),
+        tg_retry_after_max=_env_float("TG_RETRY_AFTER_MAX", 60.0),
+        tg_retry_attempts=_env_int("TG_RETRY_ATTEMPTS", 3),
+        tg_http_limit=_env_int("TG_HTTP_LIMIT", 100),
+        tg_http_limit_per_host=_env_int("TG_HTTP_LIMIT_PER_HOST", 100),
+        tg_http_keepalive=_env_float("TG_HTTP_KEEPALIVE", 60.0),
+        tg_http_dns_ttl=_env_int("TG_HTTP_DNS_TTL", 3600),
+        tg_http_timeout=_env_float("TG_HTTP_TIMEOUT", 60.0),
+        tg_http_connect_timeout=_env_float("TG_HTTP_CONNECT_TIMEOUT", 10.0),
     )
     # гарантируем, что папка для БД существует
     cfg.db_path.parent.mkdir(parents=True, exist_ok=True)
@@ -2,16 +2,21 @@
 from __future__ import annotations
 
 import aiosqlite
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional, Any, Dict
+from typing import Optional, Any, AsyncIterator, Dict, Iterable, List, Sequence, Tuple
 import time
 
 from app.config import get_config
+from app.storage.base import check_export_filters, export_columns, export_date_column
+from app.utils import sql_profiler
 
 _DB_CONN: aiosqlite.Connection | None = None
 
 
 SCHEMA_SQL = """
+-- действует только на новой БД (до первой таблицы); старую переводит /dbmaint vacuum
+PRAGMA auto_vacuum=INCREMENTAL;
 PRAGMA journal_mode=WAL;
 PRAGMA synchronous=NORMAL;
 
@@ -24,7 +29,9 @@ CREATE TABLE IF NOT EXISTS users (
     ref_code       TEXT,
     created_at     INTEGER NOT NULL,
     updated_at     INTEGER NOT NULL,
-    blocked        INTEGER NOT NULL DEFAULT 0
+    blocked        INTEGER NOT NULL DEFAULT 0,
+    last_seen_at   INTEGER,
+    interactions   INTEGER NOT NULL DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS postbacks (
@@ -33,6 +40,8 @@ CREATE TABLE IF NOT EXISTS postbacks (
     event_type    TEXT NOT NULL,
     payload       TEXT,
     created_at    INTEGER NOT NULL,
+    -- id записи в спуле постбэков (app/services/spool.py): повторный перенос — INSERT OR IGNORE
+    spool_id      INTEGER,
     FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
 
@@ -42,6 +51,15 @@ CREATE TABLE IF NOT EXISTS broadcasts (
     text          TEXT,
     markup_json   TEXT,
     filter_json   TEXT,
+    payload_json  TEXT,
+    fallback_lang TEXT,
+    -- планировщик (app/services/broadcaster.py): не раньше scheduled_for, вне quiet_hours,
+    -- не быстрее max_rate сообщений/с; cursor_* — последний обработанный (lang, user_id)
+    scheduled_for  INTEGER,
+    quiet_hours    TEXT,
+    max_rate       REAL,
+    cursor_lang    TEXT,
+    cursor_user_id INTEGER,
     status        TEXT NOT NULL DEFAULT 'draft',
     total         INTEGER DEFAULT 0,
     sent          INTEGER DEFAULT 0,
@@ -51,6 +69,14 @@ CREATE TABLE IF NOT EXISTS broadcasts (
     finished_at   INTEGER
 );
 
+-- Языковые варианты рассылки (payload_json как в broadcasts)
+CREATE TABLE IF NOT EXISTS broadcast_variants (
+    broadcast_id  INTEGER NOT NULL REFERENCES broadcasts(id),
+    lang          TEXT NOT NULL,
+    payload_json  TEXT NOT NULL,
+    PRIMARY KEY (broadcast_id, lang)
+) WITHOUT ROWID;
+
 -- Новая таблица настроек приложения (гибкие ссылки и не только)
 CREATE TABLE IF NOT EXISTS app_settings (
     key         TEXT PRIMARY KEY,
@@ -68,8 +94,83 @@ CREATE TABLE IF NOT EXISTS user_profiles (
     created_at  INTEGER NOT NULL,
     updated_at  INTEGER NOT NULL
 );
+
+-- Индексы под сегменты рассылок (app/services/segments.py)
+CREATE INDEX IF NOT EXISTS idx_users_active_lang ON users(blocked, lang);
+CREATE INDEX IF NOT EXISTS idx_users_active_created ON users(blocked, created_at);
+CREATE INDEX IF NOT EXISTS idx_users_ref ON users(ref_code);
+CREATE INDEX IF NOT EXISTS idx_postbacks_event_user ON postbacks(event_type, user_id);
+CREATE INDEX IF NOT EXISTS idx_profiles_geo ON user_profiles(geo);
+
+-- Счётчики по ref_code (ведут триггеры ниже; '' — пользователи без рефа).
+-- metric: 'users' — регистрации, 'lang:<код>' — текущий язык,
+--         'event:<тип>' — постбэки, 'uniq:<тип>' — уникальные пользователи с этим событием
+CREATE TABLE IF NOT EXISTS ref_counters (
+    ref_code  TEXT NOT NULL,
+    metric    TEXT NOT NULL,
+    n         INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ref_code, metric)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_ref_counters_metric ON ref_counters(metric, n);
+
+CREATE TRIGGER IF NOT EXISTS trg_ref_users_insert AFTER INSERT ON users
+BEGIN
+    INSERT INTO ref_counters(ref_code, metric, n) VALUES (COALESCE(NEW.ref_code, ''), 'users', 1)
+        ON CONFLICT(ref_code, metric) DO UPDATE SET n = n + 1;
+    INSERT INTO ref_counters(ref_code, metric, n) VALUES (COALESCE(NEW.ref_code, ''), 'lang:' || NEW.lang, 1)
+        ON CONFLICT(ref_code, metric) DO UPDATE SET n = n + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_ref_users_lang AFTER UPDATE OF lang ON users
+WHEN OLD.lang IS NOT NEW.lang
+BEGIN
+    UPDATE ref_counters SET n = n - 1
+        WHERE ref_code = COALESCE(OLD.ref_code, '') AND metric = 'lang:' || OLD.lang;
+    INSERT INTO ref_counters(ref_code, metric, n) VALUES (COALESCE(NEW.ref_code, ''), 'lang:' || NEW.lang, 1)
+        ON CONFLICT(ref_code, metric) DO UPDATE SET n = n + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_ref_postbacks_insert AFTER INSERT ON postbacks
+BEGIN
+    INSERT INTO ref_counters(ref_code, metric, n)
+        SELECT COALESCE(u.ref_code, ''), 'event:' || NEW.event_type, 1 FROM users u WHERE u.user_id = NEW.user_id
+        ON CONFLICT(ref_code, metric) DO UPDATE SET n = n + 1;
+    INSERT INTO ref_counters(ref_code, metric, n)
+        SELECT COALESCE(u.ref_code, ''), 'uniq:' || NEW.event_type, 1 FROM users u
+        WHERE u.user_id = NEW.user_id
+          AND NOT EXISTS (
+              SELECT 1 FROM postbacks p
+              WHERE p.event_type = NEW.event_type AND p.user_id = NEW.user_id AND p.id <> NEW.id
+          )
+        ON CONFLICT(ref_code, metric) DO UPDATE SET n = n + 1;
+END;
+"""
+
+# Колонки, появившиеся после первого релиза: на старых БД CREATE TABLE IF NOT EXISTS
+# их не добавит, поэтому доливаем ALTER TABLE. (таблица, колонка, определение)
+_ADDED_COLUMNS = (
+    ("users", "last_seen_at", "INTEGER"),
+    ("users", "interactions", "INTEGER NOT NULL DEFAULT 0"),
+    ("broadcasts", "payload_json", "TEXT"),
+    ("broadcasts", "fallback_lang", "TEXT"),
+    ("broadcasts", "scheduled_for", "INTEGER"),
+    ("broadcasts", "quiet_hours", "TEXT"),
+    ("broadcasts", "max_rate", "REAL"),
+    ("broadcasts", "cursor_lang", "TEXT"),
+    ("broadcasts", "cursor_user_id", "INTEGER"),
+    ("postbacks", "spool_id", "INTEGER"),
+)
+
+# индексы по добавленным колонкам — после миграции
+POST_MIGRATION_SQL = """
+CREATE INDEX IF NOT EXISTS idx_users_active_seen ON users(blocked, last_seen_at);
+CREATE INDEX IF NOT EXISTS idx_broadcasts_due ON broadcasts(status, scheduled_for);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_postbacks_spool ON postbacks(spool_id) WHERE spool_id IS NOT NULL;
 """
 
+# флаг в app_settings: ref_counters заполнены по уже существующим данным
+_REF_COUNTERS_READY = "ref_counters_v1"
+
 
 async def get_db() -> aiosqlite.Connection:
     """
@@ -80,15 +181,160 @@ async def get_db() -> aiosqlite.Connection:
     if _DB_CONN is None:
         cfg = get_config()
         db_path: Path = cfg.db_path
-        _DB_CONN = await aiosqlite.connect(db_path.as_posix())
+        if cfg.db_profile:
+            sql_profiler.PROFILER.slow_s = cfg.db_slow_query_ms / 1000.0
+            _DB_CONN = await sql_profiler.connect(db_path.as_posix())
+        else:
+            _DB_CONN = await aiosqlite.connect(db_path.as_posix())
+        await _apply_pragmas(_DB_CONN)
         await _DB_CONN.executescript(SCHEMA_SQL)
+        await _migrate(_DB_CONN)
         await _DB_CONN.execute("PRAGMA foreign_keys = ON;")
         await _DB_CONN.commit()
         # гарантируем дефолтные ссылки в БД
         await _ensure_default_links(_DB_CONN)
+        await _ensure_ref_counters(_DB_CONN)
     return _DB_CONN
 
 
+# PRAGMA temp_store: значение из Config -> код SQLite
+_TEMP_STORE = {"default": 0, "file": 1, "memory": 2}
+
+
+async def _apply_pragmas(conn: aiosqlite.Connection) -> None:
+    """Настройки соединения из Config (действуют на это соединение, а не на файл БД)."""
+    cfg = get_config()
+    await conn.execute(f"PRAGMA busy_timeout = {int(cfg.db_busy_timeout_ms)}")
+    await conn.execute(f"PRAGMA cache_size = {-int(cfg.db_cache_size_kb)}")  # < 0 — в КиБ, а не в страницах
+    await conn.execute(f"PRAGMA mmap_size = {int(cfg.db_mmap_size)}")
+    await conn.execute(f"PRAGMA temp_store = {_TEMP_STORE.get(cfg.db_temp_store.lower(), 0)}")
+
+
+async def open_read_only(path: Optional[Path] = None, *, immutable: bool = False) -> aiosqlite.Connection:
+    """
+    Read-only соединение к БД (по умолчанию — DB_PATH). immutable — файл никто не меняет
+    (снимок для отчётов): SQLite читает его без блокировок и без -wal/-shm.
+    """
+    uri = f"file:{(path or get_config().db_path).as_posix()}?mode=ro" + ("&immutable=1" if immutable else "")
+    conn = await aiosqlite.connect(uri, uri=True)
+    await _apply_pragmas(conn)
+    return conn
+
+
+@asynccontextmanager
+async def _read_only(conn: Optional[aiosqlite.Connection] = None) -> AsyncIterator[aiosqlite.Connection]:
+    """
+    Отдельное read-only соединение для долгих выборок (рассылки, выгрузки):
+    основное (через него пишут хендлеры) не занято, а в WAL долгое чтение не мешает записи.
+    conn — уже открытое соединение (снимок для отчётов): его и отдаём, не закрывая.
+    """
+    if conn is not None:
+        yield conn
+        return
+    ro = await open_read_only()
+    try:
+        yield ro
+    finally:
+        await ro.close()
+
+
+async def _migrate(db: aiosqlite.Connection) -> None:
+    for table, column, ddl in _ADDED_COLUMNS:
+        async with db.execute(f"PRAGMA table_info({table})") as cur:
+            existing = {row[1] for row in await cur.fetchall()}
+        if column not in existing:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+    await db.executescript(POST_MIGRATION_SQL)
+    await db.commit()
+
+
+async def close_db() -> None:
+    """Закрыть соединение при остановке (дожидается операций в очереди)."""
+    global _DB_CONN
+    if _DB_CONN is not None:
+        conn, _DB_CONN = _DB_CONN, None
+        await conn.close()
+
+
+def _pending_ops(conn: aiosqlite.Connection) -> int:
+    """
+    Длина очереди операций потока aiosqlite. Публичного API для этого нет:
+    читаем приватный Connection._tx (queue.Queue в aiosqlite 0.17–0.20).
+    Единственное место, где код лезет в приватное aiosqlite; если атрибут
+    исчезнет при обновлении — вернём 0 (контроль нагрузки по очереди БД отключится).
+    """
+    tx = getattr(conn, "_tx", None)
+    return tx.qsize() if tx is not None else 0
+
+
+def db_queue_depth() -> int:
+    """
+    Сколько операций ждёт своей очереди в потоке aiosqlite.
+    0, если соединение ещё не открыто.
+    """
+    if _DB_CONN is None:
+        return 0
+    return _pending_ops(_DB_CONN)
+
+
+# ===== Обслуживание (app/services/maintenance.py) =====
+
+async def db_pragma(name: str) -> Any:
+    db = await get_db()
+    async with db.execute(f"PRAGMA {name}") as cur:
+        row = await cur.fetchone()
+    return row[0] if row else None
+
+
+async def wal_checkpoint(mode: str = "TRUNCATE") -> Tuple[int, int, int]:
+    """
+    (busy, страниц в WAL, перенесено в БД); busy=1 — долгое чтение не дало дойти до конца WAL.
+    После успешного TRUNCATE WAL пуст, и счётчики страниц — нули.
+    """
+    db = await get_db()
+    async with db.execute(f"PRAGMA wal_checkpoint({mode})") as cur:
+        busy, log, done = await cur.fetchone()
+    return busy, log, done
+
+
+async def optimize(analysis_limit: int = 1000) -> bool:
+    """
+    PRAGMA optimize; если статистики планировщика ещё нет — сначала ANALYZE.
+    analysis_limit — ANALYZE по выборке строк, а не по всей таблице. Вернёт True, если был ANALYZE.
+    """
+    db = await get_db()
+    await db.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'") as cur:
+        analyzed = await cur.fetchone() is not None
+    if not analyzed:
+        await db.execute("ANALYZE")
+    await db.execute("PRAGMA optimize")
+    await db.commit()
+    return not analyzed
+
+
+async def incremental_vacuum(pages: int) -> int:
+    """Отдать ОС до pages свободных страниц (нужен auto_vacuum=INCREMENTAL). Вернёт, сколько отдали."""
+    db = await get_db()
+    before = await db_pragma("freelist_count")
+    # через execute() sqlite3 делает один шаг прагмы — одну страницу; executescript доводит до конца
+    await db.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    return before - await db_pragma("freelist_count")
+
+
+async def vacuum_full() -> None:
+    """
+    Полный VACUUM с переводом БД на auto_vacuum=INCREMENTAL.
+    Переписывает весь файл и держит БД всё это время — только вручную (/dbmaint vacuum).
+    """
+    db = await get_db()
+    await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    await db.commit()
+    await db.execute("VACUUM")
+    # в WAL-режиме VACUUM пишет всю БД в WAL — сразу переносим и обрезаем
+    await wal_checkpoint("TRUNCATE")
+
+
 # ===== Settings (generic) =====
 
 async def set_setting(key: str, value: str) -> None:
@@ -144,6 +390,36 @@ async def _ensure_default_links(db: aiosqlite.Connection) -> None:
     await db.commit()
 
 
+async def _ensure_ref_counters(db: aiosqlite.Connection) -> None:
+    """
+    Триггеры считают только новые строки. Один раз (на БД, где счётчиков ещё не было)
+    пересчитываем их по существующим users/postbacks — в одной транзакции.
+    """
+    async with db.execute("SELECT 1 FROM app_settings WHERE key=?", (_REF_COUNTERS_READY,)) as cur:
+        if await cur.fetchone() is not None:
+            return
+    await db.execute("DELETE FROM ref_counters")
+    await db.execute(
+        """
+        INSERT INTO ref_counters(ref_code, metric, n)
+        SELECT COALESCE(ref_code, ''), 'users', COUNT(*) FROM users GROUP BY 1
+        UNION ALL
+        SELECT COALESCE(ref_code, ''), 'lang:' || lang, COUNT(*) FROM users GROUP BY 1, 2
+        UNION ALL
+        SELECT COALESCE(u.ref_code, ''), 'event:' || p.event_type, COUNT(*)
+            FROM postbacks p JOIN users u ON u.user_id = p.user_id GROUP BY 1, 2
+        UNION ALL
+        SELECT COALESCE(u.ref_code, ''), 'uniq:' || p.event_type, COUNT(DISTINCT p.user_id)
+            FROM postbacks p JOIN users u ON u.user_id = p.user_id GROUP BY 1, 2
+        """
+    )
+    await db.execute(
+        "INSERT INTO app_settings(key, value, updated_at) VALUES(?, '1', ?)",
+        (_REF_COUNTERS_READY, int(time.time())),
+    )
+    await db.commit()
+
+
 async def set_links(*, support_url: Optional[str] = None, ref_url: Optional[str] = None, onewin_tok_url: Optional[str] = None) -> None:
     """
     Обновить ссылки частично или полностью.
@@ -189,15 +465,15 @@ async def upsert_user(
     await db.execute(
         """
         INSERT INTO users(user_id, username, first_name, last_name, lang, ref_code, created_at, updated_at, blocked)
-        VALUES(?, ?, ?, ?, COALESCE(?, 'ru'), ?, ?, ?, 0)
+        VALUES(?1, ?2, ?3, ?4, COALESCE(?5, 'ru'), ?6, ?7, ?7, 0)
         ON CONFLICT(user_id) DO UPDATE SET
             username=excluded.username,
             first_name=excluded.first_name,
             last_name=excluded.last_name,
-            lang=COALESCE(excluded.lang, users.lang),
+            lang=COALESCE(?5, users.lang),  -- не excluded.lang: там уже подставлен 'ru'
             updated_at=excluded.updated_at
         """,
-        (user_id, username, first_name, last_name, lang, ref_code, ts, ts),
+        (user_id, username, first_name, last_name, lang, ref_code, ts),
     )
     await db.commit()
 
@@ -231,8 +507,8 @@ async def get_user(user_id: int) -> Optional[Dict[str, Any]]:
         return dict(zip(cols, row))
 
 
-async def count_users_by_lang(lang: Optional[str] = None) -> int:
-    db = await get_db()
+async def count_users_by_lang(lang: Optional[str] = None, *, conn: Optional[aiosqlite.Connection] = None) -> int:
+    db = conn or await get_db()
     if lang:
         async with db.execute("SELECT COUNT(*) FROM users WHERE lang=? AND blocked=0", (lang,)) as cur:
             (n,) = await cur.fetchone()
@@ -242,6 +518,36 @@ async def count_users_by_lang(lang: Optional[str] = None) -> int:
         return int(n)
 
 
+async def record_activity(
+    rows: Sequence[Tuple[int, int, int]],
+    blocked: Sequence[Tuple[int, bool]] = (),
+) -> None:
+    """
+    Пачка из write-behind буфера одной транзакцией:
+      rows    — активность (user_id, last_seen_at, interactions): last_seen_at не откатываем, interactions прибавляем;
+      blocked — смена статуса (user_id, blocked) из my_chat_member.
+    """
+    if not rows and not blocked:
+        return
+    db = await get_db()
+    if rows:
+        await db.executemany(
+            """
+            UPDATE users SET
+                last_seen_at = MAX(COALESCE(last_seen_at, 0), ?),
+                interactions = interactions + ?
+            WHERE user_id = ?
+            """,
+            [(seen, n, uid) for uid, seen, n in rows],
+        )
+    if blocked:
+        await db.executemany(
+            "UPDATE users SET blocked=? WHERE user_id=?",
+            [(1 if b else 0, uid) for uid, b in blocked],
+        )
+    await db.commit()
+
+
 async def set_blocked(user_id: int, blocked: bool) -> None:
     db = await get_db()
     await db.execute("UPDATE users SET blocked=? WHERE user_id=?", (1 if blocked else 0, user_id))
@@ -260,19 +566,104 @@ async def add_postback(user_id: int, event_type: str, payload: str, ts: int) ->
     return cur.lastrowid
 
 
+async def add_postbacks(rows: Sequence[Tuple[int, int, str, str, int]]) -> Tuple[int, List[Tuple[int, int, str, str, int]]]:
+    """
+    Пачка постбэков из спула (spool_id, user_id, event_type, payload, created_at) одной транзакцией.
+    Уже перенесённые spool_id пропускаются (INSERT OR IGNORE по idx_postbacks_spool) — повтор
+    после сбоя ничего не задваивает. Строки с неизвестным user_id внешний ключ не пропустит:
+    их отдаём обратно, а не роняем всю пачку. Вернёт (вставлено, отвергнутые).
+    """
+    if not rows:
+        return 0, []
+    db = await get_db()
+    known: set = set()
+    user_ids = list({r[1] for r in rows})
+    for i in range(0, len(user_ids), 500):
+        chunk = user_ids[i:i + 500]
+        async with db.execute(
+            f"SELECT user_id FROM users WHERE user_id IN ({', '.join('?' * len(chunk))})", chunk,
+        ) as cur:
+            known.update(r[0] for r in await cur.fetchall())
+    accepted = [r for r in rows if r[1] in known]
+    rejected = [r for r in rows if r[1] not in known]
+    cur = await db.executemany(
+        "INSERT OR IGNORE INTO postbacks(spool_id, user_id, event_type, payload, created_at) VALUES(?, ?, ?, ?, ?)",
+        accepted,
+    )
+    await db.commit()
+    return max(cur.rowcount, 0), rejected
+
+
 # ===== Broadcasts =====
 
-async def create_broadcast(author_id: int, text: str, markup_json: str, filter_json: str, ts: int) -> int:
+async def create_broadcast(
+    author_id: int,
+    text: str,
+    markup_json: str,
+    filter_json: str,
+    ts: int,
+    *,
+    payload_json: Optional[str] = None,
+    variants: Sequence[Tuple[str, str]] = (),
+    fallback_lang: Optional[str] = None,
+    status: str = "draft",
+    scheduled_for: Optional[int] = None,
+    quiet_hours: Optional[str] = None,
+    max_rate: Optional[float] = None,
+) -> int:
+    """
+    variants — языковые варианты (lang, payload_json), пишутся в той же транзакции.
+    status='scheduled' — рассылку запустит планировщик, когда подойдёт scheduled_for.
+    """
     db = await get_db()
     cur = await db.execute(
         """
-        INSERT INTO broadcasts(author_id, text, markup_json, filter_json, status, total, sent, failed, created_at)
-        VALUES(?, ?, ?, ?, 'draft', 0, 0, 0, ?)
+        INSERT INTO broadcasts(author_id, text, markup_json, filter_json, payload_json, fallback_lang,
+                               scheduled_for, quiet_hours, max_rate,
+                               status, total, sent, failed, created_at)
+        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, 0, 0, ?)
         """,
-        (author_id, text, markup_json, filter_json, ts),
+        (author_id, text, markup_json, filter_json, payload_json, fallback_lang,
+         scheduled_for, quiet_hours, max_rate, status, ts),
+    )
+    broadcast_id = cur.lastrowid
+    if variants:
+        await db.executemany(
+            "INSERT INTO broadcast_variants(broadcast_id, lang, payload_json) VALUES(?, ?, ?)",
+            [(broadcast_id, lang, payload) for lang, payload in variants],
+        )
+    await db.commit()
+    return broadcast_id
+
+
+async def get_broadcast_variants(broadcast_id: int) -> Dict[str, str]:
+    db = await get_db()
+    async with db.execute(
+        "SELECT lang, payload_json FROM broadcast_variants WHERE broadcast_id=?", (broadcast_id,),
+    ) as cur:
+        return {lang: payload async for lang, payload in cur}
+
+
+async def set_broadcast_counts(
+    broadcast_id: int,
+    *,
+    total: int,
+    sent: int,
+    failed: int,
+    cursor: Optional[Tuple[str, int]] = None,
+) -> None:
+    """Прогресс рассылки; cursor — (lang, user_id), с которого продолжать после рестарта/паузы."""
+    db = await get_db()
+    lang, user_id = cursor if cursor is not None else (None, None)
+    await db.execute(
+        """
+        UPDATE broadcasts SET total=?, sent=?, failed=?,
+               cursor_lang=COALESCE(?, cursor_lang), cursor_user_id=COALESCE(?, cursor_user_id)
+        WHERE id=?
+        """,
+        (total, sent, failed, lang, user_id, broadcast_id),
     )
     await db.commit()
-    return cur.lastrowid
 
 
 async def set_broadcast_status(broadcast_id: int, status: str, *, started_at: Optional[int] = None, finished_at: Optional[int] = None) -> None:
@@ -284,6 +675,217 @@ async def set_broadcast_status(broadcast_id: int, status: str, *, started_at: Op
     await db.commit()
 
 
+def _dict_rows(cur: aiosqlite.Cursor, rows: Iterable[Sequence[Any]]) -> List[Dict[str, Any]]:
+    cols = [c[0] for c in cur.description]
+    return [dict(zip(cols, row)) for row in rows]
+
+
+async def get_broadcast(broadcast_id: int) -> Optional[Dict[str, Any]]:
+    db = await get_db()
+    async with db.execute("SELECT * FROM broadcasts WHERE id=?", (broadcast_id,)) as cur:
+        row = await cur.fetchone()
+        return _dict_rows(cur, [row])[0] if row else None
+
+
+async def due_broadcasts(now: int) -> List[Dict[str, Any]]:
+    """Запланированные рассылки, у которых подошло время (idx_broadcasts_due)."""
+    db = await get_db()
+    async with db.execute(
+        "SELECT * FROM broadcasts WHERE status='scheduled' AND COALESCE(scheduled_for, 0) <= ?"
+        " ORDER BY scheduled_for, id",
+        (now,),
+    ) as cur:
+        return _dict_rows(cur, await cur.fetchall())
+
+
+async def pending_broadcasts(limit: int = 10) -> List[Dict[str, Any]]:
+    """Ещё не завершённые рассылки (для админки): идущие и запланированные."""
+    db = await get_db()
+    async with db.execute(
+        "SELECT id, status, text, scheduled_for, quiet_hours, max_rate, total, sent FROM broadcasts"
+        " WHERE status IN ('running', 'scheduled') ORDER BY scheduled_for, id LIMIT ?",
+        (limit,),
+    ) as cur:
+        return _dict_rows(cur, await cur.fetchall())
+
+
+async def reschedule_broadcast(broadcast_id: int, scheduled_for: int) -> None:
+    """Вернуть рассылку в очередь планировщика (пауза на тихие часы)."""
+    db = await get_db()
+    await db.execute(
+        "UPDATE broadcasts SET status='scheduled', scheduled_for=? WHERE id=?",
+        (scheduled_for, broadcast_id),
+    )
+    await db.commit()
+
+
+async def requeue_interrupted_broadcasts() -> int:
+    """
+    При старте: рассылки, оставшиеся в 'running' (бот остановили или он упал),
+    возвращаем в очередь — продолжатся с cursor_*. Вернёт их число.
+    """
+    db = await get_db()
+    cur = await db.execute("UPDATE broadcasts SET status='scheduled' WHERE status='running'")
+    await db.commit()
+    return cur.rowcount
+
+
+async def cancel_broadcast(broadcast_id: int, ts: int) -> bool:
+    db = await get_db()
+    cur = await db.execute(
+        "UPDATE broadcasts SET status='cancelled', finished_at=?"
+        " WHERE id=? AND status IN ('draft', 'scheduled', 'running')",
+        (ts, broadcast_id),
+    )
+    await db.commit()
+    return cur.rowcount > 0
+
+
+# ===== Ref codes =====
+
+async def top_ref_codes(
+    metric: str = "users",
+    limit: int = 10,
+    *,
+    conn: Optional[aiosqlite.Connection] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Топ-N ref_code по метрике из ref_counters (см. SCHEMA_SQL) со всеми их счётчиками:
+    [{"ref_code": "abc", "users": 120, "uniq:ftd": 14, "lang:ru": 80, ...}, ...]
+    """
+    db = conn or await get_db()
+    async with db.execute(
+        "SELECT ref_code FROM ref_counters WHERE metric=? AND n > 0 ORDER BY n DESC LIMIT ?",
+        (metric, limit),
+    ) as cur:
+        codes = [r[0] for r in await cur.fetchall()]
+    if not codes:
+        return []
+    marks = ", ".join("?" * len(codes))
+    rows: Dict[str, Dict[str, Any]] = {code: {"ref_code": code} for code in codes}
+    async with db.execute(
+        f"SELECT ref_code, metric, n FROM ref_counters WHERE ref_code IN ({marks})", codes,
+    ) as cur:
+        async for code, m, n in cur:
+            rows[code][m] = n
+    return [rows[code] for code in codes]
+
+
+# ===== Segments (WHERE из app/services/segments.py) =====
+
+async def count_segment(where: str, params: Sequence[Any], *, conn: Optional[aiosqlite.Connection] = None) -> int:
+    """Размер аудитории для превью — COUNT по индексам, без чтения строк users."""
+    db = conn or await get_db()
+    async with db.execute(f"SELECT COUNT(*) FROM users u WHERE {where}", tuple(params)) as cur:
+        (n,) = await cur.fetchone()
+        return int(n)
+
+
+async def iter_segment_user_ids(
+    where: str,
+    params: Sequence[Any],
+    *,
+    after_user_id: int = 0,
+    batch: int = 500,
+) -> AsyncIterator[List[int]]:
+    """
+    Получатели сегмента пачками по batch, по возрастанию user_id (after_user_id — продолжить с места).
+    Читаем через отдельное read-only соединение: рассылка идёт часами, и держать курсор
+    на общем соединении (через которое пишут хендлеры) нельзя. Каждая пачка — свой запрос
+    с keyset (user_id > последний), дочитанный до конца до yield: открытый на всю рассылку
+    SELECT держал бы снимок WAL, и checkpoint не мог бы его обрезать.
+    """
+    sql = f"SELECT u.user_id FROM users u WHERE {where} AND u.user_id > ? ORDER BY u.user_id LIMIT ?"
+    async with _read_only() as ro:
+        while True:
+            async with ro.execute(sql, (*params, after_user_id, batch)) as cur:
+                rows = await cur.fetchall()
+            if not rows:
+                return
+            after_user_id = rows[-1][0]
+            yield [r[0] for r in rows]
+            if len(rows) < batch:
+                return
+
+
+async def iter_segment_recipients(
+    where: str,
+    params: Sequence[Any],
+    *,
+    after: Tuple[str, int] = ("", 0),
+    batch: int = 500,
+) -> AsyncIterator[List[Tuple[int, str]]]:
+    """
+    Как iter_segment_user_ids, но (user_id, lang) по порядку (lang, user_id):
+    получатели одного языка идут подряд — многоязычная рассылка проходит всех за один раз.
+    after — (lang, user_id), после которого продолжить; пачки — тоже отдельными запросами.
+    """
+    sql = (
+        f"SELECT u.user_id, u.lang FROM users u WHERE {where} AND (u.lang, u.user_id) > (?, ?)"
+        " ORDER BY u.lang, u.user_id LIMIT ?"
+    )
+    async with _read_only() as ro:
+        while True:
+            async with ro.execute(sql, (*params, *after, batch)) as cur:
+                rows = await cur.fetchall()
+            if not rows:
+                return
+            after = (rows[-1][1], rows[-1][0])
+            yield [(r[0], r[1]) for r in rows]
+            if len(rows) < batch:
+                return
+
+
+# ===== Выгрузки =====
+
+# вид выгрузки -> таблица; колонки и фильтры — в app/storage/base.py
+_EXPORT_TABLES = {"users": "users", "profiles": "user_profiles", "postbacks": "postbacks"}
+
+
+async def iter_export_rows(
+    kind: str,
+    *,
+    date_from: Optional[int] = None,
+    date_to: Optional[int] = None,
+    filters: Optional[Dict[str, Sequence[Any]]] = None,
+    batch: int = 1000,
+    conn: Optional[aiosqlite.Connection] = None,
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    """
+    Строки выгрузки (колонки — export_columns(kind)) пачками по batch, по порядку первичного ключа:
+    без сортировки во временной таблице, память не растёт с размером таблицы.
+    date_from включительно, date_to — нет; filters — колонка -> допустимые значения.
+    Читаем через отдельное read-only соединение (или conn — снимок для отчётов): основное
+    (через него пишут хендлеры) не занято, а в WAL долгое чтение не мешает записи.
+    """
+    check_export_filters(kind, filters)
+    table, columns, date_column = _EXPORT_TABLES[kind], export_columns(kind), export_date_column(kind)
+    where: List[str] = []
+    params: List[Any] = []
+    if date_from is not None:
+        where.append(f"{date_column} >= ?")
+        params.append(date_from)
+    if date_to is not None:
+        where.append(f"{date_column} < ?")
+        params.append(date_to)
+    for column, values in (filters or {}).items():
+        where.append(f"{column} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {columns[0]}"
+
+    async with _read_only(conn) as ro:
+        async with ro.execute(sql, params) as cur:
+            while True:
+                rows = await cur.fetchmany(batch)
+                if not rows:
+                    return
+                yield rows
+
+
 # ===== User Profiles ( анкета RTP ) =====
 
 async def upsert_user_profile(
@@ -319,7 +921,6 @@ async def get_user_profile(user_id: int) -> Optional[Dict[str, Any]]:
     Вернёт словарь профиля или None.
     """
     db = await get_db()
-    db.row_factory = aiosqlite.Row
     async with db.execute("SELECT * FROM user_profiles WHERE user_id=?", (user_id,)) as cur:
         row = await cur.fetchone()
-        return dict(row) if row else None
+        return _dict_rows(cur, [row])[0] if row else None
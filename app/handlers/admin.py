@@ -2,28 +2,44 @@
 from __future__ import annotations
 
 import asyncio
+import html
+import time
 from typing import Optional
 
 from aiogram import Router, F
 from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import CallbackQuery, InlineKeyboardButton, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 
 from app.config import get_config, SUPPORTED_LANGS
-from app.db import (
-    get_db,
-    count_users_by_lang,
-    set_blocked,
-    set_links,
-    get_links,
-)
+from app.services.backup import BACKUP, list_backups
+from app.services.broadcaster import SCHEDULER, effective_segment, start_broadcast
+from app.services.exports import parse_export, send_export
+from app.services.maintenance import MAINTENANCE, file_sizes
+from app.services.payloads import BroadcastContent, BroadcastPayload
+from app.services.schedule import BroadcastSchedule, broadcast_tz, format_ts, parse_schedule
+from app.services.segments import Segment, parse_segment
+from app.services.snapshot import describe_as_of
+from app.storage import get_storage
+from app.utils.sql_profiler import PROFILER
+from app.utils.i18n import areload_locales
 
 router = Router()
 
 # --- простейшее состояние для диалогов (без FSM) ---
-_ADMIN_STATE: dict[int, str] = {}  # "await_broadcast_text" | "await_link_support" | "await_link_ref" | "await_link_token"
-_ADMIN_BROADCAST_LANG: dict[int, Optional[str]] = {}
+_ADMIN_STATE: dict[int, str] = {}  # "await_broadcast_text" | "await_broadcast_segment" | "await_broadcast_schedule" | "await_variant_*" | "await_link_*"
+_ADMIN_BROADCAST_SEGMENT: dict[int, Segment] = {}
+_ADMIN_BROADCAST_SCHEDULE: dict[int, BroadcastSchedule] = {}
+
+# многоязычная рассылка: lang -> сообщение, язык для остальных, какой язык сейчас ждём
+_ADMIN_VARIANTS: dict[int, dict[str, BroadcastPayload]] = {}
+_ADMIN_VARIANT_FALLBACK: dict[int, Optional[str]] = {}
+_ADMIN_VARIANT_LANG: dict[int, str] = {}
+
+# части альбома (media_group_id -> сообщения), пока не придут все
+_ALBUM_PARTS: dict[str, list[Message]] = {}
+_ALBUM_WAIT = 1.0  # сек после первой части
+_ALBUM_TASKS: set[asyncio.Task] = set()
 
 
 def _ensure_admin(user_id: int) -> bool:
@@ -32,12 +48,35 @@ def _ensure_admin(user_id: int) -> bool:
 
 # ===== Клавиатуры админки =====
 
+_LANG_FLAGS = {
+    "ru": "🇷🇺", "en": "🇬🇧", "hi": "🇮🇳", "pt": "🇵🇹", "es": "🇪🇸",
+    "ui": "🇺🇦", "tr": "🇹🇷", "in": "🇮🇩", "fr": "🇫🇷", "ozbek": "🇺🇿", "de": "🇩🇪"
+}
+
 def _admin_menu_kb() -> InlineKeyboardBuilder:
     kb = InlineKeyboardBuilder()
     kb.button(text="📣 Рассылка", callback_data="admin:broadcast")
     kb.button(text="📊 Статистика", callback_data="admin:stats")
     kb.button(text="🔗 Ссылки", callback_data="admin:links")
-    kb.adjust(2, 1)
+    kb.button(text="🏷 Рефы", callback_data="admin:refs")
+    kb.adjust(2, 2)
+    return kb
+
+
+# сортировки отчёта по рефам: callback-суффикс -> (метрика ref_counters, подпись)
+_REF_SORTS = {
+    "users": ("users", "регистрациям"),
+    "ftd": ("uniq:ftd", "FTD"),
+    "rtd": ("uniq:rtd", "RTD"),
+}
+
+
+def _refs_kb() -> InlineKeyboardBuilder:
+    kb = InlineKeyboardBuilder()
+    for key, (_, label) in _REF_SORTS.items():
+        kb.button(text=f"↕ по {label}", callback_data=f"admin:refs:{key}")
+    kb.button(text="⬅ Назад", callback_data="admin:back")
+    kb.adjust(3, 1)
     return kb
 
 
@@ -45,13 +84,28 @@ def _broadcast_lang_kb() -> InlineKeyboardBuilder:
     kb = InlineKeyboardBuilder()
     kb.button(text="🌍 Всем языкам", callback_data="admin:broadcast:lang:all")
     for code in SUPPORTED_LANGS:
-        flag = {
-            "ru": "🇷🇺", "en": "🇬🇧", "hi": "🇮🇳", "pt": "🇵🇹", "es": "🇪🇸",
-            "ui": "🇺🇦", "tr": "🇹🇷", "in": "🇮🇩", "fr": "🇫🇷", "ozbek": "🇺🇿", "de": "🇩🇪"
-        }.get(code, "🗂")
+        flag = _LANG_FLAGS.get(code, "🗂")
         kb.button(text=f"{flag} {code}", callback_data=f"admin:broadcast:lang:{code}")
+    kb.button(text="🎯 Сегмент", callback_data="admin:broadcast:segment")
+    kb.button(text="🌐 Разные тексты по языкам", callback_data="admin:bv:open")
+    kb.button(text="⏰ Время и скорость", callback_data="admin:broadcast:schedule")
+    kb.button(text="🗓 Очередь рассылок", callback_data="admin:bq")
     kb.button(text="⬅ Назад", callback_data="admin:back")
-    kb.adjust(2, 3, 3, 3, 1)
+    kb.adjust(2, 3, 3, 3, 1, 1, 1)
+    return kb
+
+
+def _variants_kb(user_id: int) -> InlineKeyboardBuilder:
+    variants = _ADMIN_VARIANTS.get(user_id, {})
+    fallback = _ADMIN_VARIANT_FALLBACK.get(user_id)
+    kb = InlineKeyboardBuilder()
+    for code in SUPPORTED_LANGS:
+        mark = "✅" if code in variants else _LANG_FLAGS.get(code, "🗂")
+        kb.button(text=f"{mark} {code}", callback_data=f"admin:bv:lang:{code}")
+    kb.button(text=f"↩ Fallback: {fallback or 'нет'}", callback_data="admin:bv:fallback")
+    kb.button(text="🚀 Запустить", callback_data="admin:bv:go")
+    kb.button(text="⬅ Назад", callback_data="admin:broadcast")
+    kb.adjust(3, 3, 3, 2, 1, 1, 1)
     return kb
 
 
@@ -73,7 +127,9 @@ async def cmd_admin(msg: Message) -> None:
         await msg.answer("Доступ запрещён.")
         return
     _ADMIN_STATE.pop(msg.from_user.id, None)
-    _ADMIN_BROADCAST_LANG.pop(msg.from_user.id, None)
+    _ADMIN_BROADCAST_SEGMENT.pop(msg.from_user.id, None)
+    for pending in (_ADMIN_BROADCAST_SCHEDULE, _ADMIN_VARIANTS, _ADMIN_VARIANT_FALLBACK, _ADMIN_VARIANT_LANG):
+        pending.pop(msg.from_user.id, None)
 
     await msg.answer(
         "<b>Админка</b>\nВыберите раздел:",
@@ -101,20 +157,26 @@ async def on_admin_stats(cb: CallbackQuery) -> None:
         await cb.answer("Нет доступа", show_alert=True)
         return
 
-    total = await count_users_by_lang(None)
-    lines = [f"👥 Пользователей: <b>{total}</b>"]
-
-    lang_counts = []
-    for code in SUPPORTED_LANGS:
-        n = await count_users_by_lang(code)
-        if n:
-            flag = {
-                "ru": "🇷🇺", "en": "🇬🇧", "hi": "🇮🇳", "pt": "🇵🇹", "es": "🇪🇸",
-                "ui": "🇺🇦", "tr": "🇹🇷", "in": "🇮🇩", "fr": "🇫🇷", "ozbek": "🇺🇿", "de": "🇩🇪"
-            }.get(code, "🏳️")
-            lang_counts.append(f"{flag} <code>{code}</code>: <b>{n}</b>")
-    if lang_counts:
-        lines.append("📌 По языкам:\n" + "\n".join(lang_counts))
+    # снимок для отчётов: COUNT'ы не стоят в очереди основного соединения перед /start
+    async with get_storage().reports() as reports:
+        total = await reports.count_users_by_lang(None)
+        lines = [f"👥 Пользователей: <b>{total}</b>"]
+
+        active = []
+        for label, days in (("24ч", 1), ("7д", 7), ("30д", 30)):
+            n = await reports.count_segment(Segment(seen_from=reports.as_of - days * 86400))
+            active.append(f"{label}: <b>{n}</b>")
+        lines.append("🟢 Активны за " + " · ".join(active))
+
+        lang_counts = []
+        for code in SUPPORTED_LANGS:
+            n = await reports.count_users_by_lang(code)
+            if n:
+                flag = _LANG_FLAGS.get(code, "🏳️")
+                lang_counts.append(f"{flag} <code>{code}</code>: <b>{n}</b>")
+        if lang_counts:
+            lines.append("📌 По языкам:\n" + "\n".join(lang_counts))
+        lines.append(describe_as_of(reports.as_of))
 
     await cb.message.edit_text(
         "📊 <b>Статистика</b>\n\n" + "\n".join(lines),
@@ -123,6 +185,210 @@ async def on_admin_stats(cb: CallbackQuery) -> None:
     await cb.answer()
 
 
+# ===== Рефы =====
+@router.callback_query(F.data.startswith("admin:refs"))
+async def on_admin_refs(cb: CallbackQuery) -> None:
+    """Топ ref_code по регистрациям / FTD / RTD — из ref_counters, без сканов users и postbacks."""
+    if not _ensure_admin(cb.from_user.id):
+        await cb.answer("Нет доступа", show_alert=True)
+        return
+
+    key = cb.data.split(":")[2] if cb.data.count(":") >= 2 else "users"
+    metric, label = _REF_SORTS.get(key, _REF_SORTS["users"])
+    async with get_storage().reports() as reports:
+        top = await reports.top_ref_codes(metric, limit=15)
+
+    lines = []
+    for i, row in enumerate(top, 1):
+        users = row.get("users", 0)
+        ftd = row.get("uniq:ftd", 0)
+        conv = f"{ftd / users * 100:.1f}%" if users else "—"
+        langs = sorted(
+            ((m[5:], n) for m, n in row.items() if m.startswith("lang:") and n > 0),
+            key=lambda x: -x[1],
+        )[:3]
+        code = html.escape(row["ref_code"]) if row["ref_code"] else "без рефа"
+        lines.append(
+            f"<b>{i}.</b> <code>{code}</code> — 👥 {users} · FTD {ftd} ({conv}) · RTD {row.get('uniq:rtd', 0)}"
+            + ("\n    " + ", ".join(f"{lang} {n}" for lang, n in langs) if langs else "")
+        )
+
+    text = (
+        f"🏷 <b>Рефы</b> — топ по {label}\n\n" + ("\n".join(lines) if lines else "Данных пока нет.")
+        + f"\n\n{describe_as_of(reports.as_of)}"
+    )
+    await cb.message.edit_text(text, reply_markup=_refs_kb().as_markup())
+    await cb.answer()
+
+
+# ===== Профиль SQL =====
+@router.message(Command("dbtop"))
+async def cmd_dbtop(msg: Message) -> None:
+    """
+    /dbtop [N] — топ-N SQL по суммарному времени (ожидание очереди + выполнение).
+    /dbtop reset — обнулить статистику.
+    """
+    if not _ensure_admin(msg.from_user.id):
+        return
+
+    arg = (msg.text or "").split(maxsplit=1)[1:] or [""]
+    arg = arg[0].strip()
+    if arg == "reset":
+        PROFILER.reset()
+        await msg.answer("🧹 Статистика SQL сброшена.")
+        return
+    n = int(arg) if arg.isdigit() else 10
+
+    top = PROFILER.top(n)
+    if not top:
+        await msg.answer("Статистики по SQL пока нет.")
+        return
+
+    blocks = []
+    for i, st in enumerate(top, 1):
+        avg_exec = st.exec_total / st.calls * 1000 if st.calls else 0.0
+        avg_wait = st.wait_total / st.calls * 1000 if st.calls else 0.0
+        sql = st.sql if len(st.sql) <= 160 else st.sql[:160] + "…"
+        line = (
+            f"<b>{i}.</b> total <b>{st.total * 1000:.0f} ms</b> · calls {st.calls} · rows {st.rows}\n"
+            f"exec avg {avg_exec:.2f} / max {st.exec_max * 1000:.1f} ms · wait avg {avg_wait:.2f} ms"
+            + (f" · slow {st.slow}" if st.slow else "")
+            + f"\n<code>{html.escape(sql)}</code>"
+        )
+        if st.plan:
+            line += "\n<i>plan:</i> <code>" + html.escape("; ".join(st.plan))[:300] + "</code>"
+        # не режем HTML посередине тега — просто не добавляем то, что не влезает в лимит Telegram
+        if sum(len(b) + 2 for b in blocks) + len(line) > 3800:
+            break
+        blocks.append(line)
+
+    await msg.answer("🐢 <b>SQL по суммарному времени</b>\n\n" + "\n\n".join(blocks))
+
+
+# ===== Локали =====
+@router.message(Command("reload_locales"))
+async def cmd_reload_locales(msg: Message) -> None:
+    """/reload_locales — перечитать app/locales/*.json без рестарта."""
+    if not _ensure_admin(msg.from_user.id):
+        return
+    started = time.perf_counter()
+    version = await areload_locales()
+    await msg.answer(
+        f"🌐 Локали перезагружены: версия <b>{version}</b>, "
+        f"{(time.perf_counter() - started) * 1000:.0f} ms."
+    )
+
+
+# ===== Обслуживание БД =====
+@router.message(Command("dbmaint"))
+async def cmd_dbmaint(msg: Message) -> None:
+    """
+    /dbmaint — checkpoint WAL, optimize, incremental_vacuum прямо сейчас (то же, что фоновая задача).
+    /dbmaint vacuum — полный VACUUM с переводом на auto_vacuum=INCREMENTAL (блокирует БД!).
+    """
+    if not _ensure_admin(msg.from_user.id):
+        return
+
+    arg = (msg.text or "").split(maxsplit=1)[1:] or [""]
+    if arg[0].strip() == "vacuum":
+        await msg.answer("🧹 Полный VACUUM: бот не отвечает, пока он идёт…")
+        db_before, _ = file_sizes()
+        started = time.perf_counter()
+        await MAINTENANCE.vacuum_full()
+        db_after, _ = file_sizes()
+        await msg.answer(
+            f"🧹 VACUUM за {time.perf_counter() - started:.1f} c: "
+            f"{db_before / 1024 / 1024:.1f} → {db_after / 1024 / 1024:.1f} MB. "
+            "Дальше свободные страницы возвращает фоновое обслуживание."
+        )
+        return
+
+    report = await MAINTENANCE.run_once()
+    await msg.answer("🛠 <b>Обслуживание БД</b>\n\n" + report.render())
+
+
+# ===== Бэкап =====
+_BACKUP_TASKS: set[asyncio.Task] = set()
+
+
+async def _backup_and_report(msg: Message) -> None:
+    try:
+        result = await BACKUP.run_once()
+    except Exception as e:
+        await msg.answer(f"⚠️ Бэкап не удался: {html.escape(str(e))}")
+        return
+    await msg.answer("💾 <b>Бэкап готов</b>\n\n" + result.render())
+
+
+@router.message(Command("backup"))
+async def cmd_backup(msg: Message) -> None:
+    """
+    /backup — онлайн-бэкап БД сейчас (то же, что фоновая задача): бот продолжает работать.
+    /backup list — последние копии.
+    """
+    if not _ensure_admin(msg.from_user.id):
+        return
+
+    arg = (msg.text or "").split(maxsplit=1)[1:] or [""]
+    if arg[0].strip() == "list":
+        backups = list_backups()
+        if not backups:
+            await msg.answer("💾 Бэкапов пока нет.")
+            return
+        lines = [
+            f"• <code>{p.name}</code> — {p.stat().st_size / 1024 / 1024:.1f} MB"
+            for p in backups
+        ]
+        await msg.answer("💾 <b>Бэкапы</b> (новые сверху)\n\n" + "\n".join(lines))
+        return
+
+    if BACKUP.running:
+        await msg.answer("💾 Бэкап уже идёт — пришлю итог, когда закончится.")
+    else:
+        await msg.answer("💾 Бэкап начат, бот продолжает работать…")
+    task = asyncio.create_task(_backup_and_report(msg))
+    _BACKUP_TASKS.add(task)
+    task.add_done_callback(_BACKUP_TASKS.discard)
+
+
+# ===== Выгрузки =====
+_EXPORT_TASKS: set[asyncio.Task] = set()
+
+
+@router.message(Command("export"))
+async def cmd_export(msg: Message) -> None:
+    """
+    /export users csv date=30d lang=ru — выгрузка в .gz документом.
+    Собирается в фоне: хендлер (и очередь апдейтов админа) не ждёт.
+    """
+    if not _ensure_admin(msg.from_user.id):
+        return
+
+    arg = (msg.text or "").split(maxsplit=1)[1:]
+    if not arg:
+        await msg.answer(
+            "📤 <b>Выгрузка</b> (gzip)\n\n"
+            "<code>/export users csv date=30d lang=ru,en</code>\n"
+            "<code>/export postbacks ndjson date=2024-01-01..2024-01-31 event=ftd</code>\n"
+            "<code>/export profiles geo=in</code>\n\n"
+            "• что: <code>users</code>, <code>profiles</code>, <code>postbacks</code>; формат: <code>csv</code> (по умолчанию) или <code>ndjson</code>\n"
+            "• <code>date</code> — день, диапазон A..B или <code>30d</code>\n"
+            "• фильтры: users — <code>lang</code>, <code>ref</code>, <code>blocked</code>; "
+            "profiles — <code>geo</code>; postbacks — <code>event</code>, <code>user</code>"
+        )
+        return
+    try:
+        request = parse_export(arg[0])
+    except ValueError as e:
+        await msg.answer(f"⚠️ {html.escape(str(e))}")
+        return
+
+    await msg.answer(f"⏳ Готовлю выгрузку: {html.escape(request.describe())}…")
+    task = asyncio.create_task(send_export(msg.bot, msg.chat.id, request))
+    _EXPORT_TASKS.add(task)
+    task.add_done_callback(_EXPORT_TASKS.discard)
+
+
 # ===== Рассылка =====
 @router.callback_query(F.data == "admin:broadcast")
 async def on_admin_broadcast(cb: CallbackQuery) -> None:
@@ -131,17 +397,28 @@ async def on_admin_broadcast(cb: CallbackQuery) -> None:
         return
 
     _ADMIN_STATE[cb.from_user.id] = "await_broadcast_text"
-    _ADMIN_BROADCAST_LANG[cb.from_user.id] = None
+    _ADMIN_BROADCAST_SEGMENT[cb.from_user.id] = Segment()
+    _ADMIN_BROADCAST_SCHEDULE.pop(cb.from_user.id, None)
 
     await cb.message.edit_text(
         "📣 <b>Рассылка</b>\n\n"
-        "1) Выберите аудиторию по языку или всем.\n"
-        "2) Отправьте текст одним сообщением (HTML поддерживается).\n",
+        "1) Выберите аудиторию по языку, всем или задайте 🎯 сегмент.\n"
+        "2) При необходимости задайте ⏰ время старта, тихие часы и скорость.\n"
+        "3) Отправьте сообщение для рассылки: текст (HTML), фото/видео/документ или альбом.\n",
         reply_markup=_broadcast_lang_kb().as_markup(),
     )
     await cb.answer()
 
 
+async def _segment_preview(segment: Segment) -> str:
+    async with get_storage().reports() as reports:
+        n = await reports.count_segment(segment)
+    return (
+        f"Аудитория: {html.escape(segment.describe())} — <b>{n}</b> получателей\n"
+        f"<i>{describe_as_of(reports.as_of)}</i>"
+    )
+
+
 @router.callback_query(F.data.startswith("admin:broadcast:lang:"))
 async def on_broadcast_pick_lang(cb: CallbackQuery) -> None:
     if not _ensure_admin(cb.from_user.id):
@@ -149,18 +426,97 @@ async def on_broadcast_pick_lang(cb: CallbackQuery) -> None:
         return
 
     lang = cb.data.split(":")[-1]
-    _ADMIN_BROADCAST_LANG[cb.from_user.id] = None if lang == "all" else lang
+    segment = Segment() if lang == "all" else Segment(langs=(lang,))
+    _ADMIN_STATE[cb.from_user.id] = "await_broadcast_text"
+    _ADMIN_BROADCAST_SEGMENT[cb.from_user.id] = segment
 
-    picked = "🌍 всем" if lang == "all" else f"<code>{lang}</code>"
     await cb.message.edit_text(
-        f"📣 <b>Рассылка</b>\nВыбрано: {picked}\n\n"
-        "Теперь пришлите <b>текст рассылки</b> одним сообщением.\n"
+        f"📣 <b>Рассылка</b>\n{await _segment_preview(segment)}\n\n"
+        "Теперь пришлите <b>сообщение для рассылки</b>: текст, медиа или альбом.\n"
         "Отмена — /admin.",
         reply_markup=_broadcast_lang_kb().as_markup(),
     )
     await cb.answer()
 
 
+@router.callback_query(F.data == "admin:broadcast:segment")
+async def on_broadcast_segment(cb: CallbackQuery) -> None:
+    if not _ensure_admin(cb.from_user.id):
+        await cb.answer("Нет доступа", show_alert=True)
+        return
+
+    _ADMIN_STATE[cb.from_user.id] = "await_broadcast_segment"
+    await cb.message.edit_text(
+        "🎯 <b>Сегмент</b>\n\n"
+        "Пришлите фильтр одним сообщением, условия через пробел:\n"
+        "<code>lang=ru,en created=2024-01-01..2024-03-31 ref=abc has=ftd geo=in,br</code>\n\n"
+        "• <code>lang</code> — языки\n"
+        "• <code>created</code> — дата регистрации: день, диапазон A..B или <code>30d</code>\n"
+        "• <code>active</code> / <code>inactive</code> — заходили / не заходили, например <code>7d</code>\n"
+        "• <code>ref</code> — ref-коды\n"
+        "• <code>has</code> — были постбэки (ftd, rtd, …)\n"
+        "• <code>geo</code> — гео из анкеты\n\n"
+        "Отмена — /admin.",
+    )
+    await cb.answer()
+
+
+async def _handle_segment_text(msg: Message) -> None:
+    try:
+        segment = parse_segment(msg.text or "")
+    except ValueError as e:
+        await msg.answer(f"⚠️ {html.escape(str(e))}\nПопробуйте ещё раз или /admin для отмены.")
+        return
+
+    _ADMIN_STATE[msg.from_user.id] = "await_broadcast_text"
+    _ADMIN_BROADCAST_SEGMENT[msg.from_user.id] = segment
+    await msg.answer(
+        f"🎯 {await _segment_preview(segment)}\n\n"
+        "Теперь пришлите <b>сообщение для рассылки</b>: текст, медиа или альбом.\n"
+        "Отмена — /admin."
+    )
+
+
+@router.callback_query(F.data == "admin:broadcast:schedule")
+async def on_broadcast_schedule(cb: CallbackQuery) -> None:
+    if not _ensure_admin(cb.from_user.id):
+        await cb.answer("Нет доступа", show_alert=True)
+        return
+
+    _ADMIN_STATE[cb.from_user.id] = "await_broadcast_schedule"
+    await cb.message.edit_text(
+        "⏰ <b>Время и скорость</b>\n\n"
+        "Пришлите условия одним сообщением через пробел:\n"
+        "<code>at=2024-05-01T03:00 quiet=23:00-08:00 rate=10</code>\n\n"
+        "• <code>at</code> — старт: дата и время, <code>ЧЧ:ММ</code> или <code>+30m</code> / <code>+2h</code>\n"
+        "• <code>quiet</code> — тихие часы: рассылка встанет на паузу и продолжит после\n"
+        "• <code>rate</code> — не больше N сообщений в секунду\n\n"
+        f"Время — по поясу <code>{html.escape(get_config().broadcast_tz)}</code>. "
+        "<code>-</code> — сбросить. Отмена — /admin.",
+    )
+    await cb.answer()
+
+
+async def _handle_schedule_text(msg: Message) -> None:
+    text = (msg.text or "").strip()
+    try:
+        schedule = BroadcastSchedule() if text == "-" else parse_schedule(text)
+    except ValueError as e:
+        await msg.answer(f"⚠️ {html.escape(str(e))}\nПопробуйте ещё раз или /admin для отмены.")
+        return
+
+    _ADMIN_STATE[msg.from_user.id] = "await_broadcast_text"
+    _ADMIN_BROADCAST_SCHEDULE[msg.from_user.id] = schedule
+    segment = _ADMIN_BROADCAST_SEGMENT.get(msg.from_user.id) or Segment()
+    await msg.answer(
+        f"⏰ {html.escape(schedule.describe())}\n"
+        f"🎯 {await _segment_preview(segment)}\n\n"
+        "Теперь пришлите <b>сообщение для рассылки</b>: текст, медиа или альбом.\n"
+        "Отмена — /admin.",
+        reply_markup=_broadcast_lang_kb().as_markup(),
+    )
+
+
 @router.message(F.text, ~Command("admin"))
 async def on_admin_maybe_broadcast_text(msg: Message) -> None:
     # если это не режим рассылки — обработка ниже для ссылок
@@ -168,50 +524,232 @@ async def on_admin_maybe_broadcast_text(msg: Message) -> None:
         return
 
     state = _ADMIN_STATE.get(msg.from_user.id)
-    if state != "await_broadcast_text":
+    if state == "await_broadcast_segment":
+        await _handle_segment_text(msg)
+        return
+    if state == "await_broadcast_schedule":
+        await _handle_schedule_text(msg)
+        return
+    if state not in _PAYLOAD_STATES:
         # передадим обработку блоку редактирования ссылок
         await _maybe_handle_link_edit(msg, state)
         return
 
-    text = msg.html_text
-    target_lang = _ADMIN_BROADCAST_LANG.get(msg.from_user.id)
+    await _accept_payload(msg, BroadcastPayload.from_message(msg))
 
-    _ADMIN_STATE.pop(msg.from_user.id, None)
-    _ADMIN_BROADCAST_LANG.pop(msg.from_user.id, None)
 
-    # получатели
-    db = await get_db()
-    if target_lang:
-        async with db.execute("SELECT user_id FROM users WHERE blocked=0 AND lang=?", (target_lang,)) as cur:
-            rows = await cur.fetchall()
-    else:
-        async with db.execute("SELECT user_id FROM users WHERE blocked=0") as cur:
-            rows = await cur.fetchall()
+# состояния, в которых ждём сообщение для рассылки
+_PAYLOAD_STATES = frozenset({"await_broadcast_text", "await_variant_message"})
+
+
+def _awaits_broadcast(msg: Message) -> bool:
+    return _ensure_admin(msg.from_user.id) and _ADMIN_STATE.get(msg.from_user.id) in _PAYLOAD_STATES
+
+
+@router.message(F.media_group_id)
+async def on_admin_broadcast_album(msg: Message) -> None:
+    """Альбом приходит отдельными сообщениями с общим media_group_id — собираем их и запускаем одну рассылку."""
+    if not _awaits_broadcast(msg):
+        return
+    parts = _ALBUM_PARTS.setdefault(msg.media_group_id, [])
+    parts.append(msg)
+    if len(parts) == 1:
+        task = asyncio.create_task(_finish_album(msg.media_group_id))
+        _ALBUM_TASKS.add(task)
+        task.add_done_callback(_ALBUM_TASKS.discard)
+
+
+async def _finish_album(media_group_id: str) -> None:
+    await asyncio.sleep(_ALBUM_WAIT)
+    parts = _ALBUM_PARTS.pop(media_group_id, [])
+    if parts:
+        await _accept_payload(parts[0], BroadcastPayload.from_album(parts))
+
+
+@router.message(~F.text)
+async def on_admin_broadcast_media(msg: Message) -> None:
+    """Фото/видео/документ/голосовое и т.п. одним сообщением."""
+    if not _awaits_broadcast(msg):
+        return
+    await _accept_payload(msg, BroadcastPayload.from_message(msg))
 
-    user_ids = [r[0] for r in rows]
-    total = len(user_ids)
+
+async def _accept_payload(msg: Message, payload: BroadcastPayload) -> None:
+    uid = msg.from_user.id
+    if _ADMIN_STATE.get(uid) == "await_variant_message":
+        lang = _ADMIN_VARIANT_LANG.pop(uid)
+        _ADMIN_VARIANTS.setdefault(uid, {})[lang] = payload
+        _ADMIN_STATE[uid] = "await_variant_pick"
+        await msg.answer(_variants_text(uid), reply_markup=_variants_kb(uid).as_markup())
+        return
+    await _launch_broadcast(msg, BroadcastContent.single(payload))
+
+
+async def _launch_broadcast(msg: Message, content: BroadcastContent, *, author_id: Optional[int] = None) -> None:
+    author_id = author_id or msg.from_user.id
+    segment = _ADMIN_BROADCAST_SEGMENT.get(author_id) or Segment()
+
+    schedule = _ADMIN_BROADCAST_SCHEDULE.pop(author_id, None) or BroadcastSchedule()
+
+    _ADMIN_STATE.pop(author_id, None)
+    _ADMIN_BROADCAST_SEGMENT.pop(author_id, None)
+
+    target = effective_segment(content, segment)
+    total = 0
+    if target is not None:
+        total = await get_storage().count_segment(target)
     if total == 0:
         await msg.answer("Ни одного получателя не найдено.")
         return
 
-    sent = failed = 0
-    bot = msg.bot
-    for uid in user_ids:
-        try:
-            await bot.send_message(uid, text)
-            sent += 1
-        except (TelegramForbiddenError, TelegramBadRequest):
-            await set_blocked(uid, True)
-            failed += 1
-        except Exception:
-            failed += 1
-        await asyncio.sleep(0.03)
+    # рассылка уходит в фон (или в очередь планировщика): хендлер освобождается сразу,
+    # отчёт придёт автору в личку
+    now = int(time.time())
+    ready_at = schedule.ready_at(now, broadcast_tz())
+    broadcast_id = await start_broadcast(msg.bot, content, segment, author_id=author_id, schedule=schedule)
+    if ready_at > now:
+        await msg.answer(
+            f"🗓 Рассылка #{broadcast_id} запланирована на {format_ts(ready_at)}: ~{total} получателей "
+            f"({html.escape(schedule.describe())}). Отменить — «🗓 Очередь рассылок»."
+        )
+    else:
+        await msg.answer(f"🚀 Рассылка #{broadcast_id} запущена: ~{total} получателей. Пришлю отчёт по завершении.")
 
-    await msg.answer(
-        f"✅ Рассылка завершена.\nВсего: {total}\nУспешно: {sent}\nОшибок: {failed}"
+
+# ===== Рассылка: очередь =====
+
+def _queue_kb(rows: list[dict]) -> InlineKeyboardBuilder:
+    kb = InlineKeyboardBuilder()
+    for row in rows:
+        kb.button(text=f"❌ #{row['id']}", callback_data=f"admin:bq:cancel:{row['id']}")
+    kb.adjust(4)
+    kb.row(
+        InlineKeyboardButton(text="🔄 Обновить", callback_data="admin:bq"),
+        InlineKeyboardButton(text="⬅ Назад", callback_data="admin:broadcast"),
+    )
+    return kb
+
+
+async def _queue_text() -> tuple[str, list[dict]]:
+    rows = await get_storage().pending_broadcasts(limit=12)
+    lines = []
+    for row in rows:
+        if row["status"] == "running":
+            state = f"▶️ идёт: {row['sent']}/{row['total']}"
+        else:
+            state = f"🗓 {format_ts(row['scheduled_for'])}" if row["scheduled_for"] else "🗓 в очереди"
+        extra = ", ".join(
+            x for x in (
+                f"тихие часы {row['quiet_hours']}" if row["quiet_hours"] else "",
+                f"≤ {row['max_rate']:g}/с" if row["max_rate"] else "",
+            ) if x
+        )
+        preview = html.escape((row["text"] or "")[:60])
+        lines.append(f"<b>#{row['id']}</b> {state}" + (f" · {extra}" if extra else "") + f"\n    {preview}")
+    text = "🗓 <b>Очередь рассылок</b>\n\n" + ("\n".join(lines) if lines else "Запланированных и идущих рассылок нет.")
+    return text, rows
+
+
+@router.callback_query(F.data == "admin:bq")
+async def on_broadcast_queue(cb: CallbackQuery) -> None:
+    if not _ensure_admin(cb.from_user.id):
+        await cb.answer("Нет доступа", show_alert=True)
+        return
+    text, rows = await _queue_text()
+    await cb.message.edit_text(text, reply_markup=_queue_kb(rows).as_markup())
+    await cb.answer()
+
+
+@router.callback_query(F.data.startswith("admin:bq:cancel:"))
+async def on_broadcast_cancel(cb: CallbackQuery) -> None:
+    if not _ensure_admin(cb.from_user.id):
+        await cb.answer("Нет доступа", show_alert=True)
+        return
+    broadcast_id = int(cb.data.split(":")[-1])
+    cancelled = await SCHEDULER.cancel(broadcast_id)
+    text, rows = await _queue_text()
+    await cb.message.edit_text(text, reply_markup=_queue_kb(rows).as_markup())
+    await cb.answer(f"Рассылка #{broadcast_id} отменена" if cancelled else "Уже завершена")
+
+
+# ===== Рассылка: варианты по языкам =====
+
+def _variants_text(user_id: int) -> str:
+    variants = _ADMIN_VARIANTS.get(user_id, {})
+    fallback = _ADMIN_VARIANT_FALLBACK.get(user_id)
+    segment = _ADMIN_BROADCAST_SEGMENT.get(user_id) or Segment()
+    return (
+        "🌐 <b>Рассылка по языкам</b>\n"
+        f"Аудитория: {html.escape(segment.describe())}\n"
+        f"Готово вариантов: <b>{len(variants)}</b>"
+        + (f" ({', '.join(variants)})" if variants else "") + "\n"
+        f"Fallback: <b>{fallback or 'нет'}</b> — его получат языки без своего варианта"
+        + ("" if fallback else " (без fallback им ничего не уйдёт)") + ".\n\n"
+        "Нажмите язык и пришлите для него сообщение (текст, медиа или альбом)."
     )
 
 
+@router.callback_query(F.data == "admin:bv:open")
+async def on_variants_open(cb: CallbackQuery) -> None:
+    if not _ensure_admin(cb.from_user.id):
+        await cb.answer("Нет доступа", show_alert=True)
+        return
+    uid = cb.from_user.id
+    _ADMIN_STATE[uid] = "await_variant_pick"
+    _ADMIN_VARIANTS[uid] = {}
+    _ADMIN_VARIANT_FALLBACK[uid] = get_config().default_lang
+    await cb.message.edit_text(_variants_text(uid), reply_markup=_variants_kb(uid).as_markup())
+    await cb.answer()
+
+
+@router.callback_query(F.data.startswith("admin:bv:lang:"))
+async def on_variant_pick_lang(cb: CallbackQuery) -> None:
+    if not _ensure_admin(cb.from_user.id):
+        await cb.answer("Нет доступа", show_alert=True)
+        return
+    lang = cb.data.split(":")[-1]
+    _ADMIN_STATE[cb.from_user.id] = "await_variant_message"
+    _ADMIN_VARIANT_LANG[cb.from_user.id] = lang
+    await cb.message.answer(f"✍️ Пришлите сообщение для <code>{lang}</code>.")
+    await cb.answer()
+
+
+@router.callback_query(F.data == "admin:bv:fallback")
+async def on_variant_fallback(cb: CallbackQuery) -> None:
+    if not _ensure_admin(cb.from_user.id):
+        await cb.answer("Нет доступа", show_alert=True)
+        return
+    uid = cb.from_user.id
+    # по кругу: языки по порядку SUPPORTED_LANGS, затем «нет»
+    options: list[Optional[str]] = [*SUPPORTED_LANGS, None]
+    current = _ADMIN_VARIANT_FALLBACK.get(uid)
+    _ADMIN_VARIANT_FALLBACK[uid] = options[(options.index(current) + 1) % len(options)]
+    await cb.message.edit_text(_variants_text(uid), reply_markup=_variants_kb(uid).as_markup())
+    await cb.answer()
+
+
+@router.callback_query(F.data == "admin:bv:go")
+async def on_variants_go(cb: CallbackQuery) -> None:
+    if not _ensure_admin(cb.from_user.id):
+        await cb.answer("Нет доступа", show_alert=True)
+        return
+    uid = cb.from_user.id
+    variants = _ADMIN_VARIANTS.get(uid) or {}
+    if not variants:
+        await cb.answer("Сначала добавьте хотя бы один вариант", show_alert=True)
+        return
+    fallback = _ADMIN_VARIANT_FALLBACK.get(uid)
+    if fallback and fallback not in variants:
+        await cb.answer(f"Для fallback ({fallback}) нет варианта", show_alert=True)
+        return
+
+    _ADMIN_VARIANTS.pop(uid, None)
+    _ADMIN_VARIANT_FALLBACK.pop(uid, None)
+    _ADMIN_VARIANT_LANG.pop(uid, None)
+    await cb.answer()
+    await _launch_broadcast(cb.message, BroadcastContent(variants, fallback), author_id=uid)
+
+
 # ===== Ссылки (редактирование) =====
 
 @router.callback_query(F.data == "admin:links")
@@ -220,7 +758,7 @@ async def on_admin_links(cb: CallbackQuery) -> None:
         await cb.answer("Нет доступа", show_alert=True)
         return
 
-    links = await get_links()
+    links = await get_storage().get_links()
     await cb.message.edit_text(
         "🔗 <b>Ссылки</b>\n"
         f"• Поддержка: <code>{links['support_url']}</code>\n"
@@ -265,15 +803,15 @@ async def _maybe_handle_link_edit(msg: Message, state: Optional[str]) -> None:
         return
 
     if state == "await_link_support":
-        await set_links(support_url=url)
+        await get_storage().set_links(support_url=url)
     elif state == "await_link_ref":
-        await set_links(ref_url=url)
+        await get_storage().set_links(ref_url=url)
     else:
-        await set_links(onewin_tok_url=url)
+        await get_storage().set_links(onewin_tok_url=url)
 
     _ADMIN_STATE.pop(msg.from_user.id, None)
 
-    links = await get_links()
+    links = await get_storage().get_links()
     await msg.answer(
         "✅ Ссылка обновлена.\n\n"
         "Текущие значения:\n"
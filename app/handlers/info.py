@@ -7,7 +7,7 @@ from aiogram.types import Message
 
 from app.utils.i18n import t
 from app.keyboards import main_menu_keyboard
-from app.db import get_user
+from app.storage import get_storage
 
 router = Router()
 
@@ -15,7 +15,7 @@ router = Router()
 @router.message(Command("info", "Info"))
 async def cmd_info(msg: Message) -> None:
     user_id = msg.from_user.id
-    u = await get_user(user_id)
+    u = await get_storage().get_user(user_id)
     lang = (u or {}).get("lang", "ru")
     ref_code = (u or {}).get("ref_code")
 
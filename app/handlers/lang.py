@@ -9,9 +9,9 @@ from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, FSInputFile
 
 from app.keyboards import lang_keyboard, main_menu_keyboard
-from app.db import set_user_lang, get_user
+from app.storage import get_storage
 from app.utils.i18n import t
-from loguru import logger
+from app.utils.logging import log_sampled
 
 router = Router()
 
@@ -28,13 +28,13 @@ def _find_asset(stem: str) -> Optional[Path]:
 
 @router.message(Command("lang"))
 async def cmd_lang(msg: Message) -> None:
-    u = await get_user(msg.from_user.id)
+    u = await get_storage().get_user(msg.from_user.id)
     lang = (u or {}).get("lang", "ru")
     caption = t("lang.title", lang=lang)
     kb = lang_keyboard()
 
     img = _find_asset("lang_screen")
-    logger.debug("LANG image: {}", img if img else "not found")
+    log_sampled("asset:lang_screen", "LANG image: {}", img if img else "not found")
     if img:
         await msg.answer_photo(FSInputFile(str(img)), caption=caption, reply_markup=kb)
     else:
@@ -45,20 +45,20 @@ async def cmd_lang(msg: Message) -> None:
 async def on_set_lang(cb: CallbackQuery) -> None:
     user_id = cb.from_user.id
     new_lang = cb.data.split(":", 1)[1].strip()
-    await set_user_lang(user_id, new_lang, int(time.time()))
+    await get_storage().set_user_lang(user_id, new_lang, int(time.time()))
 
     try:
         await cb.message.delete()
     except Exception:
         pass
 
-    u = await get_user(user_id)
+    u = await get_storage().get_user(user_id)
     ref_code = u.get("ref_code") if u else None
     kb = await main_menu_keyboard(new_lang, ref_code=ref_code)
     caption = t("start.title", lang=new_lang)
 
     img = _find_asset("menu")
-    logger.debug("MENU image: {}", img if img else "not found")
+    log_sampled("asset:menu", "MENU image: {}", img if img else "not found")
     if img:
         await cb.message.answer_photo(FSInputFile(str(img)), caption=caption, reply_markup=kb)
     else:
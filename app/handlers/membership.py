@@ -0,0 +1,26 @@
+# app/handlers/membership.py
+from __future__ import annotations
+
+from aiogram import F, Router
+from aiogram.enums import ChatType
+from aiogram.filters import IS_MEMBER, IS_NOT_MEMBER, ChatMemberUpdatedFilter
+from aiogram.types import ChatMemberUpdated
+
+from app.services.activity import ACTIVITY
+
+# my_chat_member в личке: пользователь заблокировал бота (kicked) или вернулся.
+# Флаг blocked пишем через write-behind буфер (app/services/activity.py),
+# рассылки пропускают таких пользователей сразу, не дожидаясь сброса в БД.
+
+router = Router()
+router.my_chat_member.filter(F.chat.type == ChatType.PRIVATE)
+
+
+@router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=IS_MEMBER >> IS_NOT_MEMBER))
+async def on_bot_blocked(event: ChatMemberUpdated) -> None:
+    ACTIVITY.mark_blocked(event.from_user.id, True)
+
+
+@router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=IS_NOT_MEMBER >> IS_MEMBER))
+async def on_bot_unblocked(event: ChatMemberUpdated) -> None:
+    ACTIVITY.mark_blocked(event.from_user.id, False)
@@ -8,10 +8,10 @@ from aiogram import Router
 from aiogram.filters import CommandStart
 from aiogram.types import Message, FSInputFile
 
-from app.db import upsert_user, get_user
 from app.keyboards import lang_keyboard, main_menu_keyboard
+from app.storage import get_storage
 from app.utils.i18n import t
-from loguru import logger
+from app.utils.logging import log_sampled
 
 router = Router()
 
@@ -40,11 +40,12 @@ async def cmd_start(msg: Message) -> None:
     ts = int(time.time())
     user_id = msg.from_user.id
     payload_ref = _extract_ref(msg)
+    storage = get_storage()
 
-    existing = await get_user(user_id)
+    existing = await storage.get_user(user_id)
     ref_code_for_upsert = payload_ref if existing is None else None
 
-    await upsert_user(
+    await storage.upsert_user(
         user_id=user_id,
         username=msg.from_user.username,
         first_name=msg.from_user.first_name,
@@ -54,7 +55,7 @@ async def cmd_start(msg: Message) -> None:
         ts=ts,
     )
 
-    u = await get_user(user_id)
+    u = await storage.get_user(user_id)
     lang = (u or {}).get("lang", "ru")
     ref_code = (u or {}).get("ref_code")
     is_first_visit = u and (u["created_at"] == u["updated_at"])
@@ -63,7 +64,7 @@ async def cmd_start(msg: Message) -> None:
         caption = t("lang.title", lang="ru")
         kb = lang_keyboard()
         img = _find_asset("lang_screen")
-        logger.debug("LANG image: {}", img if img else "not found")
+        log_sampled("asset:lang_screen", "LANG image: {}", img if img else "not found")
         if img:
             await msg.answer_photo(FSInputFile(str(img)), caption=caption, reply_markup=kb)
         else:
@@ -73,7 +74,7 @@ async def cmd_start(msg: Message) -> None:
     kb = await main_menu_keyboard(lang, ref_code=ref_code)
     caption = t("start.title", lang=lang)
     img = _find_asset("menu")
-    logger.debug("MENU image: {}", img if img else "not found")
+    log_sampled("asset:menu", "MENU image: {}", img if img else "not found")
     if img:
         await msg.answer_photo(FSInputFile(str(img)), caption=caption, reply_markup=kb)
     else:
@@ -9,17 +9,31 @@ from aiogram.types import (
 )
 
 from app.config import get_config
-from app.utils.i18n import t
-from app.db import get_links
+from app.utils.i18n import t, locale_version
+from app.storage import get_storage
 
 
 # ===== Языки =====
 
+# (версия локалей, клавиатура): клавиатура одинакова для всех, пересобираем только после reload
+_LANG_KB_CACHE: tuple[int, InlineKeyboardMarkup] | None = None
+
+
 def lang_keyboard() -> InlineKeyboardMarkup:
     """
     Клавиатура выбора языка (строгий порядок как в ТЗ).
     Колбэк-данные: set_lang:<code>
     """
+    global _LANG_KB_CACHE
+    version = locale_version()
+    if _LANG_KB_CACHE is not None and _LANG_KB_CACHE[0] == version:
+        return _LANG_KB_CACHE[1]
+    markup = _build_lang_keyboard()
+    _LANG_KB_CACHE = (version, markup)
+    return markup
+
+
+def _build_lang_keyboard() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     row1 = ["ru", "en"]
     row2 = ["hi", "pt", "es"]
@@ -69,7 +83,7 @@ async def main_menu_keyboard(lang: str, *, ref_code: str | None = None) -> Inlin
 
     Ссылки тянем из БД (app_settings) с fallback на .env.
     """
-    links = await get_links()
+    links = await get_storage().get_links()
 
     b = InlineKeyboardBuilder()
 
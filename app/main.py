@@ -1,29 +1,39 @@
 # app/main.py
 from __future__ import annotations
 
+# первым: засекаем время импортов до тяжёлых aiogram/aiohttp
+from app.utils.startup import STARTUP
+
 import asyncio
+from typing import Any, Awaitable
 
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiohttp import web
+from loguru import logger
 
 from app.config import get_config
 from app.utils.logging import setup_logging
 from app.utils import i18n as i18n_utils
-from app.db import get_db
+from app.middlewares.activity import ActivityMiddleware
 from app.middlewares.language import LanguageMiddleware
-
-# handlers
-from app.handlers.start import router as start_router
-from app.handlers.lang import router as lang_router
-from app.handlers.info import router as info_router
-from app.handlers.admin import router as admin_router
-
-# services
-from app.services.postbacks import build_web_app
-from app.services.webapp import setup_webapp_routes
+from app.middlewares.scheduler import setup_update_scheduler
+from app.middlewares.telegram_api import ApiMetricsMiddleware, OutboundGovernorMiddleware
+from app.middlewares.timing import UpdateTimingMiddleware, HandlerNameMiddleware
+from app.services.activity import ACTIVITY
+from app.services.backup import BACKUP
+from app.services.broadcaster import SCHEDULER
+from app.services.channel_notify import CHANNEL_NOTIFIER
+from app.services.maintenance import MAINTENANCE
+from app.services.outbound import GOVERNOR
+from app.services.snapshot import SNAPSHOT
+from app.services.spool import SPOOL
+from app.services.telegram_session import TunedAiohttpSession
+from app.storage import get_storage
+
+STARTUP.mark("imports:core")
 
 
 async def _set_bot_commands(bot: Bot) -> None:
@@ -33,19 +43,63 @@ async def _set_bot_commands(bot: Bot) -> None:
         BotCommand(command="info", description="Информация"),
         BotCommand(command="admin", description="Админка"),
     ]
-    await bot.set_my_commands(commands)
+    try:
+        await bot.set_my_commands(commands)
+    except Exception as e:
+        # меню команд — косметика: старт из-за него не валим
+        logger.warning("set_my_commands не удался: {}", e)
+
+
+async def on_startup(dp: Dispatcher, bot: Bot) -> web.AppRunner:
+    """
+    Параллельный старт:
+      - БД (схема + дефолтные ссылки) и локали (в потоке) стартуют сразу;
+      - пока БД открывается в своём потоке, импортируем и собираем роутеры;
+      - HTTP (/postback) поднимаем, как только готова БД, не дожидаясь Telegram;
+      - set_my_commands идёт в фоне.
+    """
+    db_task = asyncio.create_task(STARTUP.timed("db", get_storage().open()))
+    locales_task = asyncio.create_task(STARTUP.timed("locales", i18n_utils.areload_locales()))
+    commands_task = asyncio.create_task(STARTUP.timed("set_my_commands", _set_bot_commands(bot)))
+    await asyncio.sleep(0)  # даём задачам стартовать до синхронной сборки роутеров
 
+    try:
+        with STARTUP.phase("routers"):
+            _include_routers(dp)
+
+        await db_task
+        runner = await STARTUP.timed("http", _start_http(bot))
+        await locales_task
+    except BaseException:
+        # старт не удался — соседние задачи не бросаем висеть (их ошибки уже не важны)
+        for task in (db_task, locales_task, commands_task):
+            task.cancel()
+        await asyncio.gather(db_task, locales_task, commands_task, return_exceptions=True)
+        raise
+
+    # отчёт не ждёт Telegram: если команды ещё в пути — допишем их отдельным отчётом
+    STARTUP.log()
+    if not commands_task.done():
+        commands_task.add_done_callback(lambda _: STARTUP.log("Старт вместе с set_my_commands"))
+    return runner
+
+
+def _build_dispatcher(*, include_routers: bool = True) -> Dispatcher:
+    dp = Dispatcher()
 
-async def on_startup(dp: Dispatcher, bot: Bot) -> None:
-    setup_logging()
-    _ = get_config()
-    i18n_utils.example_bootstrap()
-    await get_db()
-    await _set_bot_commands(bot)
+    # активность (last_seen_at, счётчик) — в память, в БД пачкой
+    dp.update.outer_middleware(ActivityMiddleware())
 
+    # планировщик апдейтов: общий лимит параллельности + очередь на пользователя
+    setup_update_scheduler(dp, get_config().update_concurrency)
 
-def _build_dispatcher() -> Dispatcher:
-    dp = Dispatcher()
+    # замеры: лаг апдейта и время хендлеров (outer) + имя хендлера (inner)
+    timing_mw = UpdateTimingMiddleware(get_config().handler_budget_ms)
+    name_mw = HandlerNameMiddleware()
+    dp.message.outer_middleware(timing_mw)
+    dp.callback_query.outer_middleware(timing_mw)
+    dp.message.middleware(name_mw)
+    dp.callback_query.middleware(name_mw)
 
     # мидлварь языка
     lang_mw = LanguageMiddleware()
@@ -53,40 +107,116 @@ def _build_dispatcher() -> Dispatcher:
     dp.callback_query.middleware(lang_mw)
 
     # роутеры
-    dp.include_router(start_router)
-    dp.include_router(lang_router)
-    dp.include_router(info_router)
-    dp.include_router(admin_router)
+    if include_routers:
+        _include_routers(dp)
 
     return dp
 
 
-async def main() -> None:
-    cfg = get_config()
-    bot = Bot(
-        token=cfg.bot_token,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
-    )
-    dp = _build_dispatcher()
+def _include_routers(dp: Dispatcher) -> None:
+    # импорт хендлеров — заметная часть старта, поэтому здесь, а не на уровне модуля
+    from app.handlers.start import router as start_router
+    from app.handlers.lang import router as lang_router
+    from app.handlers.info import router as info_router
+    from app.handlers.admin import router as admin_router
+    from app.handlers.membership import router as membership_router
 
-    await on_startup(dp, bot)
+    dp.include_router(start_router)
+    dp.include_router(lang_router)
+    dp.include_router(info_router)
+    dp.include_router(admin_router)
+    dp.include_router(membership_router)
 
+
+async def _start_http(bot: Bot) -> web.AppRunner:
     # === HTTP-сервер: постбэки + мини-апп/статик ===
-    web_app = build_web_app(bot)       # /postback, /health
+    from app.services.postbacks import build_web_app
+    from app.services.webapp import setup_webapp_routes
+
+    web_app = build_web_app(bot)       # /postback, /health, /metrics, /export
     setup_webapp_routes(web_app)       # /app, /api/settings, /static/*
     runner = web.AppRunner(web_app)
     await runner.setup()
     site = web.TCPSite(runner, host="0.0.0.0", port=8080)
     await site.start()
+    return runner
+
+
+async def _shutdown_step(name: str, step: Awaitable[Any]) -> None:
+    """Один шаг остановки: ошибку логируем и идём дальше."""
+    try:
+        await step
+    except asyncio.CancelledError:
+        if not isinstance(step, asyncio.Task):
+            raise
+    except Exception:
+        logger.exception("Остановка: шаг {} упал", name)
+
+
+async def main() -> None:
+    with STARTUP.phase("config+logging"):
+        cfg = get_config()
+        setup_logging()
 
+    bot = Bot(
+        token=cfg.bot_token,
+        session=TunedAiohttpSession(cfg),  # пул, keep-alive и таймауты из TG_HTTP_*
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    if cfg.tg_outbound_governor:
+        # общий бюджет отправок для ответов, уведомлений и рассылок (снаружи метрик)
+        bot.session.middleware(OutboundGovernorMiddleware())
+    bot.session.middleware(ApiMetricsMiddleware())
+    # роутеры подключит on_startup — параллельно с открытием БД
+    dp = _build_dispatcher(include_routers=False)
+
+    runner: web.AppRunner | None = None
+    watcher: asyncio.Task | None = None
     try:
-        # Telegram Polling
+        runner = await on_startup(dp, bot)
+
+        # горячая перезагрузка локалей при изменении файлов
+        if cfg.locales_watch_interval > 0:
+            watcher = asyncio.create_task(i18n_utils.watch_locales(cfg.locales_watch_interval))
+        ACTIVITY.start(cfg.activity_flush_interval)
+        # уведомления о постбэках в канал — одной очередью (HTTP уже принимает и копит их)
+        CHANNEL_NOTIFIER.start(bot, cfg.postback_channel_id)
+        if cfg.postback_spool:
+            # перенос постбэков из спула в БД; первый проход — остаток с прошлого запуска
+            SPOOL.start(cfg.postback_spool_interval)
+        # отложенные и прерванные рестартом рассылки
+        await SCHEDULER.start(bot, cfg.broadcast_poll_interval)
+        if get_storage().name == "sqlite":
+            # checkpoint WAL, статистика планировщика, возврат свободных страниц
+            MAINTENANCE.start(cfg.db_maintenance_interval)
+            # онлайн-бэкап по расписанию
+            BACKUP.start(cfg.backup_interval)
+            # снимок для отчётов админки: тяжёлые запросы не в очереди основного соединения
+            SNAPSHOT.start(cfg.analytics_snapshot_interval)
+
+        # Telegram Polling: каждый апдейт — своя задача, порядок и лимит держит UpdateScheduler
         await dp.start_polling(
             bot,
+            handle_as_tasks=True,
             allowed_updates=dp.resolve_used_update_types(),
         )
     finally:
-        await runner.cleanup()
+        # каждый шаг сам по себе: упавший stop() не должен отменять сброс активности
+        # и закрытие БД после него; не запущенные (старт упал раньше) останавливаются вхолостую
+        if watcher is not None:
+            watcher.cancel()
+            await _shutdown_step("locales watcher", watcher)
+        if runner is not None:
+            await _shutdown_step("http", runner.cleanup())
+        await _shutdown_step("spool", SPOOL.stop())  # после HTTP: новых постбэков нет, спул переносим в БД целиком
+        await _shutdown_step("channel notices", CHANNEL_NOTIFIER.stop())  # досылаем очередь в канал (с лимитом времени)
+        await _shutdown_step("broadcasts", SCHEDULER.stop())  # идущие рассылки сохраняют курсор и продолжат после старта
+        await _shutdown_step("activity", ACTIVITY.stop())  # последний сброс активности — до закрытия БД
+        await _shutdown_step("maintenance", MAINTENANCE.stop())
+        await _shutdown_step("backup", BACKUP.stop())
+        await _shutdown_step("snapshot", SNAPSHOT.stop())
+        await _shutdown_step("outbound", GOVERNOR.stop())
+        await _shutdown_step("storage", get_storage().close())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,31 @@
+# app/middlewares/activity.py
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.services.activity import ACTIVITY, ActivityTracker
+
+
+class ActivityMiddleware(BaseMiddleware):
+    """
+    Outer-мидлварь на dp.update: отмечает активность пользователя в памяти.
+    В БД это попадает пачкой (см. ActivityTracker), а не отдельной записью на апдейт.
+    """
+
+    def __init__(self, tracker: ActivityTracker = ACTIVITY) -> None:
+        self.tracker = tracker
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        # my_chat_member — это смена статуса (блокировка), а не активность
+        if user is not None and not user.is_bot and getattr(event, "my_chat_member", None) is None:
+            self.tracker.touch(user.id)
+        return await handler(event, data)
@@ -0,0 +1,213 @@
+# app/middlewares/admission.py
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+from loguru import logger
+
+from app.config import Config, get_config
+from app.db import db_queue_depth
+from app.services.metrics import HTTP_SHED, REGISTRY
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+# маршруты, которые не ограничиваем (пробы живости и т.п.)
+_EXEMPT_PATHS = frozenset({"/health", "/metrics"})
+
+# сколько IP-бакетов держим в памяти (LRU), чтобы скан с тысяч адресов не съел RAM
+_MAX_IP_BUCKETS = 50_000
+
+
+class TokenBucket:
+    """Классический токен-бакет: rate токенов/сек, не больше capacity."""
+
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: int, now: float) -> None:
+        self.rate = rate
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.stamp = now
+
+    def wait(self, now: float) -> float:
+        """
+        Есть ли токен (не тратя его).
+        Вернёт 0.0, если есть, иначе — сколько секунд ждать до следующего.
+        """
+        elapsed = now - self.stamp
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.stamp = now
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate if self.rate > 0 else 1.0
+
+    def take(self, now: float) -> float:
+        """
+        Пытаемся взять один токен.
+        Вернёт 0.0, если получилось, иначе — сколько секунд ждать до следующего.
+        """
+        wait = self.wait(now)
+        if not wait:
+            self.tokens -= 1.0
+        return wait
+
+
+class LoopLagMonitor:
+    """
+    Фоновая задача: спит interval и меряет, насколько позже проснулась.
+    Разница — текущая задержка event loop (чем больше, тем сильнее он занят).
+    """
+
+    def __init__(self, interval: float = 0.1) -> None:
+        self.interval = interval
+        self.lag_ms = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag_ms = max(0.0, (loop.time() - started - self.interval) * 1000)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class AdmissionControl:
+    """
+    aiohttp-мидлварь контроля нагрузки:
+      - токен-бакет на IP и на маршрут -> 429 + Retry-After
+      - глобальный лимит запросов в обработке -> 503
+      - перегружена очередь БД или event loop -> 503 сразу, без захода в хендлер
+    Отброшенные запросы считаем в метрике http_shed_total{reason, route}.
+    """
+
+    def __init__(self, cfg: Config, lag_monitor: Optional[LoopLagMonitor] = None) -> None:
+        self.cfg = cfg
+        self.lag_monitor = lag_monitor or LoopLagMonitor()
+        self.inflight = 0
+        self.shed_total = 0
+        self._ip_buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._route_buckets: dict[str, TokenBucket] = {}
+
+    # ---------- helpers ----------
+
+    def _client_ip(self, request: web.Request) -> str:
+        if self.cfg.http_trust_proxy:
+            fwd = request.headers.get("X-Forwarded-For")
+            if fwd:
+                return fwd.split(",", 1)[0].strip()
+        return request.remote or "unknown"
+
+    @staticmethod
+    def _route_key(request: web.Request) -> str:
+        resource = request.match_info.route.resource
+        return resource.canonical if resource is not None else "unmatched"
+
+    def _ip_bucket(self, ip: str, now: float) -> TokenBucket:
+        bucket = self._ip_buckets.get(ip)
+        if bucket is None:
+            bucket = TokenBucket(self.cfg.http_ip_rate, self.cfg.http_ip_burst, now)
+            self._ip_buckets[ip] = bucket
+            if len(self._ip_buckets) > _MAX_IP_BUCKETS:
+                self._ip_buckets.popitem(last=False)
+        else:
+            self._ip_buckets.move_to_end(ip)
+        return bucket
+
+    def _route_bucket(self, route: str, now: float) -> TokenBucket:
+        bucket = self._route_buckets.get(route)
+        if bucket is None:
+            bucket = TokenBucket(self.cfg.http_route_rate, self.cfg.http_route_burst, now)
+            self._route_buckets[route] = bucket
+        return bucket
+
+    def _reject(self, status: int, reason: str, route: str, retry_after: float = 1.0) -> web.Response:
+        self.shed_total += 1
+        HTTP_SHED.inc(reason, route)
+        return web.Response(
+            status=status,
+            text="too many requests" if status == 429 else "overloaded",
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+        )
+
+    def _overload_reason(self) -> Optional[str]:
+        if self.inflight >= self.cfg.http_max_inflight:
+            return "inflight"
+        if db_queue_depth() > self.cfg.http_db_queue_budget:
+            return "db_queue"
+        if self.lag_monitor.lag_ms > self.cfg.http_loop_lag_budget_ms:
+            return "loop_lag"
+        return None
+
+    # ---------- middleware ----------
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler: Handler) -> web.StreamResponse:
+        if request.path in _EXEMPT_PATHS:
+            return await handler(request)
+
+        route = self._route_key(request)
+        now = time.monotonic()
+
+        # токены тратим, только если пропускают оба бакета: отказ по маршруту
+        # не должен съедать бюджет клиента (и наоборот)
+        ip_bucket = self._ip_bucket(self._client_ip(request), now)
+        route_bucket = self._route_bucket(route, now)
+        wait = ip_bucket.wait(now)
+        if wait:
+            return self._reject(429, "ip_rate", route, wait)
+        wait = route_bucket.wait(now)
+        if wait:
+            return self._reject(429, "route_rate", route, wait)
+        ip_bucket.take(now)
+        route_bucket.take(now)
+
+        reason = self._overload_reason()
+        if reason is not None:
+            return self._reject(503, reason, route)
+
+        self.inflight += 1
+        try:
+            return await handler(request)
+        finally:
+            self.inflight -= 1
+
+    # ---------- lifecycle ----------
+
+    async def on_startup(self, _: web.Application) -> None:
+        self.lag_monitor.start()
+
+    async def on_cleanup(self, _: web.Application) -> None:
+        await self.lag_monitor.stop()
+        if self.shed_total:
+            logger.info("HTTP admission: отброшено запросов за время работы: {}", self.shed_total)
+
+
+def setup_admission(app: web.Application, cfg: Optional[Config] = None) -> AdmissionControl:
+    """Вешаем контроль нагрузки на aiohttp-приложение (до первых маршрутов)."""
+    admission = AdmissionControl(cfg or get_config())
+    app["admission"] = admission
+    app.middlewares.append(admission.middleware)
+    REGISTRY.gauge("http_inflight_requests", "HTTP requests being processed", fn=lambda: admission.inflight)
+    REGISTRY.gauge("event_loop_lag_ms", "Measured event loop lag", fn=lambda: admission.lag_monitor.lag_ms)
+    REGISTRY.gauge("db_queue_depth", "Operations waiting for the aiosqlite thread", fn=db_queue_depth)
+    app.on_startup.append(admission.on_startup)
+    app.on_cleanup.append(admission.on_cleanup)
+    return admission
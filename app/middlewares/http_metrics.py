@@ -0,0 +1,40 @@
+# app/middlewares/http_metrics.py
+from __future__ import annotations
+
+import time
+from typing import Awaitable, Callable
+
+from aiohttp import web
+
+from app.services.metrics import HTTP_LATENCY, HTTP_REQUESTS
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+def _route_label(request: web.Request) -> str:
+    # шаблон маршрута, а не сырой путь — иначе /static/* раздует кардинальность
+    resource = request.match_info.route.resource
+    return resource.canonical if resource is not None else "unmatched"
+
+
+@web.middleware
+async def http_metrics_middleware(request: web.Request, handler: Handler) -> web.StreamResponse:
+    """Счётчик и гистограмма латентности на каждый маршрут aiohttp-приложения."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        route = _route_label(request)
+        HTTP_REQUESTS.inc(route, request.method, str(status))
+        HTTP_LATENCY.observe(time.perf_counter() - started, route, request.method)
+
+
+def setup_http_metrics(app: web.Application) -> None:
+    """Должна стоять первой в цепочке, чтобы учитывать и отброшенные запросы."""
+    app.middlewares.insert(0, http_metrics_middleware)
@@ -6,7 +6,7 @@ from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 from functools import partial
 
-from app.db import get_user_lang
+from app.storage import get_storage
 from app.utils.i18n import t
 
 
@@ -27,7 +27,7 @@ class LanguageMiddleware(BaseMiddleware):
         from_user = data.get("event_from_user")  # aiogram v3 раскладывает это в data
         lang = "ru"
         if from_user:
-            lang = await get_user_lang(from_user.id)
+            lang = await get_storage().get_user_lang(from_user.id)
         data["user_lang"] = lang
         data["t"] = partial(t, lang=lang)
         return await handler(event, data)
@@ -0,0 +1,118 @@
+# app/middlewares/scheduler.py
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.services.metrics import REGISTRY
+
+UPDATE_QUEUE_WAIT = REGISTRY.histogram(
+    "bot_update_queue_wait_seconds", "Time an update waited for its user lane and a global slot",
+)
+
+
+class _Lane:
+    """Очередь одного пользователя: lock + сколько апдейтов сейчас держат/ждут его."""
+
+    __slots__ = ("lock", "users")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class UpdateScheduler(BaseMiddleware):
+    """
+    Outer-мидлварь на dp.update:
+      - апдейты одного пользователя выполняются строго по очереди (FIFO),
+        разные пользователи — параллельно;
+      - не больше concurrency апдейтов в обработке одновременно.
+    Сначала встаём в очередь пользователя и только потом занимаем глобальный слот —
+    иначе серия нажатий одного пользователя держала бы слоты, ничего не делая.
+    Очереди пользователей живут, пока в них кто-то есть, — память не растёт.
+    """
+
+    def __init__(self, concurrency: int) -> None:
+        self.concurrency = max(1, concurrency)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._lanes: Dict[Hashable, _Lane] = {}
+        self.waiting = 0
+        self.running = 0
+
+    @staticmethod
+    def _lane_key(data: Dict[str, Any]) -> Optional[Hashable]:
+        # event_from_user / event_chat раскладывает встроенный UserContextMiddleware
+        user = data.get("event_from_user")
+        if user is not None:
+            return user.id
+        chat = data.get("event_chat")
+        if chat is not None:
+            return ("chat", chat.id)
+        return None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        key = self._lane_key(data)
+        lane: Optional[_Lane] = None
+        if key is not None:
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = _Lane()
+            lane.users += 1
+
+        self.waiting += 1
+        queued = time.perf_counter()
+        lane_held = False
+        try:
+            if lane is not None:
+                await lane.lock.acquire()
+                lane_held = True
+            await self._slots.acquire()
+        except BaseException:
+            # отмена во время ожидания (остановка поллинга) — аккуратно выходим из очереди
+            if lane_held:
+                lane.lock.release()
+            self.waiting -= 1
+            self._leave(key, lane)
+            raise
+        self.waiting -= 1
+        UPDATE_QUEUE_WAIT.observe(time.perf_counter() - queued)
+
+        self.running += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.running -= 1
+            self._slots.release()
+            if lane is not None:
+                lane.lock.release()
+            self._leave(key, lane)
+
+    def _leave(self, key: Optional[Hashable], lane: Optional[_Lane]) -> None:
+        if lane is None:
+            return
+        lane.users -= 1
+        if lane.users == 0 and self._lanes.get(key) is lane:
+            del self._lanes[key]
+
+    @property
+    def lanes(self) -> int:
+        return len(self._lanes)
+
+
+def setup_update_scheduler(dp: Any, concurrency: int) -> UpdateScheduler:
+    """Вешаем планировщик на dp.update (снаружи всех остальных мидлварей) и его метрики."""
+    scheduler = UpdateScheduler(concurrency)
+    dp.update.outer_middleware(scheduler)
+    REGISTRY.gauge("bot_updates_waiting", "Updates queued behind their user lane or the global cap", fn=lambda: scheduler.waiting)
+    REGISTRY.gauge("bot_updates_running", "Updates being processed right now", fn=lambda: scheduler.running)
+    REGISTRY.gauge("bot_update_lanes", "Users with queued or running updates", fn=lambda: scheduler.lanes)
+    return scheduler
@@ -0,0 +1,96 @@
+# app/middlewares/telegram_api.py
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Any, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import CopyMessages, ForwardMessages, Response, SendMediaGroup, TelegramMethod
+
+from app.config import get_config
+from app.services.metrics import TG_API_CALLS, TG_API_LATENCY
+from app.services.outbound import GOVERNOR, OUTBOUND_PRIORITY, ChatId, OutboundGovernor
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Мидлварь сессии бота: латентность и исходы каждого вызова Bot API.
+    Исход — "ok" или имя класса исключения (TelegramRetryAfter, TelegramForbiddenError, ...).
+    """
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[Any],
+        bot: "Bot",
+        method: TelegramMethod[Any],
+    ) -> Response[Any]:
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            TG_API_CALLS.inc(name, type(e).__name__)
+            raise
+        finally:
+            TG_API_LATENCY.observe(time.perf_counter() - started, name)
+        TG_API_CALLS.inc(name, "ok")
+        return response
+
+
+def _governed_chat(method: TelegramMethod[Any]) -> Optional[ChatId]:
+    """Чат, в который метод отправляет сообщение; None — метод бюджет не тратит."""
+    name = method.__api_method__
+    if name == "sendChatAction":
+        return None
+    if not name.startswith(("send", "copyMessage", "forwardMessage")):
+        return None
+    return getattr(method, "chat_id", None)
+
+
+def _cost(method: TelegramMethod[Any]) -> int:
+    """Сколько сообщений отправит метод: альбом и пачка копий/пересылок — по числу элементов."""
+    if isinstance(method, SendMediaGroup):
+        return len(method.media)
+    if isinstance(method, (CopyMessages, ForwardMessages)):
+        return len(method.message_ids)
+    return 1
+
+
+class OutboundGovernorMiddleware(BaseRequestMiddleware):
+    """
+    Мидлварь сессии бота: каждая отправка сообщения сначала берёт бюджет у общего
+    регулятора (app/services/outbound.py) — по чату и по боту, в порядке важности.
+    На RetryAfter регулятор ставит на паузу всех отправителей, а запрос повторяется
+    после паузы (до TG_RETRY_ATTEMPTS раз, если пауза не дольше TG_RETRY_AFTER_MAX).
+    Регистрируется первой, чтобы ApiMetricsMiddleware видела каждую попытку.
+    """
+
+    def __init__(self, governor: OutboundGovernor = GOVERNOR) -> None:
+        self.governor = governor
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[Any],
+        bot: "Bot",
+        method: TelegramMethod[Any],
+    ) -> Response[Any]:
+        chat_id = _governed_chat(method)
+        if chat_id is None:
+            return await make_request(bot, method)
+        cfg = get_config()
+        priority = OUTBOUND_PRIORITY.get()
+        cost = _cost(method)
+        attempt = 0
+        while True:
+            await self.governor.acquire(chat_id, priority, cost)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.governor.retry_after(chat_id, e.retry_after, priority)
+                if attempt >= cfg.tg_retry_attempts or e.retry_after > cfg.tg_retry_after_max:
+                    raise
+                attempt += 1
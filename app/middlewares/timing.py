@@ -0,0 +1,94 @@
+# app/middlewares/timing.py
+from __future__ import annotations
+
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+from loguru import logger
+
+from app.services.metrics import REGISTRY
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    "bot_handler_duration_seconds", "Update processing time by event type and handler", ("event", "handler"),
+)
+UPDATE_LAG = REGISTRY.histogram(
+    "bot_update_lag_seconds", "Delay between message.date and the start of processing", ("event",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+HANDLER_OVER_BUDGET = REGISTRY.counter(
+    "bot_handler_over_budget_total", "Updates processed slower than the configured budget", ("event", "handler"),
+)
+
+# ключ в data, под которым outer-мидлварь оставляет слот для имени хендлера
+_SLOT_KEY = "_timing_slot"
+
+
+class _HandlerSlot:
+    __slots__ = ("name",)
+
+    def __init__(self) -> None:
+        self.name: Optional[str] = None
+
+
+def _event_kind(event: TelegramObject) -> str:
+    if isinstance(event, Message):
+        return "message"
+    if isinstance(event, CallbackQuery):
+        return "callback_query"
+    return type(event).__name__.lower()
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """
+    Outer-мидлварь для message/callback_query:
+      - лаг между message.date и началом обработки
+      - полное время обработки апдейта с разбивкой по хендлерам
+      - warning в лог, если обработка дольше бюджета
+    Имя сработавшего хендлера подсказывает HandlerNameMiddleware (inner),
+    потому что на уровне outer хендлер ещё не выбран.
+    """
+
+    def __init__(self, budget_ms: int) -> None:
+        self.budget_s = budget_ms / 1000.0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        kind = _event_kind(event)
+        if isinstance(event, Message) and event.date is not None:
+            UPDATE_LAG.observe(max(0.0, time.time() - event.date.timestamp()), kind)
+
+        slot = _HandlerSlot()
+        data[_SLOT_KEY] = slot
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            name = slot.name or "unhandled"
+            HANDLER_LATENCY.observe(elapsed, kind, name)
+            if elapsed > self.budget_s:
+                HANDLER_OVER_BUDGET.inc(kind, name)
+                logger.warning("Медленный хендлер {} ({}): {:.0f} ms", name, kind, elapsed * 1000)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Inner-мидлварь: записывает в слот имя хендлера, который реально обработал апдейт."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        slot = data.get(_SLOT_KEY)
+        handler_obj = data.get("handler")
+        if slot is not None and handler_obj is not None:
+            callback = handler_obj.callback
+            slot.name = f"{callback.__module__.rsplit('.', 1)[-1]}.{getattr(callback, '__name__', 'handler')}"
+        return await handler(event, data)
@@ -0,0 +1,135 @@
+# app/services/activity.py
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Dict, List, Optional, Set
+
+from loguru import logger
+
+from app.services.metrics import REGISTRY
+from app.storage import get_storage
+
+# Write-behind активности пользователей.
+# Мидлварь на каждый апдейт только трогает dict в памяти (last_seen_at + счётчик);
+# туда же попадает смена статуса из my_chat_member (заблокировал/вернулся).
+# В БД это уходит одной транзакцией раз в interval секунд и при остановке.
+# Между сбросами теряется максимум interval секунд активности — для статистики
+# и сегментов «активен за N дней» этого более чем достаточно.
+
+# если в буфере накопилось столько пользователей — сбрасываем, не дожидаясь таймера
+MAX_PENDING = 50_000
+
+ACTIVITY_FLUSHES = REGISTRY.counter("activity_flushes_total", "Batched activity flushes by outcome", ("outcome",))
+ACTIVITY_FLUSH_ROWS = REGISTRY.histogram(
+    "activity_flush_rows", "Users written per activity flush",
+    buckets=(1, 10, 100, 1_000, 10_000, 50_000, 100_000),
+)
+
+
+class ActivityTracker:
+    def __init__(self, max_pending: int = MAX_PENDING) -> None:
+        self.max_pending = max_pending
+        # user_id -> [last_seen_at, interactions]
+        self._pending: Dict[int, List[int]] = {}
+        # user_id -> blocked, ещё не записанные в БД
+        self._blocked_pending: Dict[int, bool] = {}
+        # кто заблокировал бота за время работы процесса: рассылка, уже читающая
+        # снимок БД, не должна слать им и после сброса буфера
+        self._blocked_seen: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    def touch(self, user_id: int, ts: Optional[int] = None) -> None:
+        """Горячий путь: никаких await и I/O."""
+        ts = int(time.time()) if ts is None else ts
+        entry = self._pending.get(user_id)
+        if entry is None:
+            self._pending[user_id] = [ts, 1]
+            if len(self._pending) >= self.max_pending and self._wakeup is not None:
+                self._wakeup.set()
+        else:
+            if ts > entry[0]:
+                entry[0] = ts
+            entry[1] += 1
+
+    def mark_blocked(self, user_id: int, blocked: bool) -> None:
+        """Пользователь заблокировал бота (True) или снова с нами (False)."""
+        self._blocked_pending[user_id] = blocked
+        if blocked:
+            self._blocked_seen.add(user_id)
+        else:
+            self._blocked_seen.discard(user_id)
+
+    def is_blocked(self, user_id: int) -> bool:
+        return user_id in self._blocked_seen
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending) + len(self._blocked_pending)
+
+    async def flush(self) -> int:
+        """Забрать буфер и записать одной транзакцией. Вернёт число пользователей."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending and not self._blocked_pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            statuses, self._blocked_pending = self._blocked_pending, {}
+            rows = [(uid, seen, n) for uid, (seen, n) in batch.items()]
+            try:
+                await get_storage().record_activity(rows, list(statuses.items()))
+            except Exception:
+                # не теряем: возвращаем в буфер, сольётся с новыми касаниями
+                for uid, seen, n in rows:
+                    entry = self._pending.setdefault(uid, [seen, 0])
+                    entry[0] = max(entry[0], seen)
+                    entry[1] += n
+                for uid, blocked in statuses.items():
+                    self._blocked_pending.setdefault(uid, blocked)  # более свежий статус важнее
+                ACTIVITY_FLUSHES.inc("error")
+                raise
+            ACTIVITY_FLUSHES.inc("ok")
+            ACTIVITY_FLUSH_ROWS.observe(len(rows) + len(statuses))
+            return len(rows) + len(statuses)
+
+    async def _run(self, interval: float) -> None:
+        assert self._wakeup is not None
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("Не удалось сбросить активность ({} польз. в буфере): {}", self.pending, e)
+
+    def start(self, interval: float) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self) -> None:
+        """Остановить фоновый сброс и записать остаток (вызывать до закрытия хранилища)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            n = await self.flush()
+            if n:
+                logger.info("Активность: при остановке записано {} польз.", n)
+        except Exception as e:
+            logger.error("Активность при остановке не записана ({} польз.): {}", self.pending, e)
+
+
+ACTIVITY = ActivityTracker()
+
+REGISTRY.gauge("activity_pending_users", "Users with activity not yet written to the DB", fn=lambda: ACTIVITY.pending)
@@ -0,0 +1,219 @@
+# app/services/backup.py
+from __future__ import annotations
+
+import asyncio
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+from loguru import logger
+
+from app.config import get_config
+from app.services.metrics import REGISTRY
+
+# Онлайн-бэкап БД через sqlite3 backup API.
+# Копия снимается на отдельном read-only соединении в потоке: за шаг — BACKUP_PAGES_PER_STEP
+# страниц, между шагами пауза. Всё копирование идёт в одной транзакции чтения: в WAL она
+# писателям не мешает, а копия — согласованный снимок на момент начала (без неё SQLite
+# начинает копию заново после каждой чужой записи и на живой БД может не закончить никогда).
+# Пока идёт бэкап, checkpoint не переносит WAL дальше снимка — WAL подрастёт и обрежется
+# следующим обслуживанием (app/services/maintenance.py).
+# Готовая копия: integrity_check → (gzip) → атомарный rename → ротация старых.
+
+BACKUP_RUNS = REGISTRY.counter("db_backup_runs_total", "SQLite online backups by outcome", ("outcome",))
+BACKUP_SECONDS = REGISTRY.histogram(
+    "db_backup_seconds", "SQLite online backup duration",
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900),
+)
+
+
+@dataclass
+class BackupResult:
+    path: Path
+    size: int               # байт на диске (после gzip, если включён)
+    db_size: int            # байт самой копии БД
+    pages: int
+    steps: int
+    elapsed: float
+
+    def summary(self) -> str:
+        return (
+            f"{self.path.name}: {self.size / 1024 / 1024:.1f} MB за {self.elapsed:.1f} c "
+            f"({self.pages} стр., шагов {self.steps})"
+        )
+
+    def render(self) -> str:
+        """HTML для админки."""
+        lines = [
+            f"Файл: <code>{self.path.name}</code>",
+            f"Размер: <b>{self.size / 1024 / 1024:.1f} MB</b>"
+            + (f" (БД {self.db_size / 1024 / 1024:.1f} MB)" if self.size != self.db_size else ""),
+            f"Время: <b>{self.elapsed:.1f} c</b>",
+            f"Страниц: {self.pages}, шагов: {self.steps}",
+            "integrity_check: ok",
+        ]
+        return "\n".join(lines)
+
+
+def copy_db(src_path: str, dst_path: str, pages: int, pause: float, *, check: bool = True) -> tuple[int, int]:
+    """
+    Согласованная копия src → dst по pages страниц за шаг. Вернёт (страниц, шагов).
+    check — integrity_check копии (полный проход по файлу). Синхронно — для потока.
+    """
+    steps = 0
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal steps
+        steps += 1
+        if pause > 0 and remaining:
+            time.sleep(pause)
+
+    src = sqlite3.connect(f"file:{src_path}?mode=ro", uri=True, isolation_level=None)
+    dst = sqlite3.connect(dst_path)
+    try:
+        # снимок: транзакция чтения открывается первым SELECT и держится до конца копирования
+        src.execute("BEGIN")
+        src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        src.backup(dst, pages=max(1, pages), progress=progress)
+        src.execute("COMMIT")
+        # копия — самостоятельный файл, без -wal/-shm рядом
+        dst.execute("PRAGMA journal_mode = DELETE")
+        if check:
+            problems = [row[0] for row in dst.execute("PRAGMA integrity_check").fetchall()]
+            if problems != ["ok"]:
+                raise RuntimeError("integrity_check копии: " + "; ".join(problems[:5]))
+        page_count = dst.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+    return page_count, steps
+
+
+def _gzip(src: Path, dst: Path) -> None:
+    with open(src, "rb") as fin, gzip.open(dst, "wb", compresslevel=6) as fout:
+        shutil.copyfileobj(fin, fout, 1024 * 1024)
+
+
+def _unlink(path: Path) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def list_backups(directory: Optional[Path] = None) -> List[Path]:
+    """Готовые копии, от новых к старым (в имени — UTC-время, сортировка по имени = по времени)."""
+    cfg = get_config()
+    directory = directory or cfg.backup_dir
+    stem = cfg.db_path.stem
+    if not directory.is_dir():
+        return []
+    files = [p for p in directory.iterdir() if p.name.startswith(f"{stem}-") and p.name.endswith((".db", ".db.gz"))]
+    return sorted(files, key=lambda p: p.name, reverse=True)
+
+
+def rotate(keep: int, directory: Optional[Path] = None) -> List[Path]:
+    """Удалить всё, кроме keep последних копий. Вернёт удалённые."""
+    removed = list_backups(directory)[max(1, keep):]
+    for path in removed:
+        _unlink(path)
+    return removed
+
+
+class DbBackup:
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self.last: Optional[BackupResult] = None
+
+    @property
+    def running(self) -> bool:
+        return self._lock is not None and self._lock.locked()
+
+    async def run_once(self) -> BackupResult:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                result = await self._backup()
+            except Exception:
+                BACKUP_RUNS.inc("error")
+                raise
+            BACKUP_RUNS.inc("ok")
+            BACKUP_SECONDS.observe(result.elapsed)
+            self.last = result
+            return result
+
+    async def _backup(self) -> BackupResult:
+        cfg = get_config()
+        cfg.backup_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        final = cfg.backup_dir / f"{cfg.db_path.stem}-{stamp}.db"
+        tmp = final.with_name(final.name + ".tmp")
+        gz_tmp = final.with_name(final.name + ".gz.tmp")
+
+        started = time.perf_counter()
+        try:
+            pages, steps = await asyncio.to_thread(
+                copy_db, cfg.db_path.as_posix(), tmp.as_posix(),
+                cfg.backup_pages_per_step, cfg.backup_step_pause_ms / 1000,
+            )
+            db_size = tmp.stat().st_size
+            if cfg.backup_compress:
+                await asyncio.to_thread(_gzip, tmp, gz_tmp)
+                final = final.with_name(final.name + ".gz")
+                os.replace(gz_tmp, final)
+                _unlink(tmp)
+            else:
+                os.replace(tmp, final)
+        finally:
+            _unlink(tmp)
+            _unlink(gz_tmp)
+        elapsed = time.perf_counter() - started
+
+        removed = rotate(cfg.backup_keep)
+        if removed:
+            logger.info("Бэкапы: удалены старые копии {}", ", ".join(p.name for p in removed))
+        return BackupResult(
+            path=final, size=final.stat().st_size, db_size=db_size,
+            pages=pages, steps=steps, elapsed=elapsed,
+        )
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                result = await self.run_once()
+                logger.info("Бэкап БД: {}", result.summary())
+            except Exception as e:
+                logger.warning("Бэкап БД не удался: {}", e)
+
+    def start(self, interval: float) -> None:
+        if interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+BACKUP = DbBackup()
+
+
+def _last_backup_ts() -> float:
+    backups = list_backups()
+    return backups[0].stat().st_mtime if backups else 0.0
+
+
+REGISTRY.gauge("db_backup_last_timestamp", "Unix time of the newest backup file", fn=_last_backup_ts)
@@ -1,4 +1,462 @@
-# Заглушка для гибкой рассылки из админки
-async def broadcast(text: str) -> int:
-    # Вернёт число доставок
-    return 0
+# app/services/broadcaster.py
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import aclosing
+from dataclasses import dataclass, field, replace
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from loguru import logger
+
+from app.services.activity import ACTIVITY
+from app.services.metrics import BROADCAST_MESSAGES, BROADCAST_RATE
+from app.services.outbound import BULK, NOTIFY, outbound_priority
+from app.services.payloads import ANY_LANG, BroadcastContent, BroadcastPayload
+from app.services.schedule import BroadcastSchedule, QuietHours, broadcast_tz, format_ts
+from app.services.segments import Segment
+from app.storage import get_storage
+
+# Рассылка идёт фоновой задачей, а не внутри хендлера:
+# иначе она часами держала бы слот планировщика апдейтов и очередь админа.
+# Всё, что нужно для продолжения, лежит в строке broadcasts (контент, сегмент,
+# расписание, счётчики и курсор) — отложенные, поставленные на паузу и
+# прерванные рестартом рассылки подхватывает BroadcastScheduler.
+
+# пауза между сообщениями (~30 msg/s — лимит Telegram на бота); общий бюджет бота
+# с ответами и уведомлениями держит регулятор (app/services/outbound.py), рассылка в нём — bulk
+SEND_INTERVAL = 0.03
+
+# первые N отправок упали одной и той же BadRequest — дело в контенте (удалён исходник,
+# битый file_id, длинная подпись), а не в получателях: рассылку останавливаем
+ABORT_AFTER = 20
+
+# BadRequest, после которых получателя больше нет (остальные — ошибка отправки, не блокировка)
+_RECIPIENT_GONE = ("chat not found",)
+
+
+class BroadcastAborted(Exception):
+    """Рассылка остановлена: Telegram отклоняет сам контент."""
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _ContentGuard:
+    """Считает одинаковые BadRequest подряд с начала прогона; первая удачная отправка его выключает."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.active = True
+        self.error: Optional[str] = None
+        self.count = 0
+
+    def ok(self) -> None:
+        self.active = False
+
+    def bad_request(self, message: str) -> None:
+        if not self.active:
+            return
+        if self.error is not None and message != self.error:
+            self.active = False  # ошибки разные — похоже на проблемы отдельных получателей
+            return
+        self.error = message
+        self.count += 1
+        if self.count >= self.limit:
+            raise BroadcastAborted(message)
+
+
+@dataclass
+class BroadcastResult:
+    broadcast_id: int
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    skipped: int = 0   # заблокировали бота уже после старта рассылки
+    no_variant: int = 0
+    elapsed: float = 0.0
+    by_lang: Dict[str, int] = field(default_factory=dict)   # доставлено по языкам (многоязычная)
+    cursor: Tuple[str, int] = ("", 0)       # последний обработанный (lang, user_id)
+    paused_until: Optional[int] = None      # ушла на паузу (тихие часы) до этого момента
+
+    def report(self) -> str:
+        by_lang = ", ".join(f"{lang} {n}" for lang, n in sorted(self.by_lang.items()))
+        return (
+            f"✅ Рассылка #{self.broadcast_id} завершена.\n"
+            f"Всего: {self.total}\nУспешно: {self.sent}\nОшибок: {self.failed}"
+            + (f"\nПропущено (заблокировали бота): {self.skipped}" if self.skipped else "")
+            + (f"\nПо языкам: {by_lang}" if by_lang else "")
+        )
+
+
+class _Pacer:
+    """
+    Общий бюджет скорости на всю рассылку: не чаще одного сообщения в interval,
+    время самой отправки засчитывается в паузу (а не добавляется к ней).
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._next = 0.0
+
+    async def wait(self) -> None:
+        now = time.monotonic()
+        if self._next > now:
+            await asyncio.sleep(self._next - now)
+            now = self._next
+        self._next = now + self.interval
+
+
+def effective_segment(content: BroadcastContent, segment: Segment) -> Optional[Segment]:
+    """
+    Сегмент с учётом вариантов: без fallback остальные языки слать нечем —
+    и читать их незачем. None — получателей нет.
+    """
+    covered = content.covered_langs()
+    if covered is None:
+        return segment
+    langs = tuple(lang for lang in (segment.langs or covered) if lang in covered)
+    return replace(segment, langs=langs) if langs else None
+
+
+async def _save_progress(result: BroadcastResult) -> None:
+    await get_storage().set_broadcast_counts(
+        result.broadcast_id, total=result.total, sent=result.sent, failed=result.failed, cursor=result.cursor,
+    )
+
+
+async def broadcast(
+    bot: Bot,
+    broadcast_id: int,
+    content: BroadcastContent,
+    segment: Segment,
+    *,
+    schedule: Optional[BroadcastSchedule] = None,
+    resume: Optional[BroadcastResult] = None,
+) -> BroadcastResult:
+    """
+    Отправить content всем получателям сегмента одним проходом по (lang, user_id):
+    каждому — вариант его языка или fallback. Заблокировавших бота помечаем blocked
+    (через write-behind буфер) и больше им не шлём.
+
+    resume — счётчики и курсор прошлого запуска: продолжаем после result.cursor.
+    С наступлением тихих часов рассылка сохраняет курсор, возвращается в очередь
+    (status='scheduled') и заканчивается с paused_until.
+    """
+    schedule = schedule or BroadcastSchedule()
+    result = resume or BroadcastResult(broadcast_id=broadcast_id)
+    started = time.monotonic()
+    pacer = _Pacer(schedule.send_interval(SEND_INTERVAL))
+    guard = _ContentGuard(ABORT_AFTER)
+    tz = broadcast_tz()
+    pause_at = schedule.quiet.next_start(int(time.time()), tz) if schedule.quiet else None
+
+    target = effective_segment(content, segment)
+
+    await get_storage().set_broadcast_status(
+        broadcast_id, "running", started_at=None if resume else int(time.time()),
+    )
+    try:
+        if target is not None:
+            async with aclosing(get_storage().iter_segment_recipients(target, after=result.cursor)) as batches:
+                async for recipients in batches:
+                    for uid, lang in recipients:
+                        if pause_at is not None and time.time() >= pause_at:
+                            result.paused_until = schedule.quiet.next_end(int(time.time()), tz)
+                            break
+                        await _deliver(bot, content, uid, lang, pacer, guard, result)
+                        # учитываем только доведённых до конца: прерванный на отправке получит её после рестарта
+                        result.total += 1
+                        result.cursor = (lang, uid)
+                    # прогресс и курсор в БД — раз в пачку, а не на каждое сообщение:
+                    # после падения процесса повторно уйдёт не больше одной пачки
+                    await _save_progress(result)
+                    if result.paused_until is not None:
+                        break
+    except asyncio.CancelledError:
+        # остановка бота или отмена админом — запоминаем, докуда дошли
+        await _save_progress(result)
+        raise
+    except BroadcastAborted:
+        await _save_progress(result)
+        await get_storage().set_broadcast_status(broadcast_id, "failed", finished_at=int(time.time()))
+        raise
+
+    result.elapsed += time.monotonic() - started
+    if result.paused_until is not None:
+        await get_storage().reschedule_broadcast(broadcast_id, result.paused_until)
+        return result
+    BROADCAST_RATE.set(result.total / max(result.elapsed, 1e-6))
+    await _save_progress(result)
+    await get_storage().set_broadcast_status(broadcast_id, "done", finished_at=int(time.time()))
+    return result
+
+
+async def _deliver(
+    bot: Bot,
+    content: BroadcastContent,
+    uid: int,
+    lang: str,
+    pacer: _Pacer,
+    guard: _ContentGuard,
+    result: BroadcastResult,
+) -> None:
+    if ACTIVITY.is_blocked(uid):
+        # my_chat_member пришёл после того, как мы открыли выборку
+        result.skipped += 1
+        BROADCAST_MESSAGES.inc("skipped")
+        return
+    payload = content.for_lang(lang)
+    if payload is None:
+        result.no_variant += 1
+        return
+    await pacer.wait()
+    try:
+        with outbound_priority(BULK):  # ответы пользователям и уведомления — вперёд рассылки
+            await payload.send(bot, uid)
+        result.sent += 1
+        if content.is_multilang:
+            result.by_lang[lang] = result.by_lang.get(lang, 0) + 1
+        BROADCAST_MESSAGES.inc("sent")
+        guard.ok()
+    except TelegramForbiddenError:
+        ACTIVITY.mark_blocked(uid, True)
+        result.failed += 1
+        BROADCAST_MESSAGES.inc("blocked")
+    except TelegramBadRequest as e:
+        result.failed += 1
+        if any(s in e.message.lower() for s in _RECIPIENT_GONE):
+            ACTIVITY.mark_blocked(uid, True)
+            BROADCAST_MESSAGES.inc("blocked")
+            return
+        # ошибка контента или запроса: получатель ни при чём, blocked не ставим
+        BROADCAST_MESSAGES.inc("bad_request")
+        guard.bad_request(e.message)
+    except Exception:
+        result.failed += 1
+        BROADCAST_MESSAGES.inc("failed")
+
+
+@dataclass
+class BroadcastJob:
+    """Рассылка, готовая к запуску: всё, что восстанавливается из строки broadcasts."""
+
+    broadcast_id: int
+    author_id: int
+    content: BroadcastContent
+    segment: Segment
+    schedule: BroadcastSchedule = field(default_factory=BroadcastSchedule)
+    progress: Optional[BroadcastResult] = None
+
+
+async def load_job(row: Dict[str, Any]) -> Optional[BroadcastJob]:
+    """Строка broadcasts -> BroadcastJob. None — контента нет (рассылка до payload_json)."""
+    raw_variants = await get_storage().get_broadcast_variants(row["id"])
+    if raw_variants:
+        content = BroadcastContent(
+            {lang: BroadcastPayload.from_json(raw) for lang, raw in raw_variants.items()},
+            row["fallback_lang"],
+        )
+    elif row["payload_json"]:
+        content = BroadcastContent.single(BroadcastPayload.from_json(row["payload_json"]))
+    else:
+        return None
+
+    progress = None
+    if row["cursor_user_id"] is not None:
+        progress = BroadcastResult(
+            broadcast_id=row["id"], total=row["total"] or 0, sent=row["sent"] or 0, failed=row["failed"] or 0,
+            cursor=(row["cursor_lang"] or "", row["cursor_user_id"]),
+        )
+    return BroadcastJob(
+        broadcast_id=row["id"],
+        author_id=row["author_id"],
+        content=content,
+        segment=Segment.from_json(row["filter_json"]),
+        schedule=BroadcastSchedule(
+            start_at=row["scheduled_for"],
+            quiet=QuietHours.parse(row["quiet_hours"]) if row["quiet_hours"] else None,
+            max_rate=row["max_rate"],
+        ),
+        progress=progress,
+    )
+
+
+class BroadcastScheduler:
+    """
+    Фоновый цикл по таблице broadcasts: раз в interval секунд запускает рассылки
+    со status='scheduled', у которых подошло scheduled_for. При старте рассылки,
+    оставшиеся в 'running' (рестарт), возвращаются в очередь и продолжаются с курсора.
+    """
+
+    def __init__(self) -> None:
+        self._bot: Optional[Bot] = None
+        self._jobs: Dict[int, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> int:
+        return len(self._jobs)
+
+    def run(
+        self,
+        bot: Bot,
+        job: BroadcastJob,
+        on_done: Optional[Callable[[BroadcastResult], Awaitable[None]]] = None,
+    ) -> None:
+        """Запустить рассылку сейчас (в фоне). on_done по умолчанию — отчёт автору в личку."""
+        task = asyncio.create_task(self._run_job(bot, job, on_done))
+        self._jobs[job.broadcast_id] = task
+        task.add_done_callback(lambda _: self._jobs.pop(job.broadcast_id, None))
+
+    async def _run_job(
+        self,
+        bot: Bot,
+        job: BroadcastJob,
+        on_done: Optional[Callable[[BroadcastResult], Awaitable[None]]],
+    ) -> None:
+        try:
+            result = await broadcast(
+                bot, job.broadcast_id, job.content, job.segment, schedule=job.schedule, resume=job.progress,
+            )
+        except BroadcastAborted as e:
+            logger.warning("Рассылка #{} остановлена: Telegram отклоняет контент ({})", job.broadcast_id, e.reason)
+            text = (
+                f"⛔ Рассылка #{job.broadcast_id} остановлена: первые {ABORT_AFTER} сообщений "
+                f"отклонены Telegram с одной ошибкой:\n{e.reason}\nПроверьте сообщение и запустите заново."
+            )
+            await self._notify_author(bot, job, text)
+            return
+        except Exception:
+            logger.exception("Рассылка #{} упала", job.broadcast_id)
+            await get_storage().set_broadcast_status(job.broadcast_id, "failed", finished_at=int(time.time()))
+            return
+
+        if result.paused_until is not None:
+            logger.info(
+                "Рассылка #{}: тихие часы, пауза до {} ({}/{})",
+                job.broadcast_id, format_ts(result.paused_until), result.sent, result.total,
+            )
+            text = (
+                f"⏸ Рассылка #{job.broadcast_id} на паузе (тихие часы) до {format_ts(result.paused_until)}. "
+                f"Уже отправлено: {result.sent}."
+            )
+        else:
+            logger.info(
+                "Рассылка #{} завершена: {}/{} за {:.0f} c",
+                job.broadcast_id, result.sent, result.total, result.elapsed,
+            )
+            if on_done is not None:
+                await on_done(result)
+                return
+            text = result.report()
+        await self._notify_author(bot, job, text)
+
+    @staticmethod
+    async def _notify_author(bot: Bot, job: BroadcastJob, text: str) -> None:
+        try:
+            with outbound_priority(NOTIFY):
+                await bot.send_message(job.author_id, text)
+        except Exception as e:
+            logger.warning("Отчёт по рассылке #{} не доставлен: {}", job.broadcast_id, e)
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        """Отменить запланированную или идущую рассылку. False — уже завершена/не найдена."""
+        cancelled = await get_storage().cancel_broadcast(broadcast_id, int(time.time()))
+        task = self._jobs.get(broadcast_id)
+        if task is not None:
+            task.cancel()
+        return cancelled
+
+    async def tick(self) -> int:
+        """Запустить подошедшие рассылки. Вернёт число запущенных."""
+        if self._bot is None:
+            return 0
+        now = int(time.time())
+        tz = broadcast_tz()
+        started = 0
+        for row in await get_storage().due_broadcasts(now):
+            if row["id"] in self._jobs:
+                continue
+            job = await load_job(row)
+            if job is None:
+                logger.warning("Рассылка #{}: нет сохранённого сообщения, продолжить нельзя", row["id"])
+                await get_storage().set_broadcast_status(row["id"], "failed", finished_at=now)
+                continue
+            ready_at = job.schedule.ready_at(now, tz)
+            if ready_at > now:
+                # тихие часы: переносим, чтобы не перечитывать её каждый тик
+                await get_storage().reschedule_broadcast(job.broadcast_id, ready_at)
+                continue
+            self.run(self._bot, job)
+            started += 1
+        return started
+
+    async def _loop(self, interval: float) -> None:
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.warning("Планировщик рассылок: {}", e)
+            await asyncio.sleep(interval)
+
+    async def start(self, bot: Bot, interval: float) -> None:
+        self._bot = bot
+        if self._task is None or self._task.done():
+            n = await get_storage().requeue_interrupted_broadcasts()
+            if n:
+                logger.info("Рассылки: {} прерванных вернулись в очередь", n)
+            self._task = asyncio.create_task(self._loop(interval))
+
+    async def stop(self) -> None:
+        """Остановить цикл и идущие рассылки: курсор сохранится, после старта продолжат (вызывать до закрытия хранилища)."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        jobs = list(self._jobs.values())
+        for task in jobs:
+            task.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+
+
+SCHEDULER = BroadcastScheduler()
+
+
+async def start_broadcast(
+    bot: Bot,
+    content: BroadcastContent,
+    segment: Segment,
+    *,
+    author_id: int,
+    schedule: Optional[BroadcastSchedule] = None,
+    on_done: Optional[Callable[[BroadcastResult], Awaitable[None]]] = None,
+) -> int:
+    """
+    Сохранить рассылку (filter_json = сегмент, варианты по языкам, расписание).
+    Если её можно начинать сразу — запускаем в фоне, иначе её запустит SCHEDULER.
+    Вернёт id рассылки; on_done получит итог (по умолчанию — отчёт автору).
+    """
+    schedule = schedule or BroadcastSchedule()
+    now = int(time.time())
+    ready_at = schedule.ready_at(now, broadcast_tz())
+    main = content.variants.get(ANY_LANG) or content.variants.get(content.fallback_lang or "")
+    broadcast_id = await get_storage().create_broadcast(
+        author_id, content.preview(), (main.markup_json if main else None) or "", segment.to_json(), now,
+        payload_json=main.to_json() if main else None,
+        variants=[(lang, p.to_json()) for lang, p in content.variants.items() if lang != ANY_LANG],
+        fallback_lang=content.fallback_lang,
+        status="scheduled" if ready_at > now else "draft",
+        scheduled_for=ready_at,
+        quiet_hours=str(schedule.quiet) if schedule.quiet else None,
+        max_rate=schedule.max_rate,
+    )
+    if ready_at <= now:
+        SCHEDULER.run(bot, BroadcastJob(broadcast_id, author_id, content, segment, schedule), on_done)
+    return broadcast_id
+
+
+def running_broadcasts() -> int:
+    return SCHEDULER.running
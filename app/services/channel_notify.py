@@ -0,0 +1,132 @@
+# app/services/channel_notify.py
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import Deque, List, Optional
+
+from aiogram import Bot
+from loguru import logger
+
+from app.config import get_config
+from app.services.metrics import REGISTRY
+from app.services.outbound import NOTIFY, outbound_priority
+
+# Уведомления о постбэках в канал POSTBACK_CHANNEL_ID.
+# В канал Telegram пускает ~20 сообщений в минуту, постбэки приходят всплесками — поэтому
+# /postback только кладёт текст в очередь (не больше POSTBACK_NOTIFY_QUEUE, лишние
+# отбрасываются с метрикой), а одна фоновая задача шлёт их по очереди, склеивая всё,
+# что накопилось, в одно сообщение (до лимита Telegram на длину). Пока задача ждёт
+# бюджета регулятора (app/services/outbound.py), новые уведомления копятся в следующую пачку.
+# На остановке очередь дошлётся за POSTBACK_NOTIFY_DRAIN сек; что не успело — в лог.
+
+MESSAGE_LIMIT = 4096
+SEPARATOR = "\n\n"
+
+NOTICES = REGISTRY.counter(
+    "postback_channel_notices_total", "Postback channel notices by outcome", ("result",),
+)
+
+
+class ChannelNotifier:
+    def __init__(self) -> None:
+        self._queue: Deque[str] = deque()
+        self._bot: Optional[Bot] = None
+        self._chat_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._sending = 0    # уведомлений в сообщении, которое сейчас отправляется
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue) + self._sending
+
+    def push(self, text: str) -> bool:
+        """Поставить уведомление в очередь; False — очередь полна, уведомление отброшено."""
+        if len(self._queue) >= get_config().postback_notify_queue:
+            NOTICES.inc("dropped")
+            return False
+        self._queue.append(text)
+        NOTICES.inc("queued")
+        if self._wakeup is not None and self._idle is not None:
+            self._idle.clear()
+            self._wakeup.set()
+        return True
+
+    def _take_batch(self) -> List[str]:
+        """Сколько влезет в одно сообщение (минимум одно уведомление)."""
+        batch: List[str] = []
+        size = 0
+        while self._queue:
+            n = len(self._queue[0]) + (len(SEPARATOR) if batch else 0)
+            if batch and size + n > MESSAGE_LIMIT:
+                break
+            batch.append(self._queue.popleft())
+            size += n
+        return batch
+
+    async def _send(self, batch: List[str]) -> None:
+        assert self._bot is not None and self._chat_id is not None
+        self._sending = len(batch)
+        try:
+            with outbound_priority(NOTIFY):
+                await self._bot.send_message(self._chat_id, SEPARATOR.join(batch))
+            NOTICES.inc("sent", amount=len(batch))
+        except Exception as e:
+            NOTICES.inc("failed", amount=len(batch))
+            logger.warning("Постбэки не доставлены в канал ({} шт.): {}", len(batch), e)
+        finally:
+            self._sending = 0
+
+    async def _run(self) -> None:
+        assert self._wakeup is not None and self._idle is not None
+        while True:
+            if not self._queue:
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._send(self._take_batch())
+
+    def start(self, bot: Bot, chat_id: int) -> None:
+        """Запустить отправку; накопленное до старта уйдёт первым сообщением."""
+        self._bot, self._chat_id = bot, chat_id
+        if self._task is None or self._task.done():
+            self._wakeup, self._idle = asyncio.Event(), asyncio.Event()
+            self._wakeup.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Дослать очередь (вызывать после остановки веб-сервера), но не дольше timeout
+        (по умолчанию POSTBACK_NOTIFY_DRAIN сек); недосланное — в лог и метрику.
+        """
+        if self._task is None:
+            return
+        assert self._idle is not None
+        timeout = get_config().postback_notify_drain if timeout is None else timeout
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        lost = self.pending
+        if lost:
+            NOTICES.inc("lost", amount=lost)
+            logger.warning("Остановка: не доставлено в канал уведомлений о постбэках: {}", lost)
+        self._queue.clear()
+        self._sending = 0
+
+
+CHANNEL_NOTIFIER = ChannelNotifier()
+
+REGISTRY.gauge(
+    "postback_channel_notices_pending", "Postback channel notices waiting to be sent",
+    fn=lambda: float(CHANNEL_NOTIFIER.pending),
+)
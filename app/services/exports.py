@@ -0,0 +1,330 @@
+# app/services/exports.py
+from __future__ import annotations
+
+import asyncio
+import csv
+import hmac
+import io
+import json
+import time
+import zlib
+from contextlib import aclosing
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+from aiogram import Bot
+from aiogram.types import FSInputFile
+from aiohttp import web
+from loguru import logger
+
+from app.config import get_config
+from app.services.metrics import REGISTRY
+from app.services.segments import parse_date_range
+from app.services.snapshot import describe_as_of
+from app.storage import EXPORT_KINDS, export_columns, export_filter_columns, get_storage
+
+# Выгрузки users / user_profiles / postbacks в gzip (CSV или NDJSON).
+# Строки идут пачками из отчётного источника хранилища (Storage.reports(); в SQLite — снимок БД,
+# app/services/snapshot.py) и сразу кодируются и сжимаются — в памяти не больше одной пачки,
+# сколько бы строк ни было. На какой момент данные — в подписи документа и в X-Data-As-Of.
+# Кодирование и zlib — в потоке, чтобы event loop бота не ждал компрессии.
+# Отдаём документом в Telegram или потоком по HTTP: GET /export/{kind} (EXPORT_TOKEN).
+
+EXPORT_FORMATS = ("csv", "ndjson")
+EXPORT_BATCH = 1000
+
+# Bot API не принимает документы больше 50 МБ
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024
+
+# синонимы в тексте команды: вид выгрузки и ключи фильтров -> колонка
+_KINDS = {
+    "users": "users", "юзеры": "users",
+    "profiles": "profiles", "profile": "profiles", "анкеты": "profiles",
+    "postbacks": "postbacks", "postback": "postbacks", "постбэки": "postbacks",
+}
+_FILTER_KEYS = {
+    "lang": "lang", "ref": "ref_code", "blocked": "blocked", "geo": "geo",
+    "event": "event_type", "has": "event_type", "user": "user_id",
+}
+_INT_COLUMNS = frozenset({"blocked", "user_id"})
+# обратно: колонка -> ключ фильтра (первый синоним), для ссылки на HTTP-выгрузку
+_FILTER_PARAMS: Dict[str, str] = {}
+for _key, _column in _FILTER_KEYS.items():
+    _FILTER_PARAMS.setdefault(_column, _key)
+
+EXPORT_ROWS = REGISTRY.counter("export_rows_total", "Rows streamed by exports", ("kind",))
+EXPORTS = REGISTRY.counter("exports_total", "Exports by destination and outcome", ("dest", "outcome"))
+
+
+@dataclass(frozen=True)
+class ExportRequest:
+    kind: str                                   # ключ из EXPORT_KINDS
+    fmt: str = "csv"
+    date_from: Optional[int] = None             # unix ts, включительно
+    date_to: Optional[int] = None               # unix ts, не включительно
+    filters: Tuple[Tuple[str, Tuple[Any, ...]], ...] = ()   # (колонка, значения)
+
+    @property
+    def filename(self) -> str:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M")
+        return f"{self.kind}_{stamp}.{self.fmt}.gz"
+
+    def describe(self) -> str:
+        parts = [f"{self.kind}, {self.fmt}"]
+        if self.date_from or self.date_to:
+            day = lambda ts: datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")  # noqa: E731
+            parts.append(
+                f"даты {day(self.date_from) if self.date_from else '…'}"
+                f"–{day(self.date_to - 1) if self.date_to else '…'}"
+            )
+        parts.extend(f"{column} ∈ {', '.join(map(str, values))}" for column, values in self.filters)
+        return "; ".join(parts)
+
+
+def parse_export(text: str, *, now: Optional[int] = None) -> ExportRequest:
+    """
+    Текст из админки:
+        users csv date=30d lang=ru,en
+        postbacks ndjson date=2024-01-01..2024-01-31 event=ftd
+        profiles geo=in
+    Вид (users / profiles / postbacks) и формат (csv / ndjson) — словами в любом порядке,
+    date — как created в сегментах. Фильтры: users — lang, ref, blocked; profiles — geo;
+    postbacks — event, user. Ошибки — ValueError с понятным текстом.
+    """
+    now = int(time.time()) if now is None else now
+    kind: Optional[str] = None
+    fmt = "csv"
+    date_from = date_to = None
+    filters: List[Tuple[str, Tuple[Any, ...]]] = []
+    pending: List[Tuple[str, str, Tuple[str, ...]]] = []
+    for token in text.replace(";", " ").split():
+        if "=" not in token:
+            word = token.strip().lower()
+            if word in _KINDS:
+                kind = _KINDS[word]
+            elif word in EXPORT_FORMATS:
+                fmt = word
+            else:
+                raise ValueError(f"не понял: {token} (ожидается {', '.join(EXPORT_KINDS)} или {', '.join(EXPORT_FORMATS)})")
+            continue
+        key, value = (x.strip() for x in token.split("=", 1))
+        key = key.lower()
+        values = tuple(v for v in (x.strip() for x in value.split(",")) if v)
+        if not values:
+            raise ValueError(f"пустое значение: {key}")
+        if key in ("date", "created", "дата"):
+            date_from, date_to = parse_date_range(values[0], now)
+        elif key in ("format", "fmt"):
+            if values[0].lower() not in EXPORT_FORMATS:
+                raise ValueError(f"формат — {' или '.join(EXPORT_FORMATS)}: {values[0]}")
+            fmt = values[0].lower()
+        elif key in _FILTER_KEYS:
+            pending.append((key, _FILTER_KEYS[key], values))
+        else:
+            raise ValueError(f"неизвестный ключ: {key}")
+
+    if kind is None:
+        raise ValueError(f"укажите, что выгружать: {', '.join(EXPORT_KINDS)}")
+    allowed = export_filter_columns(kind)
+    for key, column, values in pending:
+        if column not in allowed:
+            raise ValueError(f"фильтр {key} для {kind} не поддерживается")
+        if column in _INT_COLUMNS:
+            if not all(v.lstrip("-").isdigit() for v in values):
+                raise ValueError(f"{key} — целые числа: {','.join(values)}")
+            values = tuple(int(v) for v in values)
+        filters.append((column, values))
+    return ExportRequest(kind, fmt, date_from, date_to, tuple(filters))
+
+
+def parse_export_query(kind: str, query: Mapping[str, str], *, now: Optional[int] = None) -> ExportRequest:
+    """HTTP: /export/{kind}?format=ndjson&date=30d&lang=ru — те же ключи, что в parse_export."""
+    tokens = [kind] + [f"{k}={v}" for k, v in query.items() if k != "token"]
+    return parse_export(" ".join(tokens), now=now)
+
+
+# ---------- кодирование ----------
+
+def _encoder(columns: Sequence[str], fmt: str) -> Tuple[bytes, Callable[[List[Tuple[Any, ...]]], bytes]]:
+    """(заголовок, функция пачка строк -> байты) для формата."""
+    if fmt == "ndjson":
+        def encode(rows: List[Tuple[Any, ...]]) -> bytes:
+            return "".join(
+                json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows
+            ).encode("utf-8")
+        return b"", encode
+
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+
+    def encode(rows: List[Tuple[Any, ...]]) -> bytes:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(rows)
+        return buf.getvalue().encode("utf-8")
+
+    # BOM — чтобы Excel открыл UTF-8 без танцев с импортом
+    return b"\xef\xbb\xbf" + encode([tuple(columns)]), encode
+
+
+class ExportStream:
+    """
+    gzip-поток выгрузки: `async with aclosing(stream.chunks()) as chunks: async for chunk in chunks`.
+    После окончания rows — сколько строк ушло, size — сколько сжатых байт;
+    as_of — на какой момент данные (известен с первого чанка).
+    """
+
+    def __init__(self, request: ExportRequest, *, batch: int = EXPORT_BATCH) -> None:
+        self.request = request
+        self.batch = batch
+        self.rows = 0
+        self.size = 0
+        self.as_of: Optional[int] = None
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        req = self.request
+        gz = zlib.compressobj(6, zlib.DEFLATED, 31)   # wbits=31 — формат gzip
+        header, encode = _encoder(export_columns(req.kind), req.fmt)
+
+        def pack(rows: List[Tuple[Any, ...]]) -> bytes:
+            return gz.compress(encode(rows))
+
+        chunk = gz.compress(header)
+        # отчётный снимок (SQLite): выгрузка на минуты не отнимает основное соединение
+        async with get_storage().reports() as reports:
+            self.as_of = reports.as_of
+            batches = reports.iter_export_rows(
+                req.kind, date_from=req.date_from, date_to=req.date_to, filters=dict(req.filters), batch=self.batch,
+            )
+            # aclosing: если клиент оборвал загрузку, курсор закрывается сразу
+            async with aclosing(batches):
+                async for rows in batches:
+                    chunk += await asyncio.to_thread(pack, rows)
+                    self.rows += len(rows)
+                    EXPORT_ROWS.inc(req.kind, amount=len(rows))
+                    if chunk:
+                        self.size += len(chunk)
+                        yield chunk
+                        chunk = b""
+        chunk += gz.flush()
+        self.size += len(chunk)
+        yield chunk
+
+
+# ---------- доставка ----------
+
+async def export_to_file(request: ExportRequest, directory: Path) -> Tuple[Path, ExportStream]:
+    """Записать выгрузку в directory/<filename>; при ошибке или отмене недописанный файл удаляется."""
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / request.filename
+    stream = ExportStream(request)
+    try:
+        with open(path, "wb") as f:
+            async with aclosing(stream.chunks()) as chunks:
+                async for chunk in chunks:
+                    await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path, stream
+
+
+def export_url(request: ExportRequest) -> Optional[str]:
+    """Ссылка на HTTP-выгрузку (без токена) или None, если она не настроена."""
+    cfg = get_config()
+    if not cfg.export_token or not cfg.domain:
+        return None
+    query = [f"format={request.fmt}"]
+    if request.date_from is not None or request.date_to is not None:
+        # в ссылке — целые дни (UTC); относительное окно (30d) расширяется до начала первого дня
+        day = lambda ts: datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")  # noqa: E731
+        left = day(request.date_from) if request.date_from is not None else ""
+        right = day(request.date_to - 1) if request.date_to is not None else ""
+        query.append(f"date={left}..{right}")
+    query += [
+        f"{_FILTER_PARAMS[column]}={quote(','.join(map(str, values)), safe=',')}"
+        for column, values in request.filters
+    ]
+    return f"https://{cfg.domain}/export/{request.kind}?" + "&".join(query)
+
+
+async def send_export(bot: Bot, chat_id: int, request: ExportRequest) -> None:
+    """Собрать выгрузку во временный файл рядом с БД и отправить документом."""
+    directory = get_config().db_path.parent / "exports"
+    started = time.perf_counter()
+    path: Optional[Path] = None
+    try:
+        path, stream = await export_to_file(request, directory)
+        if stream.size > TELEGRAM_DOCUMENT_LIMIT:
+            url = export_url(request)
+            await bot.send_message(
+                chat_id,
+                f"⚠️ Выгрузка {stream.size / 1024 / 1024:.0f} МБ — больше лимита Telegram на документ."
+                + (f"\nСкачайте по HTTP: {url} (заголовок Authorization: Bearer EXPORT_TOKEN)" if url else
+                   "\nСузьте выборку (date=…, фильтры) или настройте EXPORT_TOKEN для HTTP-выгрузки."),
+            )
+            EXPORTS.inc("document", "too_large")
+            return
+        await bot.send_document(
+            chat_id,
+            FSInputFile(path, filename=request.filename),
+            caption=(
+                f"📤 {request.describe()}\n{stream.rows} строк за {time.perf_counter() - started:.1f} c\n"
+                + describe_as_of(stream.as_of or int(time.time()))
+            ),
+        )
+        EXPORTS.inc("document", "ok")
+    except Exception as e:
+        EXPORTS.inc("document", "error")
+        logger.exception("Выгрузка {} не удалась", request.describe())
+        await bot.send_message(chat_id, f"⚠️ Выгрузка не удалась: {e}")
+    finally:
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+
+async def export_handler(request: web.Request) -> web.StreamResponse:
+    """
+    GET /export/{kind}?format=csv|ndjson&date=…&<фильтры> — gzip-поток (chunked).
+    Нужен EXPORT_TOKEN: Authorization: Bearer … или ?token=…; без него маршрут выключен.
+    """
+    token = get_config().export_token
+    if not token:
+        raise web.HTTPNotFound()
+    auth = request.headers.get("Authorization", "")
+    given = auth[7:] if auth.startswith("Bearer ") else request.query.get("token", "")
+    if not hmac.compare_digest(given.encode(), token.encode()):
+        return web.Response(status=403, text="forbidden")
+
+    kind = request.match_info["kind"]
+    if kind not in EXPORT_KINDS:
+        raise web.HTTPNotFound()
+    try:
+        req = parse_export_query(kind, request.query)
+    except ValueError as e:
+        return web.Response(status=400, text=str(e))
+
+    resp = web.StreamResponse(headers={
+        "Content-Type": "application/gzip",
+        "Content-Disposition": f'attachment; filename="{req.filename}"',
+    })
+    resp.enable_chunked_encoding()
+    stream = ExportStream(req)
+    try:
+        async with aclosing(stream.chunks()) as chunks:
+            async for chunk in chunks:
+                if not resp.prepared:
+                    # момент данных известен только после первого чанка — заголовки шлём с ним
+                    resp.headers["X-Data-As-Of"] = str(stream.as_of)
+                    await resp.prepare(request)
+                await resp.write(chunk)
+    except (ConnectionResetError, asyncio.CancelledError):
+        EXPORTS.inc("http", "aborted")
+        raise
+    await resp.write_eof()
+    EXPORTS.inc("http", "ok")
+    logger.info("HTTP-выгрузка {}: {} строк, {} байт", req.describe(), stream.rows, stream.size)
+    return resp
@@ -0,0 +1,162 @@
+# app/services/maintenance.py
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+from loguru import logger
+
+from app.config import get_config
+from app.db import db_pragma, incremental_vacuum, optimize, vacuum_full, wal_checkpoint
+from app.services.metrics import REGISTRY
+
+# Обслуживание SQLite в фоне, раз в DB_MAINTENANCE_INTERVAL секунд:
+#   - PRAGMA optimize (и ANALYZE, если статистики ещё нет) — свежая статистика для планировщика;
+#   - incremental_vacuum — отдаёт ОС свободные страницы порциями, без полного VACUUM;
+#   - wal_checkpoint(TRUNCATE) — переносит WAL в БД и обрезает файл -wal
+#     (автоматический checkpoint только переиспользует WAL, но не уменьшает его).
+# Каждый шаг короткий и идёт через общее соединение, между шагами бот работает как обычно.
+
+T = TypeVar("T")
+
+MAINTENANCE_RUNS = REGISTRY.counter("db_maintenance_runs_total", "SQLite maintenance runs by outcome", ("outcome",))
+MAINTENANCE_SECONDS = REGISTRY.histogram(
+    "db_maintenance_step_seconds", "SQLite maintenance step duration", ("step",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def file_sizes() -> Tuple[int, int]:
+    """(размер БД, размер WAL) в байтах."""
+    db_path = get_config().db_path.as_posix()
+    return _size(db_path), _size(db_path + "-wal")
+
+
+def _mb(n: int) -> str:
+    return f"{n / 1024 / 1024:.1f} MB"
+
+
+@dataclass
+class MaintenanceReport:
+    db_before: int = 0
+    wal_before: int = 0
+    db_after: int = 0
+    wal_after: int = 0
+    steps: List[Tuple[str, float, str]] = field(default_factory=list)   # (шаг, секунды, итог)
+
+    @property
+    def elapsed(self) -> float:
+        return sum(sec for _, sec, _ in self.steps)
+
+    def summary(self) -> str:
+        steps = ", ".join(f"{name} {sec * 1000:.0f} ms ({info})" for name, sec, info in self.steps)
+        return (
+            f"БД {_mb(self.db_before)} → {_mb(self.db_after)}, WAL {_mb(self.wal_before)} → {_mb(self.wal_after)}; "
+            f"{steps}"
+        )
+
+    def render(self) -> str:
+        """HTML для админки."""
+        lines = [
+            f"БД: <b>{_mb(self.db_before)}</b> → <b>{_mb(self.db_after)}</b>",
+            f"WAL: <b>{_mb(self.wal_before)}</b> → <b>{_mb(self.wal_after)}</b>",
+        ]
+        lines += [f"• {name}: {sec * 1000:.0f} ms — {info}" for name, sec, info in self.steps]
+        lines.append(f"Итого: {self.elapsed * 1000:.0f} ms")
+        return "\n".join(lines)
+
+
+class DbMaintenance:
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._warned_vacuum = False
+
+    async def _step(self, report: MaintenanceReport, name: str, coro: Awaitable[T], describe: Callable[[T], str]) -> T:
+        started = time.perf_counter()
+        result = await coro
+        elapsed = time.perf_counter() - started
+        MAINTENANCE_SECONDS.observe(elapsed, name)
+        report.steps.append((name, elapsed, describe(result)))
+        return result
+
+    async def run_once(self, vacuum_pages: Optional[int] = None) -> MaintenanceReport:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        vacuum_pages = get_config().db_vacuum_pages if vacuum_pages is None else vacuum_pages
+        async with self._lock:
+            report = MaintenanceReport()
+            report.db_before, report.wal_before = file_sizes()
+            try:
+                await self._step(
+                    report, "optimize", optimize(),
+                    lambda analyzed: "ANALYZE + optimize" if analyzed else "optimize",
+                )
+                if await db_pragma("auto_vacuum") == 2:  # INCREMENTAL
+                    await self._step(
+                        report, "incremental_vacuum", incremental_vacuum(vacuum_pages),
+                        lambda freed: f"освобождено {freed} стр.",
+                    )
+                elif not self._warned_vacuum:
+                    self._warned_vacuum = True
+                    logger.info(
+                        "БД без auto_vacuum=INCREMENTAL: свободные страницы ({}) не возвращаются ОС. "
+                        "Перевести — /dbmaint vacuum (полный VACUUM, блокирует БД).",
+                        await db_pragma("freelist_count"),
+                    )
+                # последним: в WAL попадают и страницы, переписанные vacuum'ом
+                await self._step(
+                    report, "wal_checkpoint", wal_checkpoint("TRUNCATE"),
+                    lambda r: f"не до конца ({r[2]}/{r[1]} стр.) — мешает долгое чтение" if r[0] else "WAL обрезан",
+                )
+            except Exception:
+                MAINTENANCE_RUNS.inc("error")
+                raise
+            report.db_after, report.wal_after = file_sizes()
+            MAINTENANCE_RUNS.inc("ok")
+            return report
+
+    async def vacuum_full(self) -> None:
+        """Полный VACUUM (app/db.py: vacuum_full) — не одновременно с run_once."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await vacuum_full()
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                report = await self.run_once()
+                logger.info("Обслуживание БД за {:.0f} ms: {}", report.elapsed * 1000, report.summary())
+            except Exception as e:
+                logger.warning("Обслуживание БД не удалось: {}", e)
+
+    def start(self, interval: float) -> None:
+        if interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+MAINTENANCE = DbMaintenance()
+
+REGISTRY.gauge("db_file_bytes", "SQLite database file size", fn=lambda: file_sizes()[0])
+REGISTRY.gauge("db_wal_bytes", "SQLite WAL file size", fn=lambda: file_sizes()[1])
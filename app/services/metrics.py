@@ -0,0 +1,260 @@
+# app/services/metrics.py
+from __future__ import annotations
+
+import hmac
+import math
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from app.config import get_config
+
+# Минимальный реестр метрик в стиле Prometheus (без внешних зависимостей).
+# Счётчики/гистограммы живут в памяти процесса, /metrics отдаёт их
+# в текстовом формате exposition 0.0.4.
+
+LabelValues = Tuple[str, ...]
+
+# дефолтные бакеты латентности (секунды): от 1 мс до 10 с
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+
+    def samples(self) -> Iterable[str]:  # pragma: no cover - переопределяется
+        return ()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        # dict-операции атомарны под GIL — отдельный lock не нужен
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def samples(self) -> Iterable[str]:
+        for lv, v in sorted(self._values.items()):
+            yield f"{self.name}{_fmt_labels(self.labels, lv)} {_fmt_value(v)}"
+
+
+class Gauge(_Metric):
+    """
+    Гейдж: либо явные set/inc, либо функция, которую вызываем в момент сбора
+    (удобно для «живых» значений вроде глубины очереди).
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        fn: Optional[Callable[[], float]] = None,
+    ) -> None:
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._fn = fn
+
+    def set(self, value: float, *label_values: str) -> None:
+        self._values[label_values] = value
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1.0) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        self._fn = fn
+
+    def samples(self) -> Iterable[str]:
+        if self._fn is not None:
+            try:
+                yield f"{self.name} {_fmt_value(float(self._fn()))}"
+            except Exception:
+                return
+            return
+        for lv, v in sorted(self._values.items()):
+            yield f"{self.name}{_fmt_labels(self.labels, lv)} {_fmt_value(v)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # на каждый набор лейблов: [счётчики по бакетам (+Inf последним), sum, count]
+        self._series: Dict[LabelValues, list] = {}
+        self._lock = Lock()  # observe() может прилетать из потоков (aiosqlite)
+
+    def observe(self, value: float, *label_values: str) -> None:
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(label_values)
+            if s is None:
+                s = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[label_values] = s
+            s[0][idx] += 1
+            s[1] += value
+            s[2] += 1
+
+    def snapshot(self, *label_values: str) -> Tuple[int, float]:
+        """(count, sum) по набору лейблов — для админских отчётов."""
+        s = self._series.get(label_values)
+        return (s[2], s[1]) if s else (0, 0.0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            series = [(lv, list(s[0]), s[1], s[2]) for lv, s in sorted(self._series.items())]
+        bounds = self.buckets + (math.inf,)
+        for lv, counts, total, count in series:
+            acc = 0
+            for le, n in zip(bounds, counts):
+                acc += n
+                le_label = f'le="{_fmt_value(le)}"'
+                yield f"{self.name}_bucket{_fmt_labels(self.labels, lv, le_label)} {acc}"
+            yield f"{self.name}_sum{_fmt_labels(self.labels, lv)} {_fmt_value(total)}"
+            yield f"{self.name}_count{_fmt_labels(self.labels, lv)} {count}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _get_or_create(self, cls: type, name: str, *args, **kwargs) -> _Metric:
+        m = self._metrics.get(name)
+        if m is None:
+            m = cls(name, *args, **kwargs)
+            self._metrics[name] = m
+        elif not isinstance(m, cls):
+            raise ValueError(f"metric {name} already registered as {m.kind}")
+        return m
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labels)  # type: ignore[return-value]
+
+    def gauge(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        fn: Optional[Callable[[], float]] = None,
+    ) -> Gauge:
+        g = self._get_or_create(Gauge, name, help_text, labels)
+        if fn is not None:
+            g.set_function(fn)  # type: ignore[union-attr]
+        return g  # type: ignore[return-value]
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labels, buckets=buckets)  # type: ignore[return-value]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ===== Общие метрики приложения =====
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status"),
+)
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("route", "method"),
+)
+HTTP_SHED = REGISTRY.counter(
+    "http_shed_total", "HTTP requests rejected by admission control", ("reason", "route"),
+)
+POSTBACKS = REGISTRY.counter(
+    "postbacks_total", "Accepted postbacks by normalized event type", ("event",),
+)
+TG_API_CALLS = REGISTRY.counter(
+    "telegram_api_calls_total", "Bot API calls by method and outcome", ("method", "outcome"),
+)
+TG_API_LATENCY = REGISTRY.histogram(
+    "telegram_api_duration_seconds", "Bot API call latency", ("method",),
+)
+BROADCAST_MESSAGES = REGISTRY.counter(
+    "broadcast_messages_total", "Broadcast deliveries by result", ("result",),
+)
+BROADCAST_RATE = REGISTRY.gauge(
+    "broadcast_last_rate", "Messages per second of the last finished broadcast",
+)
+
+
+# ===== HTTP =====
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """
+    GET /metrics — текстовый формат Prometheus.
+    Если задан METRICS_TOKEN — требуем его в Authorization: Bearer ... или ?token=...
+    """
+    token = get_config().metrics_token
+    if token:
+        auth = request.headers.get("Authorization", "")
+        given = auth[7:] if auth.startswith("Bearer ") else request.query.get("token", "")
+        if not hmac.compare_digest(given.encode(), token.encode()):
+            return web.Response(status=403, text="forbidden")
+    return web.Response(
+        body=REGISTRY.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
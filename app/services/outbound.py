@@ -0,0 +1,200 @@
+# app/services/outbound.py
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from app.config import get_config
+from app.services.metrics import REGISTRY
+
+# Общий регулятор исходящих сообщений бота: ответы хендлеров, уведомления о постбэках
+# и рассылки идут через один бюджет (мидлварь сессии OutboundGovernorMiddleware,
+# app/middlewares/telegram_api.py), а не каждый со своим темпом.
+#   - на чат: личка — TG_CHAT_RATE сообщений/с (всплеск TG_CHAT_BURST),
+#     группы и каналы (chat_id < 0 или @username) — TG_GROUP_PER_MINUTE в минуту;
+#   - на бота: TG_GLOBAL_RATE сообщений/с (всплеск TG_GLOBAL_BURST); когда бюджета
+#     не хватает, первым идёт более важный класс: ответы > уведомления > рассылки;
+#   - RetryAfter (429) от Telegram ставит на паузу всех отправителей, а чат — отдельно.
+# Класс отправки берётся из contextvar: по умолчанию — ответ (interactive),
+# рассылка и уведомления выставляют свой через outbound_priority().
+
+INTERACTIVE, NOTIFY, BULK = 0, 1, 2
+PRIORITY_NAMES = ("interactive", "notify", "bulk")
+
+OUTBOUND_PRIORITY: ContextVar[int] = ContextVar("outbound_priority", default=INTERACTIVE)
+
+# сколько корзин чатов держим; лишние (давно полные) выбрасываем
+MAX_CHATS = 20_000
+
+OUTBOUND_WAIT = REGISTRY.histogram(
+    "telegram_outbound_wait_seconds", "Time a Bot API send waited for the outbound budget", ("priority",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 15, 60),
+)
+OUTBOUND_RETRY_AFTER = REGISTRY.counter(
+    "telegram_retry_after_total", "RetryAfter (429) responses by priority of the send", ("priority",),
+)
+
+ChatId = Union[int, str]
+
+
+@contextmanager
+def outbound_priority(priority: int) -> Iterator[None]:
+    """Все отправки внутри блока (и в задачах, созданных из него) — с этим классом."""
+    token = OUTBOUND_PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        OUTBOUND_PRIORITY.reset(token)
+
+
+def is_group(chat_id: ChatId) -> bool:
+    """Группы, супергруппы и каналы — отрицательные id или @username канала."""
+    return isinstance(chat_id, str) or chat_id < 0
+
+
+class _Bucket:
+    """Token bucket: rate токенов/с, не больше burst. Токены могут уйти в минус — это очередь резерваций."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float, cost: float) -> float:
+        self._refill(now)
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+    def take(self, now: float, cost: float) -> None:
+        self._refill(now)
+        self.tokens -= cost
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class OutboundGovernor:
+    def __init__(self) -> None:
+        self._heap: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._global: Optional[_Bucket] = None
+        self._chats: Dict[ChatId, _Bucket] = {}
+        self._paused_until = 0.0                       # RetryAfter: пауза для всех
+        self._chat_paused: Dict[ChatId, float] = {}    # RetryAfter: пауза для чата
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for *_, fut in self._heap if not fut.done())
+
+    # ---------- бюджет ----------
+
+    def _chat_bucket(self, chat_id: ChatId, now: float) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHATS:
+                self._chats = {k: b for k, b in self._chats.items() if not b.full(now)}
+            cfg = get_config()
+            if is_group(chat_id):
+                bucket = _Bucket(cfg.tg_group_per_minute / 60.0, cfg.tg_group_burst, now)
+            else:
+                bucket = _Bucket(cfg.tg_chat_rate, cfg.tg_chat_burst, now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: ChatId, priority: int = INTERACTIVE, cost: int = 1) -> float:
+        """Дождаться бюджета на отправку cost сообщений в chat_id. Вернёт, сколько ждали (сек)."""
+        started = time.monotonic()
+        now = started
+
+        # чат: резервация по порядку прихода (и пауза после RetryAfter в этом чате);
+        # альбом или пачка копий — один вызов, с чата берём не больше всплеска,
+        # полностью cost списывается только с общего бюджета
+        bucket = self._chat_bucket(chat_id, now)
+        chat_cost = min(cost, bucket.burst)
+        delay = bucket.delay(now, chat_cost)
+        bucket.take(now, chat_cost)
+        paused = self._chat_paused.get(chat_id, 0.0)
+        if paused > now:
+            delay = max(delay, paused - now)
+        elif paused:
+            del self._chat_paused[chat_id]
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        # бот: общая очередь по классу, внутри класса — по порядку прихода
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+        assert self._wakeup is not None
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), float(cost), fut))
+        self._wakeup.set()
+        await fut
+
+        waited = time.monotonic() - started
+        OUTBOUND_WAIT.observe(waited, PRIORITY_NAMES[priority])
+        return waited
+
+    async def _dispatch(self) -> None:
+        assert self._wakeup is not None
+        cfg = get_config()
+        self._global = _Bucket(cfg.tg_global_rate, cfg.tg_global_burst, time.monotonic())
+        while True:
+            while self._heap and self._heap[0][3].done():
+                heapq.heappop(self._heap)  # отправитель ушёл (отмена)
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            cost = min(self._heap[0][2], self._global.burst)
+            wait = self._global.delay(now, cost)
+            if wait > 0:
+                # за время сна может прийти более важный — он и получит бюджет первым
+                await asyncio.sleep(wait)
+                continue
+            self._global.take(now, cost)
+            fut = heapq.heappop(self._heap)[3]
+            fut.set_result(None)
+
+    def retry_after(self, chat_id: ChatId, seconds: float, priority: int = INTERACTIVE) -> None:
+        """Telegram ответил 429: пауза для всех отправителей и для этого чата."""
+        until = time.monotonic() + seconds
+        self._paused_until = max(self._paused_until, until)
+        self._chat_paused[chat_id] = max(self._chat_paused.get(chat_id, 0.0), until)
+        OUTBOUND_RETRY_AFTER.inc(PRIORITY_NAMES[priority])
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for *_, fut in self._heap:
+            if not fut.done():
+                fut.cancel()
+        self._heap.clear()
+
+
+GOVERNOR = OutboundGovernor()
+
+REGISTRY.gauge("telegram_outbound_queued", "Bot API sends waiting for the global budget", fn=lambda: float(GOVERNOR.queued))
@@ -0,0 +1,207 @@
+# app/services/payloads.py
+from __future__ import annotations
+
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import (
+    InlineKeyboardMarkup,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+    Message,
+)
+
+# Содержимое рассылки — исходное сообщение админа (текст, медиа или альбом).
+# Рассылаем через copy_message/copy_messages: Telegram копирует у себя,
+# файл ни разу не перезаливается. Если исходник удалили из чата с админом —
+# переходим на отправку по сохранённым file_id (тоже без загрузки).
+
+# типы медиа, которые переотправляем по file_id: тип -> метод Bot
+_SEND_METHODS = {
+    "photo": "send_photo",
+    "video": "send_video",
+    "animation": "send_animation",
+    "document": "send_document",
+    "audio": "send_audio",
+    "voice": "send_voice",
+    "video_note": "send_video_note",
+    "sticker": "send_sticker",
+}
+
+# что бывает в альбоме
+_INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+}
+
+# без подписи
+_NO_CAPTION = frozenset({"video_note", "sticker"})
+
+# ответы Telegram, после которых copy больше не пробуем
+_COPY_GONE = ("message to copy not found", "message_id_invalid", "message not found")
+
+
+@dataclass
+class MediaItem:
+    kind: str                 # ключ из _SEND_METHODS
+    file_id: str
+    caption: Optional[str] = None   # HTML
+
+
+def _media_of(msg: Message) -> Optional[MediaItem]:
+    caption = msg.html_text if msg.caption else None
+    if msg.photo:
+        return MediaItem("photo", msg.photo[-1].file_id, caption)
+    for kind in ("video", "animation", "document", "audio", "voice", "video_note", "sticker"):
+        obj = getattr(msg, kind, None)
+        if obj is not None:
+            return MediaItem(kind, obj.file_id, None if kind in _NO_CAPTION else caption)
+    return None
+
+
+@dataclass
+class BroadcastPayload:
+    from_chat_id: int
+    message_ids: List[int]
+    text: Optional[str] = None                 # HTML, если это текстовое сообщение
+    media: List[MediaItem] = field(default_factory=list)
+    markup_json: Optional[str] = None          # inline-клавиатура (broadcasts.markup_json)
+    copy_ok: bool = True                       # исходник ещё доступен для copy_message
+
+    # ---------- сбор ----------
+
+    @classmethod
+    def from_message(cls, msg: Message) -> "BroadcastPayload":
+        media = _media_of(msg)
+        markup = msg.reply_markup.model_dump_json(exclude_none=True) if msg.reply_markup else None
+        return cls(
+            from_chat_id=msg.chat.id,
+            message_ids=[msg.message_id],
+            text=msg.html_text if msg.text else None,
+            media=[media] if media else [],
+            markup_json=markup,
+        )
+
+    @classmethod
+    def from_album(cls, messages: Sequence[Message]) -> "BroadcastPayload":
+        ordered = sorted(messages, key=lambda m: m.message_id)
+        return cls(
+            from_chat_id=ordered[0].chat.id,
+            message_ids=[m.message_id for m in ordered],
+            media=[m for m in (_media_of(x) for x in ordered) if m is not None],
+        )
+
+    @property
+    def is_album(self) -> bool:
+        return len(self.message_ids) > 1
+
+    def preview(self) -> str:
+        """Короткое описание для админки и broadcasts.text."""
+        if self.text is not None:
+            return self.text
+        kinds = ", ".join(m.kind for m in self.media)
+        caption = next((m.caption for m in self.media if m.caption), "")
+        return f"[{kinds}] {caption}".strip()
+
+    # ---------- (де)сериализация ----------
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "BroadcastPayload":
+        data: Dict[str, Any] = json.loads(raw)
+        data["media"] = [MediaItem(**m) for m in data.get("media", [])]
+        return cls(**data)
+
+    # ---------- отправка ----------
+
+    def _markup(self) -> Optional[InlineKeyboardMarkup]:
+        if not self.markup_json:
+            return None
+        return InlineKeyboardMarkup.model_validate_json(self.markup_json)
+
+    async def send(self, bot: Bot, chat_id: int) -> None:
+        if self.copy_ok:
+            try:
+                if self.is_album:
+                    await bot.copy_messages(chat_id, self.from_chat_id, self.message_ids)
+                else:
+                    await bot.copy_message(
+                        chat_id, self.from_chat_id, self.message_ids[0], reply_markup=self._markup(),
+                    )
+                return
+            except TelegramBadRequest as e:
+                if not any(s in str(e).lower() for s in _COPY_GONE):
+                    raise
+                # исходник удалён — дальше только по file_id
+                self.copy_ok = False
+        await self._send_cached(bot, chat_id)
+
+    async def _send_cached(self, bot: Bot, chat_id: int) -> None:
+        if self.text is not None:
+            await bot.send_message(chat_id, self.text, reply_markup=self._markup())
+            return
+        if self.is_album:
+            group = [
+                _INPUT_MEDIA[m.kind](media=m.file_id, caption=m.caption)
+                for m in self.media if m.kind in _INPUT_MEDIA
+            ]
+            await bot.send_media_group(chat_id, group)
+            return
+        if not self.media:
+            raise RuntimeError("исходное сообщение удалено, а этот тип сообщения по file_id не переотправить")
+        item = self.media[0]
+        method = getattr(bot, _SEND_METHODS[item.kind])
+        kwargs: Dict[str, Any] = {"reply_markup": self._markup()}
+        if item.kind not in _NO_CAPTION:
+            kwargs["caption"] = item.caption
+        await method(chat_id, item.file_id, **kwargs)
+
+
+# ключ варианта «для всех языков» (обычная рассылка одним сообщением)
+ANY_LANG = "*"
+
+
+@dataclass
+class BroadcastContent:
+    """
+    Что слать каждому получателю: вариант по users.lang, иначе вариант fallback-языка.
+    Обычная рассылка — один вариант ANY_LANG.
+    """
+
+    variants: Dict[str, BroadcastPayload]
+    fallback_lang: Optional[str] = None
+
+    @classmethod
+    def single(cls, payload: BroadcastPayload) -> "BroadcastContent":
+        return cls({ANY_LANG: payload})
+
+    @property
+    def is_multilang(self) -> bool:
+        return ANY_LANG not in self.variants
+
+    def for_lang(self, lang: str) -> Optional[BroadcastPayload]:
+        payload = self.variants.get(lang) or self.variants.get(ANY_LANG)
+        if payload is None and self.fallback_lang:
+            payload = self.variants.get(self.fallback_lang)
+        return payload
+
+    def covered_langs(self) -> Optional[Tuple[str, ...]]:
+        """Языки, которым есть что слать; None — всем (есть ANY_LANG или fallback)."""
+        if not self.is_multilang or self.fallback_lang in self.variants:
+            return None
+        return tuple(self.variants)
+
+    def preview(self) -> str:
+        if not self.is_multilang:
+            return self.variants[ANY_LANG].preview()
+        langs = ", ".join(self.variants)
+        return f"[{langs}; fallback {self.fallback_lang or '—'}] " + next(iter(self.variants.values())).preview()
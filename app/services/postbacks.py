@@ -9,7 +9,13 @@ from aiohttp import web
 from aiogram import Bot
 
 from app.config import get_config
-from app.db import add_postback
+from app.middlewares.admission import setup_admission
+from app.middlewares.http_metrics import setup_http_metrics
+from app.services.channel_notify import CHANNEL_NOTIFIER
+from app.services.exports import export_handler
+from app.services.metrics import POSTBACKS, metrics_handler
+from app.services.spool import SPOOL
+from app.storage import get_storage
 
 
 # ======== Маппинг событий 1Win ========
@@ -87,7 +93,7 @@ def _format_postback_message(event_type: str, q: Dict[str, str]) -> str:
 
 async def handle_postback(request: web.Request) -> web.Response:
     """
-    GET/POST /postback?... — валидируем секрет, пишем в БД и шлём в канал.
+    GET/POST /postback?... — валидируем секрет, пишем в спул (или сразу в БД) и шлём в канал.
     Параметры от 1Win (по скринам): {event_id}, {date}, {hash_id}, {hash_name}, {source_id}, {source_name},
     {amount}, {transaction_id}, {country}, {user_id}, {sub1}, {sub2}
     """
@@ -106,16 +112,16 @@ async def handle_postback(request: web.Request) -> web.Response:
     user_id = _extract_user_id(params) or 0
 
     payload = json.dumps(params, ensure_ascii=False)
-    await add_postback(user_id, event_type, payload, int(time.time()))
-
-    text = _format_postback_message(event_type, params)
-    bot: Bot = request.app["bot"]
+    if cfg.postback_spool:
+        # на диске после fsync — в БД перенесёт фоновая задача (app/services/spool.py)
+        await SPOOL.append(user_id, event_type, payload, int(time.time()))
+    else:
+        await get_storage().add_postback(user_id, event_type, payload, int(time.time()))
+    POSTBACKS.inc(event_type)
 
-    try:
-        await bot.send_message(cfg.postback_channel_id, text)
-    except Exception:
-        # чтобы ПП не ддосила ретраями, подтверждаем при ошибке доставки в канал
-        return web.Response(status=202, text="accepted")
+    # в канал — не больше ~20 сообщений в минуту: уведомление ждёт в очереди
+    # (app/services/channel_notify.py), а ПП получает ответ сразу (постбэк уже сохранён)
+    CHANNEL_NOTIFIER.push(_format_postback_message(event_type, params))
 
     return web.Response(text="ok")
 
@@ -123,9 +129,13 @@ async def handle_postback(request: web.Request) -> web.Response:
 def build_web_app(bot: Bot) -> web.Application:
     app = web.Application()
     app["bot"] = bot
+    setup_admission(app)     # лимиты на IP/маршрут и сброс нагрузки
+    setup_http_metrics(app)  # счётчики/латентность всех маршрутов (встаёт первой)
     app.add_routes([
         web.get("/postback", handle_postback),
         web.post("/postback", handle_postback),
         web.get("/health", lambda _: web.Response(text="ok")),
+        web.get("/metrics", metrics_handler),
+        web.get("/export/{kind}", export_handler),
     ])
     return app
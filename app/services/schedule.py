@@ -0,0 +1,162 @@
+# app/services/schedule.py
+from __future__ import annotations
+
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, tzinfo
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from app.config import get_config
+
+# Расписание рассылки: когда начинать, в какие часы не слать и с какой скоростью.
+# Время старта и тихие часы — в поясе BROADCAST_TZ (Config.broadcast_tz);
+# в БД всё хранится в unix ts (broadcasts.scheduled_for) и строкой "ЧЧ:ММ-ЧЧ:ММ".
+
+_HHMM_RE = re.compile(r"^(\d{1,2}):(\d{2})$")
+_REL_RE = re.compile(r"^\+(\d+)([mh])$")
+
+_KEYS = {
+    "at": "at", "start": "at", "старт": "at",
+    "quiet": "quiet", "тихо": "quiet",
+    "rate": "rate", "скорость": "rate",
+}
+
+
+def broadcast_tz() -> tzinfo:
+    return ZoneInfo(get_config().broadcast_tz)
+
+
+def format_ts(ts: int, tz: Optional[tzinfo] = None) -> str:
+    return datetime.fromtimestamp(ts, tz or broadcast_tz()).strftime("%Y-%m-%d %H:%M")
+
+
+def _parse_hhmm(value: str) -> int:
+    m = _HHMM_RE.match(value)
+    if not m or int(m.group(1)) > 23 or int(m.group(2)) > 59:
+        raise ValueError(f"время задаётся как ЧЧ:ММ: {value}")
+    return int(m.group(1)) * 60 + int(m.group(2))
+
+
+def _next_at(ts: int, tz: tzinfo, minute: int) -> int:
+    """Ближайший после ts момент, когда местное время равно minute (минут от полуночи)."""
+    local = datetime.fromtimestamp(ts, tz)
+    at = local.replace(hour=minute // 60, minute=minute % 60, second=0, microsecond=0)
+    if at <= local:
+        at += timedelta(days=1)
+    return int(at.timestamp())
+
+
+@dataclass(frozen=True)
+class QuietHours:
+    """Окно «не слать» в минутах от полуночи; может переходить через полночь (23:00-08:00)."""
+
+    start: int
+    end: int
+
+    @classmethod
+    def parse(cls, text: str) -> "QuietHours":
+        left, sep, right = text.partition("-")
+        if not sep:
+            raise ValueError(f"тихие часы задаются как ЧЧ:ММ-ЧЧ:ММ: {text}")
+        quiet = cls(_parse_hhmm(left.strip()), _parse_hhmm(right.strip()))
+        if quiet.start == quiet.end:
+            raise ValueError("начало и конец тихих часов совпадают")
+        return quiet
+
+    def __str__(self) -> str:
+        return f"{self.start // 60:02d}:{self.start % 60:02d}-{self.end // 60:02d}:{self.end % 60:02d}"
+
+    def contains(self, ts: int, tz: tzinfo) -> bool:
+        local = datetime.fromtimestamp(ts, tz)
+        minute = local.hour * 60 + local.minute
+        if self.start < self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end
+
+    def next_start(self, ts: int, tz: tzinfo) -> int:
+        """Ближайшее начало тихих часов после ts."""
+        return _next_at(ts, tz, self.start)
+
+    def next_end(self, ts: int, tz: tzinfo) -> int:
+        """Ближайший конец тихих часов после ts."""
+        return _next_at(ts, tz, self.end)
+
+
+@dataclass(frozen=True)
+class BroadcastSchedule:
+    start_at: Optional[int] = None        # unix ts; None — сразу
+    quiet: Optional[QuietHours] = None
+    max_rate: Optional[float] = None      # сообщений/с; None — сколько позволяет лимит Telegram
+
+    def ready_at(self, now: int, tz: tzinfo) -> int:
+        """Когда рассылку можно начинать (или продолжать): не раньше start_at и вне тихих часов."""
+        at = max(self.start_at or now, now)
+        if self.quiet is not None and self.quiet.contains(at, tz):
+            at = self.quiet.next_end(at, tz)
+        return at
+
+    def send_interval(self, base: float) -> float:
+        """Пауза между сообщениями: max_rate может только замедлить рассылку."""
+        if self.max_rate:
+            return max(base, 1.0 / self.max_rate)
+        return base
+
+    def describe(self, tz: Optional[tzinfo] = None) -> str:
+        parts = []
+        if self.start_at:
+            parts.append(f"старт {format_ts(self.start_at, tz)}")
+        if self.quiet is not None:
+            parts.append(f"тихие часы {self.quiet}")
+        if self.max_rate:
+            parts.append(f"≤ {self.max_rate:g} сообщ./с")
+        return ", ".join(parts) if parts else "сразу, без ограничений"
+
+
+def parse_schedule(text: str, *, now: Optional[int] = None, tz: Optional[tzinfo] = None) -> BroadcastSchedule:
+    """
+    Текст из админки, условия через пробел:
+        at=2024-05-01T03:00  quiet=23:00-08:00  rate=10
+    at: ГГГГ-ММ-ДДTЧЧ:ММ, ЧЧ:ММ (сегодня, а если уже прошло — завтра) или +Nm / +Nh от текущего момента.
+    Время — в поясе BROADCAST_TZ. Ошибки — ValueError с понятным текстом.
+    """
+    now = int(time.time()) if now is None else now
+    tz = tz or broadcast_tz()
+    fields: dict = {}
+    for token in text.replace(";", " ").split():
+        if "=" not in token:
+            raise ValueError(f"ожидается ключ=значение: {token}")
+        key, value = (x.strip() for x in token.split("=", 1))
+        name = _KEYS.get(key.lower())
+        if name is None:
+            raise ValueError(f"неизвестный ключ: {key}")
+        if not value:
+            raise ValueError(f"пустое значение: {key}")
+
+        if name == "at":
+            fields["start_at"] = _parse_start(value, now, tz)
+        elif name == "quiet":
+            fields["quiet"] = QuietHours.parse(value)
+        else:
+            try:
+                rate = float(value)
+            except ValueError:
+                raise ValueError(f"rate — число сообщений в секунду: {value}") from None
+            if rate <= 0:
+                raise ValueError("rate должен быть больше нуля")
+            fields["max_rate"] = rate
+    return BroadcastSchedule(**fields)
+
+
+def _parse_start(value: str, now: int, tz: tzinfo) -> int:
+    rel = _REL_RE.match(value)
+    if rel:
+        return now + int(rel.group(1)) * (60 if rel.group(2) == "m" else 3600)
+    if _HHMM_RE.match(value):
+        return _next_at(now, tz, _parse_hhmm(value))
+    try:
+        at = datetime.strptime(value, "%Y-%m-%dT%H:%M").replace(tzinfo=tz)
+    except ValueError:
+        raise ValueError(f"не понял время старта: {value}") from None
+    return int(at.timestamp())
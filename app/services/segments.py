@@ -0,0 +1,247 @@
+# app/services/segments.py
+from __future__ import annotations
+
+import json
+import re
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Collection, List, Mapping, Optional, Tuple
+
+from app.config import SUPPORTED_LANGS
+
+# Сегмент аудитории рассылки (broadcasts.filter_json).
+# Фильтр компилируется в WHERE по таблице users (алиас u), каждое условие —
+# под свой индекс (см. SCHEMA_SQL в app/db.py):
+#   lang      -> idx_users_active_lang (blocked, lang)
+#   created   -> idx_users_active_created (blocked, created_at)
+#   active    -> idx_users_active_seen (blocked, last_seen_at)
+#   ref       -> idx_users_ref (ref_code)
+#   has       -> idx_postbacks_event_user (event_type, user_id)
+#   geo       -> idx_profiles_geo (geo)
+
+SEGMENT_EVENTS = ("register", "ftd", "rtd", "all_deposits", "income", "app_start")
+
+_DAY = 24 * 3600
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_REL_RE = re.compile(r"^(\d+)d$")
+
+# синонимы ключей в текстовом фильтре
+_KEYS = {
+    "lang": "langs", "langs": "langs", "язык": "langs",
+    "created": "created", "reg": "created", "дата": "created",
+    "active": "active", "активен": "active",
+    "inactive": "inactive", "неактивен": "inactive",
+    "ref": "ref_codes", "ref_code": "ref_codes", "реф": "ref_codes",
+    "has": "has_events", "event": "has_events", "событие": "has_events",
+    "geo": "geos", "гео": "geos",
+}
+
+
+@dataclass(frozen=True)
+class Segment:
+    langs: Tuple[str, ...] = ()
+    created_from: Optional[int] = None   # unix ts, включительно
+    created_to: Optional[int] = None     # unix ts, не включительно
+    ref_codes: Tuple[str, ...] = ()
+    has_events: Tuple[str, ...] = ()     # все перечисленные события должны быть у пользователя
+    geos: Tuple[str, ...] = ()
+    seen_from: Optional[int] = None      # last_seen_at >= (активные)
+    seen_to: Optional[int] = None        # last_seen_at < или ни разу не видели (неактивные)
+    include_blocked: bool = False
+
+    # ---------- SQL ----------
+
+    def compile(self) -> Tuple[str, List[Any]]:
+        """WHERE-условие по users u + параметры. Пустой сегмент — все активные."""
+        where: List[str] = []
+        params: List[Any] = []
+        if not self.include_blocked:
+            # при избирательных условиях (ref/has/geo) «+» убирает blocked из выбора индекса:
+            # иначе планировщик без ANALYZE берёт (blocked, ...) и листает всех активных
+            selective = self.ref_codes or self.has_events or self.geos
+            where.append("+u.blocked = 0" if selective else "u.blocked = 0")
+        if self.langs:
+            where.append(f"u.lang IN ({_marks(self.langs)})")
+            params.extend(self.langs)
+        if self.created_from is not None:
+            where.append("u.created_at >= ?")
+            params.append(self.created_from)
+        if self.created_to is not None:
+            where.append("u.created_at < ?")
+            params.append(self.created_to)
+        if self.seen_from is not None:
+            where.append("u.last_seen_at >= ?")
+            params.append(self.seen_from)
+        if self.seen_to is not None:
+            where.append("(u.last_seen_at < ? OR u.last_seen_at IS NULL)")
+            params.append(self.seen_to)
+        if self.ref_codes:
+            where.append(f"u.ref_code IN ({_marks(self.ref_codes)})")
+            params.extend(self.ref_codes)
+        for ev in self.has_events:
+            where.append("u.user_id IN (SELECT p.user_id FROM postbacks p WHERE p.event_type = ?)")
+            params.append(ev)
+        if self.geos:
+            where.append(f"u.user_id IN (SELECT up.user_id FROM user_profiles up WHERE up.geo IN ({_marks(self.geos)}))")
+            params.extend(self.geos)
+        return (" AND ".join(where) or "1"), params
+
+    # ---------- в памяти (app/storage/memory.py) ----------
+
+    def matches(
+        self,
+        user: Mapping[str, Any],
+        *,
+        events: Collection[str] = (),
+        geo: Optional[str] = None,
+    ) -> bool:
+        """
+        То же условие, что compile(), для строки users (dict).
+        events — типы постбэков пользователя, geo — гео из его анкеты (None — анкеты нет).
+        """
+        if not self.include_blocked and user["blocked"]:
+            return False
+        if self.langs and user["lang"] not in self.langs:
+            return False
+        created = user["created_at"]
+        if self.created_from is not None and created < self.created_from:
+            return False
+        if self.created_to is not None and created >= self.created_to:
+            return False
+        seen = user.get("last_seen_at")
+        if self.seen_from is not None and (seen is None or seen < self.seen_from):
+            return False
+        if self.seen_to is not None and seen is not None and seen >= self.seen_to:
+            return False
+        if self.ref_codes and user.get("ref_code") not in self.ref_codes:
+            return False
+        if any(ev not in events for ev in self.has_events):
+            return False
+        if self.geos and geo not in self.geos:
+            return False
+        return True
+
+    # ---------- (де)сериализация ----------
+
+    def to_json(self) -> str:
+        data = {k: list(v) if isinstance(v, tuple) else v for k, v in asdict(self).items()}
+        return json.dumps({k: v for k, v in data.items() if v not in ((), [], None, False)}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: Optional[str]) -> "Segment":
+        if not raw:
+            return cls()
+        data = json.loads(raw)
+        return cls(
+            langs=tuple(data.get("langs", ())),
+            created_from=data.get("created_from"),
+            created_to=data.get("created_to"),
+            ref_codes=tuple(data.get("ref_codes", ())),
+            has_events=tuple(data.get("has_events", ())),
+            geos=tuple(data.get("geos", ())),
+            seen_from=data.get("seen_from"),
+            seen_to=data.get("seen_to"),
+            include_blocked=bool(data.get("include_blocked", False)),
+        )
+
+    def describe(self) -> str:
+        """Человекочитаемое описание для админки."""
+        parts = []
+        if self.langs:
+            parts.append("язык: " + ", ".join(self.langs))
+        if self.created_from is not None or self.created_to is not None:
+            parts.append(f"регистрация: {_fmt_day(self.created_from)}..{_fmt_day(self.created_to, end=True)}")
+        if self.seen_from is not None:
+            parts.append(f"активны с {_fmt_day(self.seen_from)}")
+        if self.seen_to is not None:
+            parts.append(f"неактивны с {_fmt_day(self.seen_to)}")
+        if self.ref_codes:
+            parts.append("ref: " + ", ".join(self.ref_codes))
+        if self.has_events:
+            parts.append("есть события: " + ", ".join(self.has_events))
+        if self.geos:
+            parts.append("гео: " + ", ".join(self.geos))
+        return "; ".join(parts) or "все пользователи"
+
+
+def _marks(values: Tuple[Any, ...]) -> str:
+    return ", ".join("?" * len(values))
+
+
+def _fmt_day(ts: Optional[int], *, end: bool = False) -> str:
+    if ts is None:
+        return ""
+    if end:
+        ts -= 1  # граница не включительно — показываем последний день окна
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def _parse_day(value: str) -> int:
+    if not _DATE_RE.match(value):
+        raise ValueError(f"дата должна быть в формате ГГГГ-ММ-ДД: {value}")
+    return int(datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+
+
+def parse_date_range(value: str, now: int) -> Tuple[Optional[int], Optional[int]]:
+    """ГГГГ-ММ-ДД, A..B (любая сторона может быть пустой) или Nd -> [from, to) в unix ts (UTC)."""
+    rel = _REL_RE.match(value)
+    if rel:
+        return now - int(rel.group(1)) * _DAY, None
+    if ".." not in value:
+        start = _parse_day(value)
+        return start, start + _DAY
+    left, right = value.split("..", 1)
+    return (
+        _parse_day(left) if left else None,
+        _parse_day(right) + _DAY if right else None,
+    )
+
+
+def parse_segment(text: str, *, now: Optional[int] = None) -> Segment:
+    """
+    Текстовый фильтр из админки, условия через пробел или с новой строки:
+        lang=ru,en  created=2024-01-01..2024-03-31  active=7d  ref=abc  has=ftd  geo=in,br
+    created: ГГГГ-ММ-ДД, диапазон A..B (любая сторона может быть пустой) или Nd — за последние N дней.
+    active: то же по last_seen_at; inactive=Nd — не заходили N дней (или ни разу).
+    Ошибки — ValueError с понятным текстом.
+    """
+    now = int(time.time()) if now is None else now
+    fields: dict = {}
+    for token in text.replace(";", " ").split():
+        if "=" not in token:
+            raise ValueError(f"ожидается ключ=значение: {token}")
+        key, value = token.split("=", 1)
+        name = _KEYS.get(key.strip().lower())
+        if name is None:
+            raise ValueError(f"неизвестный ключ: {key}")
+        values = tuple(v for v in (x.strip() for x in value.split(",")) if v)
+        if not values:
+            raise ValueError(f"пустое значение: {key}")
+
+        if name == "langs":
+            bad = [v for v in values if v not in SUPPORTED_LANGS]
+            if bad:
+                raise ValueError("неизвестный язык: " + ", ".join(bad))
+            fields["langs"] = values
+        elif name == "created":
+            fields["created_from"], fields["created_to"] = parse_date_range(values[0], now)
+        elif name == "active":
+            fields["seen_from"], fields["seen_to"] = parse_date_range(values[0], now)
+        elif name == "inactive":
+            rel = _REL_RE.match(values[0])
+            if not rel:
+                raise ValueError(f"inactive задаётся как Nd (например 30d): {values[0]}")
+            fields["seen_to"] = now - int(rel.group(1)) * _DAY
+        elif name == "has_events":
+            values = tuple(v.lower() for v in values)
+            bad = [v for v in values if v not in SEGMENT_EVENTS]
+            if bad:
+                raise ValueError("неизвестное событие: " + ", ".join(bad))
+            fields["has_events"] = values
+        elif name == "geos":
+            # коды гео в анкете мини-аппа — в нижнем регистре (ru, in, br, ...)
+            fields["geos"] = tuple(v.lower() for v in values)
+        else:
+            fields[name] = values
+    return Segment(**fields)
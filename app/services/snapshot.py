@@ -0,0 +1,149 @@
+# app/services/snapshot.py
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional, Tuple
+
+import aiosqlite
+from loguru import logger
+
+from app import db
+from app.config import get_config
+from app.services.backup import copy_db
+from app.services.metrics import REGISTRY
+from app.services.schedule import format_ts
+
+# Снимок БД для отчётов админки (статистика, рефы, выгрузки, превью сегментов).
+# Раз в ANALYTICS_SNAPSHOT_INTERVAL сек БД копируется тем же backup API, что и бэкап
+# (app/services/backup.py: согласованная копия в потоке, шагами с паузами), во временный
+# файл и атомарно подменяет ANALYTICS_SNAPSHOT_PATH. Отчёты читают снимок через своё
+# соединение (immutable — без блокировок): основное соединение, через которое идут /start
+# и постбэки, тяжёлых запросов не видит, а в отчёте видно, на какой момент данные.
+# Старый снимок закрывается, когда дочитают те, кто его взял (выгрузка может идти минуты);
+# на POSIX открытый файл живёт и после подмены.
+# Пока снимка нет (старт, интервал 0) — отдельное read-only соединение к живой БД.
+
+SNAPSHOT_RUNS = REGISTRY.counter("analytics_snapshot_runs_total", "Reports snapshot refreshes by outcome", ("outcome",))
+SNAPSHOT_SECONDS = REGISTRY.histogram(
+    "analytics_snapshot_seconds", "Reports snapshot refresh duration",
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300),
+)
+
+
+def describe_as_of(as_of: int, *, now: Optional[int] = None) -> str:
+    """«данные на …» для отчётов; время — в поясе BROADCAST_TZ, как и всё в админке."""
+    age = (int(time.time()) if now is None else now) - as_of
+    return f"🕒 данные на {format_ts(as_of)}" + (f" ({age // 60} мин назад)" if age >= 60 else "")
+
+
+@dataclass
+class _Snapshot:
+    conn: aiosqlite.Connection
+    as_of: int
+    leases: int = 0
+    retired: bool = False
+
+
+class AnalyticsSnapshot:
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._current: Optional[_Snapshot] = None
+
+    @property
+    def as_of(self) -> Optional[int]:
+        return self._current.as_of if self._current else None
+
+    async def refresh(self) -> float:
+        """Снять новый снимок и переключить на него отчёты. Вернёт длительность (сек)."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            cfg = get_config()
+            path = cfg.analytics_snapshot_path
+            tmp = path.with_name(path.name + ".tmp")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            as_of = int(time.time())
+            started = time.perf_counter()
+            try:
+                # integrity_check не нужен: снимок пересобирается, а не хранится
+                await asyncio.to_thread(
+                    copy_db, cfg.db_path.as_posix(), tmp.as_posix(),
+                    cfg.backup_pages_per_step, cfg.backup_step_pause_ms / 1000, check=False,
+                )
+                os.replace(tmp, path)
+                conn = await db.open_read_only(path, immutable=True)
+            except Exception:
+                SNAPSHOT_RUNS.inc("error")
+                tmp.unlink(missing_ok=True)
+                raise
+            elapsed = time.perf_counter() - started
+            SNAPSHOT_RUNS.inc("ok")
+            SNAPSHOT_SECONDS.observe(elapsed)
+
+            old, self._current = self._current, _Snapshot(conn, as_of)
+            if old is not None:
+                await self._retire(old)
+            return elapsed
+
+    @staticmethod
+    async def _retire(snap: _Snapshot) -> None:
+        snap.retired = True
+        if not snap.leases:
+            await snap.conn.close()
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[Tuple[aiosqlite.Connection, int]]:
+        """(соединение, данные на момент) на время блока; снимок не закроется, пока блок не выйдет."""
+        snap = self._current
+        if snap is None:
+            conn = await db.open_read_only()
+            try:
+                yield conn, int(time.time())
+            finally:
+                await conn.close()
+            return
+        snap.leases += 1
+        try:
+            yield snap.conn, snap.as_of
+        finally:
+            snap.leases -= 1
+            if snap.retired and not snap.leases:
+                await snap.conn.close()
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            try:
+                elapsed = await self.refresh()
+                logger.debug("Снимок для отчётов обновлён за {:.1f} c", elapsed)
+            except Exception as e:
+                logger.warning("Снимок для отчётов не обновился: {}", e)
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float) -> None:
+        if interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._current is not None:
+            snap, self._current = self._current, None
+            await self._retire(snap)
+
+
+SNAPSHOT = AnalyticsSnapshot()
+
+REGISTRY.gauge(
+    "analytics_snapshot_timestamp", "Unix time the reports snapshot was taken (0 — none yet)",
+    fn=lambda: float(SNAPSHOT.as_of or 0),
+)
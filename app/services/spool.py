@@ -0,0 +1,294 @@
+# app/services/spool.py
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import secrets
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from loguru import logger
+
+from app.config import get_config
+from app.services.metrics import REGISTRY
+from app.storage import get_storage
+from app.storage.base import SpoolRow
+
+# Спул постбэков: /postback не ждёт SQLite.
+# Запись — строка NDJSON в сегмент POSTBACK_SPOOL_DIR/postbacks-<ns>.ndjson. Записи, пришедшие
+# за окно POSTBACK_SPOOL_FSYNC_MS, пишутся одним write + fsync (групповой коммит); ответ партнёру —
+# после fsync, то есть постбэк уже на диске, даже если БД занята или бот упадёт.
+# Фоновая задача раз в POSTBACK_SPOOL_INTERVAL сек закрывает текущий сегмент и переносит
+# закрытые в postbacks пачками по POSTBACK_SPOOL_BATCH строк (одна транзакция на пачку),
+# потом удаляет файл. У каждой записи свой spool_id (уникальный индекс в postbacks):
+# повторный перенос после сбоя между INSERT и удалением файла — INSERT OR IGNORE, без дублей.
+# На старте всё, что осталось с прошлого запуска, переносится первым проходом.
+# Недописанная при падении последняя строка не была подтверждена — её пропускаем.
+# Постбэки на неизвестных боту пользователей внешний ключ не пускает: они уходят
+# в rejected.ndjson рядом (разбор вручную), а не блокируют очередь.
+
+SEGMENT_PREFIX = "postbacks-"
+SEGMENT_SUFFIX = ".ndjson"
+REJECTED_FILE = "rejected.ndjson"
+
+SPOOL_RECORDS = REGISTRY.counter(
+    "postback_spool_records_total", "Postback spool records by stage", ("stage",),
+)
+SPOOL_FSYNC_SECONDS = REGISTRY.histogram(
+    "postback_spool_fsync_seconds", "Postback spool write+fsync duration per group commit",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5),
+)
+SPOOL_GROUP = REGISTRY.histogram(
+    "postback_spool_group_size", "Postbacks per group commit",
+    buckets=(1, 2, 5, 10, 50, 100, 500, 1000),
+)
+
+
+def _segments(directory: Path) -> List[Path]:
+    """Сегменты по порядку записи (в имени — time_ns создания фиксированной ширины)."""
+    if not directory.is_dir():
+        return []
+    return sorted(
+        p for p in directory.iterdir() if p.name.startswith(SEGMENT_PREFIX) and p.name.endswith(SEGMENT_SUFFIX)
+    )
+
+
+def _fsync_dir(directory: Path) -> None:
+    """Запись о новом/удалённом файле в каталоге — тоже на диск."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _read_segment(path: Path) -> Tuple[List[SpoolRow], int]:
+    """Строки сегмента и число битых (недописанных) строк. Синхронно — для потока."""
+    rows: List[SpoolRow] = []
+    broken = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                r = json.loads(line)
+                rows.append((int(r["id"]), int(r["u"]), r["e"], r["p"], int(r["t"])))
+            except (ValueError, KeyError, TypeError):
+                broken += 1
+    return rows, broken
+
+
+def _append_rejected(path: Path, rows: List[SpoolRow]) -> None:
+    data = b"".join(
+        json.dumps({"id": r[0], "u": r[1], "e": r[2], "p": r[3], "t": r[4]}, ensure_ascii=False).encode("utf-8") + b"\n"
+        for r in rows
+    )
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class PostbackSpool:
+    def __init__(self) -> None:
+        self._pending: List[Tuple[bytes, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._consumer: Optional[asyncio.Task] = None
+        self._file_lock: Optional[asyncio.Lock] = None     # запись в сегмент vs его закрытие
+        self._consume_lock: Optional[asyncio.Lock] = None
+        self._fd: Optional[int] = None
+        self._segment: Optional[Path] = None
+        self._segment_size = 0
+        self._closing = False
+
+    @property
+    def directory(self) -> Path:
+        return get_config().postback_spool_dir
+
+    # ---------- запись (горячий путь /postback) ----------
+
+    async def append(self, user_id: int, event_type: str, payload: str, ts: int) -> int:
+        """Дописать постбэк в спул; вернётся после fsync. Вернёт spool_id."""
+        if self._writer is None or self._writer.done():
+            self._start_writer()
+        assert self._wakeup is not None
+        spool_id = secrets.randbits(63)
+        line = json.dumps(
+            {"id": spool_id, "u": user_id, "e": event_type, "p": payload, "t": ts}, ensure_ascii=False,
+        ).encode("utf-8") + b"\n"
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((line, fut))
+        self._wakeup.set()
+        await fut
+        return spool_id
+
+    def _start_writer(self) -> None:
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._file_lock = self._file_lock or asyncio.Lock()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def _write_loop(self) -> None:
+        assert self._wakeup is not None
+        window = get_config().postback_spool_fsync_ms / 1000
+        while True:
+            await self._wakeup.wait()
+            if window > 0 and not self._closing:
+                await asyncio.sleep(window)  # собираем группу под один fsync
+            self._wakeup.clear()
+            await self._commit_pending()
+            if self._closing and not self._pending:
+                return
+
+    async def _commit_pending(self) -> None:
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        assert self._file_lock is not None
+        started = time.perf_counter()
+        try:
+            async with self._file_lock:
+                await asyncio.to_thread(self._write, b"".join(line for line, _ in batch))
+        except Exception as e:
+            logger.error("Спул постбэков: запись не удалась ({} шт.): {}", len(batch), e)
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        SPOOL_FSYNC_SECONDS.observe(time.perf_counter() - started)
+        SPOOL_GROUP.observe(len(batch))
+        SPOOL_RECORDS.inc("spooled", amount=len(batch))
+        for _, fut in batch:
+            if not fut.done():
+                fut.set_result(None)
+
+    def _write(self, data: bytes) -> None:
+        """write + fsync в текущий сегмент (новый — при первом вызове или после закрытия). Синхронно."""
+        cfg = get_config()
+        if self._fd is not None and self._segment_size >= cfg.postback_spool_segment_bytes:
+            self._seal()
+        if self._fd is None:
+            cfg.postback_spool_dir.mkdir(parents=True, exist_ok=True)
+            self._segment = cfg.postback_spool_dir / f"{SEGMENT_PREFIX}{time.time_ns():020d}{SEGMENT_SUFFIX}"
+            self._fd = os.open(self._segment, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            self._segment_size = 0
+            _fsync_dir(cfg.postback_spool_dir)
+        try:
+            view = memoryview(data)
+            while view:
+                n = os.write(self._fd, view)
+                view = view[n:]
+            os.fsync(self._fd)
+        except OSError:
+            # ENOSPC/EIO посреди пачки: обрезаем недописанный хвост (записи получат ошибку —
+            # ПП повторит постбэк) и закрываем сегмент, чтобы следующая пачка начала
+            # с чистой строки в новом, а не склеилась с обрывком
+            try:
+                os.ftruncate(self._fd, self._segment_size)
+            except OSError:
+                pass
+            self._seal()
+            raise
+        self._segment_size += len(data)
+
+    def _seal(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._segment = None
+            self._segment_size = 0
+
+    # ---------- перенос в БД ----------
+
+    async def consume(self) -> int:
+        """Закрыть текущий сегмент и перенести все закрытые в БД. Вернёт число вставленных строк."""
+        self._consume_lock = self._consume_lock or asyncio.Lock()
+        self._file_lock = self._file_lock or asyncio.Lock()
+        async with self._consume_lock:
+            async with self._file_lock:
+                if self._segment_size:
+                    self._seal()
+                active = self._segment
+            inserted = 0
+            for path in _segments(self.directory):
+                if path != active:
+                    inserted += await self._consume_segment(path)
+            return inserted
+
+    async def _consume_segment(self, path: Path) -> int:
+        cfg = get_config()
+        rows, broken = await asyncio.to_thread(_read_segment, path)
+        if broken:
+            logger.warning("Спул постбэков: {} — пропущено недописанных строк: {}", path.name, broken)
+            SPOOL_RECORDS.inc("broken", amount=broken)
+        inserted = 0
+        batch_size = max(1, cfg.postback_spool_batch)
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            n, rejected = await get_storage().add_postbacks(batch)
+            inserted += n
+            SPOOL_RECORDS.inc("inserted", amount=n)
+            duplicates = len(batch) - n - len(rejected)
+            if duplicates:
+                SPOOL_RECORDS.inc("duplicate", amount=duplicates)
+            if rejected:
+                await asyncio.to_thread(_append_rejected, path.parent / REJECTED_FILE, rejected)
+                SPOOL_RECORDS.inc("rejected", amount=len(rejected))
+                logger.warning(
+                    "Спул постбэков: {} шт. на неизвестных пользователей — в {}", len(rejected), REJECTED_FILE,
+                )
+        path.unlink()
+        await asyncio.to_thread(_fsync_dir, path.parent)
+        return inserted
+
+    async def _consume_loop(self, interval: float) -> None:
+        while True:
+            try:
+                n = await self.consume()
+                if n:
+                    logger.debug("Спул постбэков: перенесено в БД {}", n)
+            except Exception as e:
+                # БД занята/недоступна — сегменты остаются на диске, попробуем в следующий раз
+                logger.warning("Спул постбэков: перенос в БД не удался: {}", e)
+            await asyncio.sleep(interval)
+
+    # ---------- жизненный цикл ----------
+
+    def start(self, interval: float) -> None:
+        """Запустить перенос в БД; первый проход сразу — переносит оставшееся с прошлого запуска."""
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.create_task(self._consume_loop(interval))
+
+    async def stop(self) -> None:
+        """
+        Дописать ожидающих и перенести всё в БД (вызывать после остановки веб-сервера
+        и до закрытия хранилища). Что не успело — перенесётся при следующем запуске.
+        """
+        if self._writer is not None and self._wakeup is not None:
+            # писатель не отменяем посреди write/fsync: он дописывает группу и выходит сам
+            self._closing = True
+            self._wakeup.set()
+            await self._writer
+        if self._consumer is not None:
+            # прерванная пачка не страшна: повторный перенос пропустит уже вставленные spool_id
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+        self._consumer = self._writer = None
+        try:
+            await self.consume()
+        except Exception as e:
+            logger.warning("Спул постбэков: остаток перенесётся при следующем запуске ({})", e)
+
+
+SPOOL = PostbackSpool()
+
+
+def _spool_bytes() -> float:
+    return float(sum(p.stat().st_size for p in _segments(get_config().postback_spool_dir)))
+
+
+REGISTRY.gauge("postback_spool_bytes", "Bytes of postbacks spooled but not yet moved to the DB", fn=_spool_bytes)
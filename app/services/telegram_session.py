@@ -0,0 +1,119 @@
+# app/services/telegram_session.py
+from __future__ import annotations
+
+import time
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, Optional
+
+from aiohttp import ClientSession, ClientTimeout, TraceConfig
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+from aiogram import __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+
+from app.config import Config, get_config
+from app.services.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+# HTTP-сессия бота к Bot API с настройками из Config (TG_HTTP_*): размер пула соединений
+# (всего и на хост — у нас один хост, api.telegram.org), keep-alive, кэш DNS и таймауты.
+# По умолчанию aiogram держит пул в 100 соединений с keep-alive 15 с — всплеск рассылки
+# или постбэков после паузы открывает соединения (TCP+TLS) заново.
+# Через TraceConfig считаем новые и переиспользованные соединения, ожидание свободного
+# соединения в пуле и попадания в кэш DNS: по ним подбирается TG_HTTP_LIMIT под нагрузку.
+# Общий таймаут запроса — как в aiogram (long polling сам добавляет к нему время ожидания),
+# сверху — отдельный таймаут на установку соединения.
+
+TG_HTTP_CONNECTIONS = REGISTRY.counter(
+    "telegram_http_connections_total", "Bot API requests by connection: new or reused from the pool", ("kind",),
+)
+TG_HTTP_CONNECT_SECONDS = REGISTRY.histogram(
+    "telegram_http_connect_seconds", "Time to open a new Bot API connection (DNS+TCP+TLS)",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+TG_HTTP_POOL_WAIT = REGISTRY.histogram(
+    "telegram_http_pool_wait_seconds", "Time a Bot API request waited for a free connection in the pool",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+TG_HTTP_DNS = REGISTRY.counter("telegram_http_dns_total", "Bot API DNS lookups by cache result", ("result",))
+
+
+async def _on_connection_create_start(_: ClientSession, ctx: SimpleNamespace, __: Any) -> None:
+    ctx.connect_started = time.perf_counter()
+
+
+async def _on_connection_create_end(_: ClientSession, ctx: SimpleNamespace, __: Any) -> None:
+    TG_HTTP_CONNECTIONS.inc("new")
+    TG_HTTP_CONNECT_SECONDS.observe(time.perf_counter() - ctx.connect_started)
+
+
+async def _on_connection_reuseconn(_: ClientSession, __: SimpleNamespace, ___: Any) -> None:
+    TG_HTTP_CONNECTIONS.inc("reused")
+
+
+async def _on_connection_queued_start(_: ClientSession, ctx: SimpleNamespace, __: Any) -> None:
+    ctx.queued_started = time.perf_counter()
+
+
+async def _on_connection_queued_end(_: ClientSession, ctx: SimpleNamespace, __: Any) -> None:
+    TG_HTTP_POOL_WAIT.observe(time.perf_counter() - ctx.queued_started)
+
+
+async def _on_dns_cache_hit(_: ClientSession, __: SimpleNamespace, ___: Any) -> None:
+    TG_HTTP_DNS.inc("hit")
+
+
+async def _on_dns_cache_miss(_: ClientSession, __: SimpleNamespace, ___: Any) -> None:
+    TG_HTTP_DNS.inc("miss")
+
+
+def _trace_config() -> TraceConfig:
+    trace = TraceConfig()
+    trace.on_connection_create_start.append(_on_connection_create_start)
+    trace.on_connection_create_end.append(_on_connection_create_end)
+    trace.on_connection_reuseconn.append(_on_connection_reuseconn)
+    trace.on_connection_queued_start.append(_on_connection_queued_start)
+    trace.on_connection_queued_end.append(_on_connection_queued_end)
+    trace.on_dns_cache_hit.append(_on_dns_cache_hit)
+    trace.on_dns_cache_miss.append(_on_dns_cache_miss)
+    return trace
+
+
+class TunedAiohttpSession(AiohttpSession):
+    """AiohttpSession с пулом, keep-alive, DNS и таймаутами из Config и метриками соединений."""
+
+    def __init__(self, cfg: Optional[Config] = None) -> None:
+        cfg = cfg or get_config()
+        super().__init__(limit=cfg.tg_http_limit, timeout=cfg.tg_http_timeout)
+        self._connector_init.update(
+            limit_per_host=cfg.tg_http_limit_per_host,
+            keepalive_timeout=cfg.tg_http_keepalive,
+            use_dns_cache=cfg.tg_http_dns_ttl > 0,
+            ttl_dns_cache=cfg.tg_http_dns_ttl or None,
+        )
+        self.connect_timeout = cfg.tg_http_connect_timeout
+
+    async def create_session(self) -> ClientSession:
+        # как в AiohttpSession.create_session, плюс трассировка: её можно передать
+        # только при создании ClientSession
+        if self._should_reset_connector:
+            await self.close()
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=self._connector_type(**self._connector_init),
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}"},
+                trace_configs=[_trace_config()],
+            )
+            self._should_reset_connector = False
+        return self._session
+
+    async def make_request(
+        self, bot: "Bot", method: TelegramMethod[Any], timeout: Optional[int] = None,
+    ) -> Any:
+        total = self.timeout if timeout is None else timeout
+        # aiohttp: число вместо ClientTimeout — только общий таймаут, без таймаута соединения
+        client_timeout = ClientTimeout(total=total, sock_connect=self.connect_timeout)
+        return await super().make_request(bot, method, timeout=client_timeout)  # type: ignore[arg-type]
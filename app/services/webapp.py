@@ -4,7 +4,7 @@ from __future__ import annotations
 from pathlib import Path
 from aiohttp import web
 
-from app.db import get_links, get_user_profile, upsert_user_profile
+from app.storage import get_storage
 
 # Корень с файлами мини-аппа
 MINIAPP_DIR = Path(__file__).resolve().parent.parent / "miniapp"
@@ -36,7 +36,7 @@ async def api_settings(_: web.Request) -> web.Response:
     GET /api/settings -> {"support_url": "...", "ref_url": "...", "onewin_tok_url": "..."}
     Берём из БД (админка управляет).
     """
-    links = await get_links()
+    links = await get_storage().get_links()
     return web.json_response(links)
 
 
@@ -48,7 +48,7 @@ async def api_get_profile(request: web.Request) -> web.Response:
     if not user_id:
         return web.json_response({"ok": False, "error": "missing user_id"}, status=400)
 
-    profile = await get_user_profile(user_id)
+    profile = await get_storage().get_user_profile(user_id)
     return web.json_response({"ok": True, "profile": profile})
 
 
@@ -84,7 +84,7 @@ async def api_upsert_profile(request: web.Request) -> web.Response:
     tg_handle  = tg_handle[:64]
     geo        = geo[:12]
 
-    await upsert_user_profile(
+    await get_storage().upsert_user_profile(
         user_id=user_id,
         full_name=full_name,
         account_id=account_id,
@@ -0,0 +1,42 @@
+# app/storage/__init__.py
+from __future__ import annotations
+
+from typing import Optional
+
+from app.config import get_config
+from app.storage.base import EXPORT_KINDS, Storage, export_columns, export_filter_columns  # noqa: F401
+
+# Текущее хранилище процесса. Бэкенд — STORAGE_BACKEND (Config.storage_backend):
+#   sqlite — файл DB_PATH (по умолчанию), memory — в памяти процесса (тесты, бенчмарки).
+# Модули бэкендов импортируются лениво: app/db.py сам импортирует app.storage.base.
+
+STORAGE_BACKENDS = ("sqlite", "memory")
+
+_storage: Optional[Storage] = None
+
+
+def create_storage(name: str) -> Storage:
+    if name == "sqlite":
+        from app.storage.sqlite import SqliteStorage
+
+        return SqliteStorage()
+    if name == "memory":
+        from app.storage.memory import MemoryStorage
+
+        return MemoryStorage()
+    raise ValueError(f"неизвестное хранилище: {name} (есть {', '.join(STORAGE_BACKENDS)})")
+
+
+def get_storage() -> Storage:
+    """Ленивое создание хранилища (один раз на процесс)."""
+    global _storage
+    if _storage is None:
+        _storage = create_storage(get_config().storage_backend)
+    return _storage
+
+
+def set_storage(storage: Optional[Storage]) -> None:
+    """Подменить хранилище (бенчмарки, проверка бэкендов); None — снова по Config."""
+    global _storage
+    _storage = storage
+
@@ -0,0 +1,367 @@
+# app/storage/base.py
+from __future__ import annotations
+
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from app.services.segments import Segment
+
+# Интерфейс хранилища: всё, что хендлеры и сервисы читают и пишут, — через него.
+# Бэкенды: app/storage/sqlite.py (основной, поверх app/db.py) и app/storage/memory.py
+# (тесты и бенчмарки). Одинаковое поведение проверяет `python -m bench conformance`.
+#
+# Соглашения для всех бэкендов:
+#   - время — unix ts (int); строки — dict с именами колонок схемы из app/db.py;
+#   - пользователь без языка — 'ru', blocked — 0/1;
+#   - долгие выборки (iter_*) — async-генераторы пачками, снимок на момент первого чтения;
+#     закрывать через contextlib.aclosing, если бросаете на полпути;
+#   - отчёты админки читают через `async with storage.reports() as r` (Reports ниже):
+#     SQLite отдаёт периодический снимок БД, чтобы тяжёлые запросы не стояли в очереди
+#     перед /start и постбэками; r.as_of — на какой момент данные.
+
+# Выгрузки: вид -> (колонки в порядке выдачи, колонка даты, колонки для фильтров).
+# Первая колонка — ключ, по нему строки и идут.
+_EXPORTS: Dict[str, Tuple[Tuple[str, ...], str, Tuple[str, ...]]] = {
+    "users": (
+        ("user_id", "username", "first_name", "last_name", "lang", "ref_code",
+         "created_at", "updated_at", "blocked", "last_seen_at", "interactions"),
+        "created_at",
+        ("lang", "ref_code", "blocked"),
+    ),
+    "profiles": (
+        ("user_id", "full_name", "account_id", "tg_handle", "geo", "created_at", "updated_at"),
+        "created_at",
+        ("geo",),
+    ),
+    "postbacks": (
+        ("id", "user_id", "event_type", "payload", "created_at"),
+        "created_at",
+        ("event_type", "user_id"),
+    ),
+}
+EXPORT_KINDS = tuple(_EXPORTS)
+
+# колонки строки пользователя, которые отдаёт get_user
+USER_COLUMNS = ("user_id", "username", "first_name", "last_name", "lang", "ref_code", "created_at", "updated_at", "blocked")
+
+# колонки pending_broadcasts (очередь в админке)
+PENDING_BROADCAST_COLUMNS = ("id", "status", "text", "scheduled_for", "quiet_hours", "max_rate", "total", "sent")
+
+# статусы, из которых рассылку ещё можно отменить
+CANCELLABLE_STATUSES = ("draft", "scheduled", "running")
+
+LINK_KEYS = ("support_url", "ref_url", "onewin_tok_url")
+
+# строка спула постбэков: (spool_id, user_id, event_type, payload, created_at)
+SpoolRow = Tuple[int, int, str, str, int]
+
+
+def export_columns(kind: str) -> Tuple[str, ...]:
+    return _EXPORTS[kind][0]
+
+
+def export_date_column(kind: str) -> str:
+    return _EXPORTS[kind][1]
+
+
+def export_filter_columns(kind: str) -> Tuple[str, ...]:
+    return _EXPORTS[kind][2]
+
+
+def check_export_filters(kind: str, filters: Optional[Dict[str, Sequence[Any]]]) -> None:
+    allowed = export_filter_columns(kind)
+    for column in filters or {}:
+        if column not in allowed:
+            raise ValueError(f"фильтр {column} для {kind} не поддерживается")
+
+
+class Reports(ABC):
+    """Чтение для отчётов: статистика, рефы, выгрузки, превью сегментов. Данные — на момент as_of."""
+
+    as_of: int
+
+    @abstractmethod
+    async def count_users_by_lang(self, lang: Optional[str] = None) -> int: ...
+
+    @abstractmethod
+    async def top_ref_codes(self, metric: str = "users", limit: int = 10) -> List[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def count_segment(self, segment: Segment) -> int: ...
+
+    @abstractmethod
+    def iter_export_rows(
+        self,
+        kind: str,
+        *,
+        date_from: Optional[int] = None,
+        date_to: Optional[int] = None,
+        filters: Optional[Dict[str, Sequence[Any]]] = None,
+        batch: int = 1000,
+    ) -> AsyncIterator[List[Tuple[Any, ...]]]: ...
+
+
+class Storage(ABC):
+    """Хранилище бота. Реализации не должны отличаться ничем, кроме скорости и долговечности."""
+
+    name: str = ""
+
+    # ---------- жизненный цикл ----------
+
+    async def open(self) -> None:
+        """Подготовить хранилище (схема, миграции). Повторный вызов — no-op."""
+
+    async def close(self) -> None:
+        """Дописать и освободить ресурсы при остановке."""
+
+    # ---------- настройки ----------
+
+    @abstractmethod
+    async def get_setting(self, key: str) -> Optional[str]: ...
+
+    @abstractmethod
+    async def set_setting(self, key: str, value: str) -> None: ...
+
+    @abstractmethod
+    async def get_links(self) -> Dict[str, str]:
+        """Ссылки из настроек; чего нет — из .env (Config)."""
+
+    async def set_links(
+        self,
+        *,
+        support_url: Optional[str] = None,
+        ref_url: Optional[str] = None,
+        onewin_tok_url: Optional[str] = None,
+    ) -> None:
+        """Обновить ссылки частично или полностью."""
+        for key, value in zip(LINK_KEYS, (support_url, ref_url, onewin_tok_url)):
+            if value is not None:
+                await self.set_setting(key, value)
+
+    # ---------- пользователи ----------
+
+    @abstractmethod
+    async def upsert_user(
+        self,
+        user_id: int,
+        *,
+        username: Optional[str],
+        first_name: Optional[str],
+        last_name: Optional[str],
+        lang: Optional[str],
+        ref_code: Optional[str],
+        ts: int,
+    ) -> None:
+        """Новый — с lang (или 'ru') и ref_code; существующий — обновить имена, lang (если задан) и updated_at."""
+
+    @abstractmethod
+    async def set_user_lang(self, user_id: int, lang: str, ts: int) -> None: ...
+
+    @abstractmethod
+    async def get_user_lang(self, user_id: int) -> str: ...
+
+    @abstractmethod
+    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Строка пользователя с колонками USER_COLUMNS или None."""
+
+    @abstractmethod
+    async def count_users_by_lang(self, lang: Optional[str] = None) -> int:
+        """Не заблокировавшие бота; lang=None — все языки."""
+
+    @abstractmethod
+    async def record_activity(
+        self,
+        rows: Sequence[Tuple[int, int, int]],
+        blocked: Sequence[Tuple[int, bool]] = (),
+    ) -> None:
+        """
+        Пачка из write-behind буфера (app/services/activity.py):
+          rows    — (user_id, last_seen_at, interactions): last_seen_at не откатываем, interactions прибавляем;
+          blocked — (user_id, blocked) из my_chat_member.
+        """
+
+    @abstractmethod
+    async def set_blocked(self, user_id: int, blocked: bool) -> None: ...
+
+    # ---------- постбэки ----------
+
+    @abstractmethod
+    async def add_postback(self, user_id: int, event_type: str, payload: str, ts: int) -> int:
+        """Вернёт id постбэка. Неизвестный user_id — sqlite3.IntegrityError (внешний ключ)."""
+
+    @abstractmethod
+    async def add_postbacks(self, rows: Sequence[SpoolRow]) -> Tuple[int, List[SpoolRow]]:
+        """
+        Пачка из спула (app/services/spool.py) одной транзакцией; уже перенесённые spool_id
+        пропускаются. Строки с неизвестным user_id не вставляются и возвращаются.
+        Вернёт (вставлено, отвергнутые).
+        """
+
+    # ---------- анкеты мини-аппа ----------
+
+    @abstractmethod
+    async def upsert_user_profile(self, user_id: int, full_name: str, account_id: str, tg_handle: str, geo: str) -> None: ...
+
+    @abstractmethod
+    async def get_user_profile(self, user_id: int) -> Optional[Dict[str, Any]]: ...
+
+    # ---------- рассылки ----------
+
+    @abstractmethod
+    async def create_broadcast(
+        self,
+        author_id: int,
+        text: str,
+        markup_json: str,
+        filter_json: str,
+        ts: int,
+        *,
+        payload_json: Optional[str] = None,
+        variants: Sequence[Tuple[str, str]] = (),
+        fallback_lang: Optional[str] = None,
+        status: str = "draft",
+        scheduled_for: Optional[int] = None,
+        quiet_hours: Optional[str] = None,
+        max_rate: Optional[float] = None,
+    ) -> int:
+        """
+        variants — языковые варианты (lang, payload_json), сохраняются вместе с рассылкой.
+        status='scheduled' — рассылку запустит планировщик, когда подойдёт scheduled_for.
+        """
+
+    @abstractmethod
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def get_broadcast_variants(self, broadcast_id: int) -> Dict[str, str]: ...
+
+    @abstractmethod
+    async def set_broadcast_counts(
+        self,
+        broadcast_id: int,
+        *,
+        total: int,
+        sent: int,
+        failed: int,
+        cursor: Optional[Tuple[str, int]] = None,
+    ) -> None:
+        """Прогресс рассылки; cursor — (lang, user_id), с которого продолжать после рестарта/паузы."""
+
+    @abstractmethod
+    async def set_broadcast_status(
+        self,
+        broadcast_id: int,
+        status: str,
+        *,
+        started_at: Optional[int] = None,
+        finished_at: Optional[int] = None,
+    ) -> None: ...
+
+    @abstractmethod
+    async def due_broadcasts(self, now: int) -> List[Dict[str, Any]]:
+        """'scheduled', у которых scheduled_for <= now, по (scheduled_for, id)."""
+
+    @abstractmethod
+    async def pending_broadcasts(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Идущие и запланированные (колонки PENDING_BROADCAST_COLUMNS), по (scheduled_for, id)."""
+
+    @abstractmethod
+    async def reschedule_broadcast(self, broadcast_id: int, scheduled_for: int) -> None: ...
+
+    @abstractmethod
+    async def requeue_interrupted_broadcasts(self) -> int:
+        """'running' → 'scheduled' (после рестарта). Вернёт их число."""
+
+    @abstractmethod
+    async def cancel_broadcast(self, broadcast_id: int, ts: int) -> bool:
+        """False — рассылки нет или она уже закончилась."""
+
+    # ---------- ref-коды ----------
+
+    @abstractmethod
+    async def top_ref_codes(self, metric: str = "users", limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Топ-N ref_code по метрике со всеми их счётчиками ('' — без рефа):
+        [{"ref_code": "abc", "users": 120, "uniq:ftd": 14, "lang:ru": 80, ...}, ...]
+        metric: 'users', 'lang:<код>', 'event:<тип>' (постбэки), 'uniq:<тип>' (пользователи с событием).
+        """
+
+    # ---------- сегменты ----------
+
+    @abstractmethod
+    async def count_segment(self, segment: Segment) -> int: ...
+
+    @abstractmethod
+    def iter_segment_user_ids(
+        self,
+        segment: Segment,
+        *,
+        after_user_id: int = 0,
+        batch: int = 500,
+    ) -> AsyncIterator[List[int]]:
+        """Получатели пачками по возрастанию user_id (after_user_id — продолжить с места)."""
+
+    @abstractmethod
+    def iter_segment_recipients(
+        self,
+        segment: Segment,
+        *,
+        after: Tuple[str, int] = ("", 0),
+        batch: int = 500,
+    ) -> AsyncIterator[List[Tuple[int, str]]]:
+        """(user_id, lang) по порядку (lang, user_id), строго после after."""
+
+    # ---------- выгрузки ----------
+
+    @abstractmethod
+    def iter_export_rows(
+        self,
+        kind: str,
+        *,
+        date_from: Optional[int] = None,
+        date_to: Optional[int] = None,
+        filters: Optional[Dict[str, Sequence[Any]]] = None,
+        batch: int = 1000,
+    ) -> AsyncIterator[List[Tuple[Any, ...]]]:
+        """
+        Строки (колонки — export_columns(kind)) пачками по порядку первой колонки.
+        date_from включительно, date_to — нет; filters — колонка -> допустимые значения
+        (только export_filter_columns(kind), иначе ValueError).
+        """
+
+    # ---------- отчёты ----------
+
+    @asynccontextmanager
+    async def reports(self) -> AsyncIterator[Reports]:
+        """Источник для отчётов на время блока. По умолчанию — само хранилище, данные на сейчас."""
+        yield LiveReports(self, int(time.time()))
+
+
+class LiveReports(Reports):
+    """Отчёты прямо по хранилищу (memory; SQLite, пока снимка нет)."""
+
+    def __init__(self, storage: Storage, as_of: int) -> None:
+        self.storage = storage
+        self.as_of = as_of
+
+    async def count_users_by_lang(self, lang: Optional[str] = None) -> int:
+        return await self.storage.count_users_by_lang(lang)
+
+    async def top_ref_codes(self, metric: str = "users", limit: int = 10) -> List[Dict[str, Any]]:
+        return await self.storage.top_ref_codes(metric, limit)
+
+    async def count_segment(self, segment: Segment) -> int:
+        return await self.storage.count_segment(segment)
+
+    def iter_export_rows(
+        self,
+        kind: str,
+        *,
+        date_from: Optional[int] = None,
+        date_to: Optional[int] = None,
+        filters: Optional[Dict[str, Sequence[Any]]] = None,
+        batch: int = 1000,
+    ) -> AsyncIterator[List[Tuple[Any, ...]]]:
+        return self.storage.iter_export_rows(kind, date_from=date_from, date_to=date_to, filters=filters, batch=batch)
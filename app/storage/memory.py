@@ -0,0 +1,414 @@
+# app/storage/memory.py
+from __future__ import annotations
+
+import sqlite3
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from app.config import get_config
+from app.services.segments import Segment
+from app.storage.base import (
+    CANCELLABLE_STATUSES,
+    LINK_KEYS,
+    PENDING_BROADCAST_COLUMNS,
+    USER_COLUMNS,
+    SpoolRow,
+    Storage,
+    check_export_filters,
+    export_columns,
+    export_date_column,
+)
+
+# Бэкенд в памяти процесса: для тестов, бенчмарков и прогонов без файла БД.
+# Ничего не переживает рестарт. Поведение — как у SqliteStorage (сверяет
+# `python -m bench conformance`), включая ref-счётчики, которые в SQLite ведут триггеры.
+# Методы не ждут ничего внутри: каждый атомарен относительно event loop, блокировки не нужны.
+
+BROADCAST_COLUMNS = (
+    "id", "author_id", "text", "markup_json", "filter_json", "payload_json", "fallback_lang",
+    "scheduled_for", "quiet_hours", "max_rate", "cursor_lang", "cursor_user_id",
+    "status", "total", "sent", "failed", "created_at", "started_at", "finished_at",
+)
+
+
+def _schedule_key(row: Dict[str, Any]) -> Tuple[bool, int, int]:
+    # как ORDER BY scheduled_for, id в SQLite: NULL — первыми
+    return row["scheduled_for"] is not None, row["scheduled_for"] or 0, row["id"]
+
+
+class MemoryStorage(Storage):
+    name = "memory"
+
+    def __init__(self) -> None:
+        self._settings: Dict[str, str] = {}
+        self._users: Dict[int, Dict[str, Any]] = {}
+        self._postbacks: Dict[int, Tuple[Any, ...]] = {}
+        self._events: Dict[int, Set[str]] = defaultdict(set)    # user_id -> типы его постбэков
+        self._profiles: Dict[int, Dict[str, Any]] = {}
+        self._broadcasts: Dict[int, Dict[str, Any]] = {}
+        self._variants: Dict[int, Dict[str, str]] = {}
+        self._ref_counters: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._postback_seq = 0
+        self._spool_ids: Set[int] = set()
+        self._broadcast_seq = 0
+
+    # ---------- загрузка (бенчмарки) ----------
+
+    def load(
+        self,
+        *,
+        users: Iterable[Sequence[Any]] = (),
+        postbacks: Iterable[Sequence[Any]] = (),
+        profiles: Iterable[Sequence[Any]] = (),
+    ) -> None:
+        """Залить строки пачкой; колонки — в порядке export_columns("users" | "postbacks" | "profiles")."""
+        for row in users:
+            user = dict(zip(export_columns("users"), row))
+            self._users[user["user_id"]] = user
+            self._count_new_user(user)
+        for row in postbacks:
+            self._store_postback(tuple(row))
+        for row in profiles:
+            profile = dict(zip(export_columns("profiles"), row))
+            self._profiles[profile["user_id"]] = profile
+
+    # ---------- ref-счётчики (в SQLite — триггеры trg_ref_*) ----------
+
+    def _count_new_user(self, user: Dict[str, Any]) -> None:
+        ref = user["ref_code"] or ""
+        self._ref_counters[(ref, "users")] += 1
+        self._ref_counters[(ref, "lang:" + user["lang"])] += 1
+
+    def _count_lang_change(self, user: Dict[str, Any], old_lang: str) -> None:
+        if old_lang == user["lang"]:
+            return
+        ref = user["ref_code"] or ""
+        self._ref_counters[(ref, "lang:" + old_lang)] -= 1
+        self._ref_counters[(ref, "lang:" + user["lang"])] += 1
+
+    def _store_postback(self, row: Tuple[Any, ...]) -> None:
+        postback_id, user_id, event_type = row[0], row[1], row[2]
+        self._postbacks[postback_id] = row
+        self._postback_seq = max(self._postback_seq, postback_id)
+        user = self._users.get(user_id)
+        if user is not None:
+            ref = user["ref_code"] or ""
+            self._ref_counters[(ref, "event:" + event_type)] += 1
+            if event_type not in self._events[user_id]:
+                self._ref_counters[(ref, "uniq:" + event_type)] += 1
+        self._events[user_id].add(event_type)
+
+    # ---------- настройки ----------
+
+    async def get_setting(self, key: str) -> Optional[str]:
+        return self._settings.get(key)
+
+    async def set_setting(self, key: str, value: str) -> None:
+        self._settings[key] = value
+
+    async def get_links(self) -> Dict[str, str]:
+        cfg = get_config()
+        result = {
+            "support_url": cfg.support_url,
+            "ref_url": cfg.ref_url,
+            "onewin_tok_url": cfg.onewin_tok_url,
+        }
+        for key in LINK_KEYS:
+            if self._settings.get(key):
+                result[key] = self._settings[key]
+        return result
+
+    # ---------- пользователи ----------
+
+    async def upsert_user(
+        self,
+        user_id: int,
+        *,
+        username: Optional[str],
+        first_name: Optional[str],
+        last_name: Optional[str],
+        lang: Optional[str],
+        ref_code: Optional[str],
+        ts: int,
+    ) -> None:
+        user = self._users.get(user_id)
+        if user is None:
+            user = {
+                "user_id": user_id, "username": username, "first_name": first_name, "last_name": last_name,
+                "lang": lang or "ru", "ref_code": ref_code, "created_at": ts, "updated_at": ts,
+                "blocked": 0, "last_seen_at": None, "interactions": 0,
+            }
+            self._users[user_id] = user
+            self._count_new_user(user)
+            return
+        old_lang = user["lang"]
+        user.update(username=username, first_name=first_name, last_name=last_name, updated_at=ts)
+        if lang is not None:
+            user["lang"] = lang
+            self._count_lang_change(user, old_lang)
+
+    async def set_user_lang(self, user_id: int, lang: str, ts: int) -> None:
+        user = self._users.get(user_id)
+        if user is not None:
+            old_lang = user["lang"]
+            user.update(lang=lang, updated_at=ts)
+            self._count_lang_change(user, old_lang)
+
+    async def get_user_lang(self, user_id: int) -> str:
+        user = self._users.get(user_id)
+        return user["lang"] if user and user["lang"] else "ru"
+
+    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        user = self._users.get(user_id)
+        return {k: user[k] for k in USER_COLUMNS} if user else None
+
+    async def count_users_by_lang(self, lang: Optional[str] = None) -> int:
+        return sum(1 for u in self._users.values() if not u["blocked"] and (not lang or u["lang"] == lang))
+
+    async def record_activity(
+        self,
+        rows: Sequence[Tuple[int, int, int]],
+        blocked: Sequence[Tuple[int, bool]] = (),
+    ) -> None:
+        for user_id, seen, n in rows:
+            user = self._users.get(user_id)
+            if user is not None:
+                user["last_seen_at"] = max(user["last_seen_at"] or 0, seen)
+                user["interactions"] += n
+        for user_id, b in blocked:
+            await self.set_blocked(user_id, b)
+
+    async def set_blocked(self, user_id: int, blocked: bool) -> None:
+        user = self._users.get(user_id)
+        if user is not None:
+            user["blocked"] = 1 if blocked else 0
+
+    # ---------- постбэки ----------
+
+    async def add_postback(self, user_id: int, event_type: str, payload: str, ts: int) -> int:
+        if user_id not in self._users:
+            # как внешний ключ postbacks.user_id в SQLite
+            raise sqlite3.IntegrityError("FOREIGN KEY constraint failed")
+        postback_id = self._postback_seq + 1
+        self._store_postback((postback_id, user_id, event_type, payload, ts))
+        return postback_id
+
+    async def add_postbacks(self, rows: Sequence[SpoolRow]) -> Tuple[int, List[SpoolRow]]:
+        inserted, rejected = 0, []
+        for row in rows:
+            spool_id, user_id, event_type, payload, ts = row
+            if user_id not in self._users:
+                rejected.append(row)
+            elif spool_id not in self._spool_ids:
+                self._spool_ids.add(spool_id)
+                await self.add_postback(user_id, event_type, payload, ts)
+                inserted += 1
+        return inserted, rejected
+
+    # ---------- анкеты мини-аппа ----------
+
+    async def upsert_user_profile(self, user_id: int, full_name: str, account_id: str, tg_handle: str, geo: str) -> None:
+        ts = int(time.time())
+        profile = self._profiles.get(user_id)
+        if profile is None:
+            self._profiles[user_id] = {
+                "user_id": user_id, "full_name": full_name, "account_id": account_id,
+                "tg_handle": tg_handle, "geo": geo, "created_at": ts, "updated_at": ts,
+            }
+            return
+        profile.update(full_name=full_name, account_id=account_id, tg_handle=tg_handle, geo=geo, updated_at=ts)
+
+    async def get_user_profile(self, user_id: int) -> Optional[Dict[str, Any]]:
+        profile = self._profiles.get(user_id)
+        return dict(profile) if profile else None
+
+    # ---------- рассылки ----------
+
+    async def create_broadcast(
+        self,
+        author_id: int,
+        text: str,
+        markup_json: str,
+        filter_json: str,
+        ts: int,
+        *,
+        payload_json: Optional[str] = None,
+        variants: Sequence[Tuple[str, str]] = (),
+        fallback_lang: Optional[str] = None,
+        status: str = "draft",
+        scheduled_for: Optional[int] = None,
+        quiet_hours: Optional[str] = None,
+        max_rate: Optional[float] = None,
+    ) -> int:
+        self._broadcast_seq += 1
+        broadcast_id = self._broadcast_seq
+        row = dict.fromkeys(BROADCAST_COLUMNS)
+        row.update(
+            id=broadcast_id, author_id=author_id, text=text, markup_json=markup_json, filter_json=filter_json,
+            payload_json=payload_json, fallback_lang=fallback_lang, scheduled_for=scheduled_for,
+            quiet_hours=quiet_hours, max_rate=max_rate, status=status, total=0, sent=0, failed=0, created_at=ts,
+        )
+        self._broadcasts[broadcast_id] = row
+        if variants:
+            self._variants[broadcast_id] = dict(variants)
+        return broadcast_id
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        row = self._broadcasts.get(broadcast_id)
+        return dict(row) if row else None
+
+    async def get_broadcast_variants(self, broadcast_id: int) -> Dict[str, str]:
+        return dict(self._variants.get(broadcast_id, {}))
+
+    async def set_broadcast_counts(
+        self,
+        broadcast_id: int,
+        *,
+        total: int,
+        sent: int,
+        failed: int,
+        cursor: Optional[Tuple[str, int]] = None,
+    ) -> None:
+        row = self._broadcasts.get(broadcast_id)
+        if row is None:
+            return
+        row.update(total=total, sent=sent, failed=failed)
+        if cursor is not None:
+            row["cursor_lang"], row["cursor_user_id"] = cursor
+
+    async def set_broadcast_status(
+        self,
+        broadcast_id: int,
+        status: str,
+        *,
+        started_at: Optional[int] = None,
+        finished_at: Optional[int] = None,
+    ) -> None:
+        row = self._broadcasts.get(broadcast_id)
+        if row is None:
+            return
+        row["status"] = status
+        if started_at is not None:
+            row["started_at"] = started_at
+        if finished_at is not None:
+            row["finished_at"] = finished_at
+
+    async def due_broadcasts(self, now: int) -> List[Dict[str, Any]]:
+        rows = [
+            r for r in self._broadcasts.values()
+            if r["status"] == "scheduled" and (r["scheduled_for"] or 0) <= now
+        ]
+        return [dict(r) for r in sorted(rows, key=_schedule_key)]
+
+    async def pending_broadcasts(self, limit: int = 10) -> List[Dict[str, Any]]:
+        rows = [r for r in self._broadcasts.values() if r["status"] in ("running", "scheduled")]
+        return [{k: r[k] for k in PENDING_BROADCAST_COLUMNS} for r in sorted(rows, key=_schedule_key)[:limit]]
+
+    async def reschedule_broadcast(self, broadcast_id: int, scheduled_for: int) -> None:
+        row = self._broadcasts.get(broadcast_id)
+        if row is not None:
+            row.update(status="scheduled", scheduled_for=scheduled_for)
+
+    async def requeue_interrupted_broadcasts(self) -> int:
+        n = 0
+        for row in self._broadcasts.values():
+            if row["status"] == "running":
+                row["status"] = "scheduled"
+                n += 1
+        return n
+
+    async def cancel_broadcast(self, broadcast_id: int, ts: int) -> bool:
+        row = self._broadcasts.get(broadcast_id)
+        if row is None or row["status"] not in CANCELLABLE_STATUSES:
+            return False
+        row.update(status="cancelled", finished_at=ts)
+        return True
+
+    # ---------- ref-коды ----------
+
+    async def top_ref_codes(self, metric: str = "users", limit: int = 10) -> List[Dict[str, Any]]:
+        # при равенстве — ref_code по убыванию, как обратный проход idx_ref_counters_metric
+        ranked = sorted(
+            ((n, ref) for (ref, m), n in self._ref_counters.items() if m == metric and n > 0),
+            reverse=True,
+        )[:limit]
+        rows: Dict[str, Dict[str, Any]] = {ref: {"ref_code": ref} for _, ref in ranked}
+        for (ref, m), n in self._ref_counters.items():
+            if ref in rows:
+                rows[ref][m] = n
+        return [rows[ref] for _, ref in ranked]
+
+    # ---------- сегменты ----------
+
+    def _segment_users(self, segment: Segment) -> List[Dict[str, Any]]:
+        events = self._events
+        profiles = self._profiles
+        return [
+            u for u in self._users.values()
+            if segment.matches(
+                u,
+                events=events.get(u["user_id"], ()),
+                geo=profiles[u["user_id"]]["geo"] if u["user_id"] in profiles else None,
+            )
+        ]
+
+    async def count_segment(self, segment: Segment) -> int:
+        return len(self._segment_users(segment))
+
+    async def iter_segment_user_ids(
+        self,
+        segment: Segment,
+        *,
+        after_user_id: int = 0,
+        batch: int = 500,
+    ) -> AsyncIterator[List[int]]:
+        ids = sorted(u["user_id"] for u in self._segment_users(segment) if u["user_id"] > after_user_id)
+        for i in range(0, len(ids), batch):
+            yield ids[i:i + batch]
+
+    async def iter_segment_recipients(
+        self,
+        segment: Segment,
+        *,
+        after: Tuple[str, int] = ("", 0),
+        batch: int = 500,
+    ) -> AsyncIterator[List[Tuple[int, str]]]:
+        keys = sorted((u["lang"], u["user_id"]) for u in self._segment_users(segment))
+        keys = [k for k in keys if k > tuple(after)]
+        for i in range(0, len(keys), batch):
+            yield [(user_id, lang) for lang, user_id in keys[i:i + batch]]
+
+    # ---------- выгрузки ----------
+
+    def _export_source(self, kind: str) -> List[Tuple[Any, ...]]:
+        if kind == "postbacks":
+            return list(self._postbacks.values())
+        table = self._users if kind == "users" else self._profiles
+        columns = export_columns(kind)
+        return [tuple(row[c] for c in columns) for row in table.values()]
+
+    async def iter_export_rows(
+        self,
+        kind: str,
+        *,
+        date_from: Optional[int] = None,
+        date_to: Optional[int] = None,
+        filters: Optional[Dict[str, Sequence[Any]]] = None,
+        batch: int = 1000,
+    ) -> AsyncIterator[List[Tuple[Any, ...]]]:
+        check_export_filters(kind, filters)
+        columns = export_columns(kind)
+        date_idx = columns.index(export_date_column(kind))
+        checks = [(columns.index(c), set(values)) for c, values in (filters or {}).items()]
+        rows = sorted(
+            (
+                row for row in self._export_source(kind)
+                if (date_from is None or row[date_idx] >= date_from)
+                and (date_to is None or row[date_idx] < date_to)
+                and all(row[i] in allowed for i, allowed in checks)
+            ),
+            key=lambda row: row[0],
+        )
+        for i in range(0, len(rows), batch):
+            yield rows[i:i + batch]
@@ -0,0 +1,250 @@
+# app/storage/sqlite.py
+from __future__ import annotations
+
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import aiosqlite
+
+from app import db
+from app.services.segments import Segment
+from app.services.snapshot import SNAPSHOT
+from app.storage.base import Reports, SpoolRow, Storage
+
+# Основной бэкенд: один файл SQLite (WAL) через aiosqlite. SQL и схема живут в app/db.py,
+# здесь — только привязка к интерфейсу и компиляция сегментов в WHERE.
+# Отчёты (reports) читают снимок из app/services/snapshot.py, а не основное соединение.
+
+
+class SqliteStorage(Storage):
+    name = "sqlite"
+
+    async def open(self) -> None:
+        await db.get_db()
+
+    async def close(self) -> None:
+        await db.close_db()
+
+    # ---------- настройки ----------
+
+    async def get_setting(self, key: str) -> Optional[str]:
+        return await db.get_setting(key)
+
+    async def set_setting(self, key: str, value: str) -> None:
+        await db.set_setting(key, value)
+
+    async def get_links(self) -> Dict[str, str]:
+        return await db.get_links()
+
+    async def set_links(
+        self,
+        *,
+        support_url: Optional[str] = None,
+        ref_url: Optional[str] = None,
+        onewin_tok_url: Optional[str] = None,
+    ) -> None:
+        await db.set_links(support_url=support_url, ref_url=ref_url, onewin_tok_url=onewin_tok_url)
+
+    # ---------- пользователи ----------
+
+    async def upsert_user(
+        self,
+        user_id: int,
+        *,
+        username: Optional[str],
+        first_name: Optional[str],
+        last_name: Optional[str],
+        lang: Optional[str],
+        ref_code: Optional[str],
+        ts: int,
+    ) -> None:
+        await db.upsert_user(
+            user_id, username=username, first_name=first_name, last_name=last_name,
+            lang=lang, ref_code=ref_code, ts=ts,
+        )
+
+    async def set_user_lang(self, user_id: int, lang: str, ts: int) -> None:
+        await db.set_user_lang(user_id, lang, ts)
+
+    async def get_user_lang(self, user_id: int) -> str:
+        return await db.get_user_lang(user_id)
+
+    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return await db.get_user(user_id)
+
+    async def count_users_by_lang(self, lang: Optional[str] = None) -> int:
+        return await db.count_users_by_lang(lang)
+
+    async def record_activity(
+        self,
+        rows: Sequence[Tuple[int, int, int]],
+        blocked: Sequence[Tuple[int, bool]] = (),
+    ) -> None:
+        await db.record_activity(rows, blocked)
+
+    async def set_blocked(self, user_id: int, blocked: bool) -> None:
+        await db.set_blocked(user_id, blocked)
+
+    # ---------- постбэки ----------
+
+    async def add_postback(self, user_id: int, event_type: str, payload: str, ts: int) -> int:
+        return await db.add_postback(user_id, event_type, payload, ts)
+
+    async def add_postbacks(self, rows: Sequence[SpoolRow]) -> Tuple[int, List[SpoolRow]]:
+        return await db.add_postbacks(rows)
+
+    # ---------- анкеты мини-аппа ----------
+
+    async def upsert_user_profile(self, user_id: int, full_name: str, account_id: str, tg_handle: str, geo: str) -> None:
+        await db.upsert_user_profile(user_id, full_name, account_id, tg_handle, geo)
+
+    async def get_user_profile(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return await db.get_user_profile(user_id)
+
+    # ---------- рассылки ----------
+
+    async def create_broadcast(
+        self,
+        author_id: int,
+        text: str,
+        markup_json: str,
+        filter_json: str,
+        ts: int,
+        *,
+        payload_json: Optional[str] = None,
+        variants: Sequence[Tuple[str, str]] = (),
+        fallback_lang: Optional[str] = None,
+        status: str = "draft",
+        scheduled_for: Optional[int] = None,
+        quiet_hours: Optional[str] = None,
+        max_rate: Optional[float] = None,
+    ) -> int:
+        return await db.create_broadcast(
+            author_id, text, markup_json, filter_json, ts,
+            payload_json=payload_json, variants=variants, fallback_lang=fallback_lang, status=status,
+            scheduled_for=scheduled_for, quiet_hours=quiet_hours, max_rate=max_rate,
+        )
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        return await db.get_broadcast(broadcast_id)
+
+    async def get_broadcast_variants(self, broadcast_id: int) -> Dict[str, str]:
+        return await db.get_broadcast_variants(broadcast_id)
+
+    async def set_broadcast_counts(
+        self,
+        broadcast_id: int,
+        *,
+        total: int,
+        sent: int,
+        failed: int,
+        cursor: Optional[Tuple[str, int]] = None,
+    ) -> None:
+        await db.set_broadcast_counts(broadcast_id, total=total, sent=sent, failed=failed, cursor=cursor)
+
+    async def set_broadcast_status(
+        self,
+        broadcast_id: int,
+        status: str,
+        *,
+        started_at: Optional[int] = None,
+        finished_at: Optional[int] = None,
+    ) -> None:
+        await db.set_broadcast_status(broadcast_id, status, started_at=started_at, finished_at=finished_at)
+
+    async def due_broadcasts(self, now: int) -> List[Dict[str, Any]]:
+        return await db.due_broadcasts(now)
+
+    async def pending_broadcasts(self, limit: int = 10) -> List[Dict[str, Any]]:
+        return await db.pending_broadcasts(limit)
+
+    async def reschedule_broadcast(self, broadcast_id: int, scheduled_for: int) -> None:
+        await db.reschedule_broadcast(broadcast_id, scheduled_for)
+
+    async def requeue_interrupted_broadcasts(self) -> int:
+        return await db.requeue_interrupted_broadcasts()
+
+    async def cancel_broadcast(self, broadcast_id: int, ts: int) -> bool:
+        return await db.cancel_broadcast(broadcast_id, ts)
+
+    # ---------- ref-коды ----------
+
+    async def top_ref_codes(self, metric: str = "users", limit: int = 10) -> List[Dict[str, Any]]:
+        return await db.top_ref_codes(metric, limit)
+
+    # ---------- сегменты ----------
+
+    async def count_segment(self, segment: Segment) -> int:
+        where, params = segment.compile()
+        return await db.count_segment(where, params)
+
+    def iter_segment_user_ids(
+        self,
+        segment: Segment,
+        *,
+        after_user_id: int = 0,
+        batch: int = 500,
+    ) -> AsyncIterator[List[int]]:
+        where, params = segment.compile()
+        return db.iter_segment_user_ids(where, params, after_user_id=after_user_id, batch=batch)
+
+    def iter_segment_recipients(
+        self,
+        segment: Segment,
+        *,
+        after: Tuple[str, int] = ("", 0),
+        batch: int = 500,
+    ) -> AsyncIterator[List[Tuple[int, str]]]:
+        where, params = segment.compile()
+        return db.iter_segment_recipients(where, params, after=after, batch=batch)
+
+    # ---------- выгрузки ----------
+
+    def iter_export_rows(
+        self,
+        kind: str,
+        *,
+        date_from: Optional[int] = None,
+        date_to: Optional[int] = None,
+        filters: Optional[Dict[str, Sequence[Any]]] = None,
+        batch: int = 1000,
+    ) -> AsyncIterator[List[Tuple[Any, ...]]]:
+        return db.iter_export_rows(kind, date_from=date_from, date_to=date_to, filters=filters, batch=batch)
+
+    # ---------- отчёты ----------
+
+    @asynccontextmanager
+    async def reports(self) -> AsyncIterator[Reports]:
+        async with SNAPSHOT.lease() as (conn, as_of):
+            yield SqliteReports(conn, as_of)
+
+
+class SqliteReports(Reports):
+    """Те же запросы, что у SqliteStorage, но на соединении снимка."""
+
+    def __init__(self, conn: aiosqlite.Connection, as_of: int) -> None:
+        self.conn = conn
+        self.as_of = as_of
+
+    async def count_users_by_lang(self, lang: Optional[str] = None) -> int:
+        return await db.count_users_by_lang(lang, conn=self.conn)
+
+    async def top_ref_codes(self, metric: str = "users", limit: int = 10) -> List[Dict[str, Any]]:
+        return await db.top_ref_codes(metric, limit, conn=self.conn)
+
+    async def count_segment(self, segment: Segment) -> int:
+        where, params = segment.compile()
+        return await db.count_segment(where, params, conn=self.conn)
+
+    def iter_export_rows(
+        self,
+        kind: str,
+        *,
+        date_from: Optional[int] = None,
+        date_to: Optional[int] = None,
+        filters: Optional[Dict[str, Sequence[Any]]] = None,
+        batch: int = 1000,
+    ) -> AsyncIterator[List[Tuple[Any, ...]]]:
+        return db.iter_export_rows(
+            kind, date_from=date_from, date_to=date_to, filters=filters, batch=batch, conn=self.conn,
+        )
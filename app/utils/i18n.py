@@ -1,27 +1,87 @@
 # app/utils/i18n.py
 from __future__ import annotations
 
+import asyncio
 import json
+import string
 from pathlib import Path
-from typing import Dict, Any
+from typing import Any, Callable, Dict
+
+from loguru import logger
 
 from app.config import get_config, SUPPORTED_LANGS, DEFAULT_LANG
 
+LOCALES_DIR = Path(__file__).resolve().parent.parent / "locales"
+
 _LOCALES: dict[str, dict[str, str]] = {}
 _LOADED = False
+_VERSION = 0
 
+# Скомпилированные каталоги: язык -> {ключ: шаблон}, уже с подмешанным дефолтным языком.
+# Шаблон без плейсхолдеров хранится как str, с плейсхолдерами — как _Template.
+_CATALOG: dict[str, dict[str, "str | _Template"]] = {}
 
-def _load_locales() -> None:
-    """Ленивая загрузка JSON-локалей из app/locales/*.json"""
-    global _LOADED, _LOCALES
-    if _LOADED:
-        return
+_FORMATTER = string.Formatter()
+
+
+class _Template:
+    """
+    Шаблон с плейсхолдерами, разобранный один раз при загрузке.
+    Простые {name} компилируем в f-строку (быстрее str.format примерно вдвое),
+    всё остальное ({x:>5}, {x!r}, {a.b}) — через str.format_map, как и раньше.
+    """
+
+    __slots__ = ("raw", "render")
+
+    def __init__(self, raw: str) -> None:
+        self.raw = raw
+        self.render: Callable[[dict[str, Any]], str] = self._build(raw) or raw.format_map
+
+    @staticmethod
+    def _build(raw: str) -> Callable[[dict[str, Any]], str] | None:
+        literals: dict[str, str] = {}
+        pieces: list[str] = []
+        for literal, field, spec, conv in _FORMATTER.parse(raw):
+            if literal:
+                name = f"_l{len(literals)}"
+                literals[name] = literal
+                pieces.append("{" + name + "}")
+            if field is None:
+                continue
+            if spec or conv or not field.isidentifier():
+                return None
+            pieces.append("{p[" + repr(field) + "]}")
+        # литералы передаём значениями по умолчанию — экранировать их в исходнике не нужно
+        args = "".join(f", {n}={n}" for n in literals)
+        return eval(f"lambda p{args}: f{''.join(pieces)!r}", {}, literals)
+
+
+def _compile_template(text: str) -> "str | _Template":
+    if "{" not in text and "}" not in text:
+        return text
+    try:
+        return _Template(text)
+    except ValueError:
+        # одиночная скобка ("Скидка {50%", "a } b") — как и раньше, отдаём текст как есть,
+        # а не валим загрузку всех локалей
+        return text
 
-    base = Path(__file__).resolve().parent.parent / "locales"
+
+def _compile(raw: dict[str, dict[str, str]]) -> dict[str, dict[str, "str | _Template"]]:
+    """Плоские каталоги на каждый поддерживаемый язык: дефолт + свои ключи поверх."""
+    compiled = {lang: {k: _compile_template(v) for k, v in data.items()} for lang, data in raw.items()}
+    default = compiled.get(DEFAULT_LANG, {})
+    return {lang: {**default, **compiled.get(lang, {})} for lang in SUPPORTED_LANGS}
+
+
+def _read_locales(base: Path = LOCALES_DIR, previous: dict[str, dict[str, str]] | None = None) -> dict[str, dict[str, str]]:
+    """
+    Читаем и парсим app/locales/*.json (блокирующий I/O — вне event loop, если можно).
+    Если файл битый (например, его как раз дописывают) — берём прошлую версию этого языка.
+    """
+    raw: dict[str, dict[str, str]] = {}
     if not base.exists():
-        _LOCALES = {}
-        _LOADED = True
-        return
+        return raw
 
     for p in base.glob("*.json"):
         lang = p.stem  # ru.json -> ru
@@ -30,12 +90,48 @@ def _load_locales() -> None:
                 data = json.load(f)
                 if isinstance(data, dict):
                     # ключи в строку, значения в строку
-                    _LOCALES[lang] = {str(k): str(v) for k, v in data.items()}
+                    raw[lang] = {str(k): str(v) for k, v in data.items()}
         except Exception:
             # не валим процесс: просто пропустим битую локаль
+            if previous and lang in previous:
+                raw[lang] = previous[lang]
             continue
+    return raw
 
+
+def _build_catalog() -> tuple[dict[str, dict[str, str]], dict[str, dict[str, "str | _Template"]]]:
+    raw = _read_locales(previous=_LOCALES)
+    return raw, _compile(raw)
+
+
+def _swap(raw: dict[str, dict[str, str]], catalog: dict[str, dict[str, "str | _Template"]]) -> int:
+    """
+    Подменяем каталог одним присваиванием: конкурентный t() видит
+    либо старую, либо новую версию целиком — пустого каталога не бывает.
+    """
+    global _LOCALES, _CATALOG, _LOADED, _VERSION
+    _LOCALES = raw
+    _CATALOG = catalog
+    _VERSION += 1
     _LOADED = True
+    return _VERSION
+
+
+def _load_locales() -> None:
+    """Ленивая загрузка JSON-локалей из app/locales/*.json"""
+    if _LOADED:
+        return
+    _swap(*_build_catalog())
+
+
+def locale_version() -> int:
+    """
+    Версия загруженных локалей (растёт при каждой перезагрузке).
+    Кеши, построенные из t() (например, клавиатуры), сверяются с ней.
+    """
+    if not _LOADED:
+        _load_locales()
+    return _VERSION
 
 
 def langs() -> tuple[str, ...]:
@@ -50,52 +146,75 @@ def _pick_lang(lang: str | None) -> str:
     return lang if lang in SUPPORTED_LANGS else DEFAULT_LANG
 
 
+def _catalog(lang: str | None) -> dict[str, "str | _Template"]:
+    cat = _CATALOG.get(lang) if lang else None
+    if cat is None:
+        if not _LOADED:
+            _load_locales()
+        cat = _CATALOG.get(_pick_lang(lang), {})
+    return cat
+
+
 def t(key: str, *, lang: str | None = None, **params: Any) -> str:
     """
     Перевод по ключу:
       - сначала язык пользователя
-      - потом дефолтный язык
+      - потом дефолтный язык (уже подмешан в каталог при загрузке)
       - потом сам ключ (как fallback для отладки)
-    Подстановки — через .format(**params)
+    Подстановки — через заранее разобранный шаблон (эквивалент .format(**params))
     """
-    _load_locales()
-    l = _pick_lang(lang)
-
-    # 1) точное совпадение языка
-    text = _LOCALES.get(l, {}).get(key)
-    # 2) fallback на дефолт
-    if text is None and l != DEFAULT_LANG:
-        text = _LOCALES.get(DEFAULT_LANG, {}).get(key)
-    # 3) крайний случай — вернуть ключ
-    if text is None:
-        text = key
-
+    text = _catalog(lang).get(key, key)
+    if type(text) is str:
+        return text
+    if not params:
+        return text.raw
     try:
-        if params:
-            text = text.format(**params)
+        return text.render(params)
     except Exception:
         # при ошибке форматирования вернём как есть
-        pass
-    return text
+        return text.raw
 
 
 def has_key(key: str, *, lang: str | None = None) -> bool:
     """Проверка наличия ключа в указанной локали (или в дефолтной)."""
-    _load_locales()
-    l = _pick_lang(lang)
-    if key in _LOCALES.get(l, {}):
-        return True
-    if l != DEFAULT_LANG and key in _LOCALES.get(DEFAULT_LANG, {}):
-        return True
-    return False
-
-
-def reload_locales() -> None:
-    """Горячая перезагрузка словарей (на будущее из админки)."""
-    global _LOADED, _LOCALES
-    _LOADED = False
-    _LOCALES = {}
-    _load_locales()
+    return key in _catalog(lang)
+
+
+def reload_locales() -> int:
+    """Синхронная перезагрузка словарей (старый каталог работает до подмены)."""
+    return _swap(*_build_catalog())
+
+
+async def areload_locales() -> int:
+    """Перезагрузка без блокировки event loop: чтение и компиляция — в потоке, подмена — атомарно."""
+    raw, catalog = await asyncio.to_thread(_build_catalog)
+    return _swap(raw, catalog)
+
+
+def _locales_fingerprint(base: Path = LOCALES_DIR) -> tuple[tuple[str, int, int], ...]:
+    if not base.exists():
+        return ()
+    stats = ((p.name, p.stat()) for p in base.glob("*.json"))
+    return tuple(sorted((name, st.st_mtime_ns, st.st_size) for name, st in stats))
+
+
+async def watch_locales(interval: float) -> None:
+    """
+    Фоновый вотчер: раз в interval секунд сверяет mtime/размер файлов локалей
+    и при изменении перезагружает каталог. Отменяется через task.cancel().
+    """
+    last = await asyncio.to_thread(_locales_fingerprint)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            current = await asyncio.to_thread(_locales_fingerprint)
+            if current == last:
+                continue
+            last = current
+            version = await areload_locales()
+            logger.info("Локали перезагружены (изменились файлы), версия {}", version)
+        except Exception as e:
+            logger.warning("Не удалось перезагрузить локали: {}", e)
 
 
 def example_bootstrap() -> None:
@@ -1,33 +1,152 @@
 # app/utils/logging.py
 from __future__ import annotations
 
+import json
 import logging
 import sys
+import threading
+import time
 from pathlib import Path
+from typing import Any, Dict, List, Union
 
 from loguru import logger
 
 from app.config import get_config
 
+# файлы, кадры которых пропускаем при поиске реального места вызова
+_LOGGING_FILES = frozenset({logging.__file__, __file__})
+
+_LEVEL_NOS = {"TRACE": 5, "DEBUG": 10, "INFO": 20, "SUCCESS": 25, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+# минимальный уровень, который реально пишут sink'и (выставляется в setup_logging)
+_MIN_LEVEL_NO = logging.DEBUG
+
 
 class InterceptHandler(logging.Handler):
     """Перекидываем стандартный logging в loguru, чтобы все логи были едиными."""
 
+    # levelno -> имя уровня loguru (logger.level() на каждую запись — лишний lookup)
+    _LEVEL_NAMES: Dict[int, Union[str, int]] = {}
+
     def emit(self, record: logging.LogRecord) -> None:
-        try:
-            level = logger.level(record.levelname).name
-        except Exception:
-            level = record.levelno
+        # быстрый путь: уровень всё равно отфильтрован — не ходим по стеку и не строим запись
+        if record.levelno < _MIN_LEVEL_NO:
+            return
+
+        level = self._LEVEL_NAMES.get(record.levelno)
+        if level is None:
+            try:
+                level = logger.level(record.levelname).name
+            except Exception:
+                level = record.levelno
+            self._LEVEL_NAMES[record.levelno] = level
 
         frame, depth = logging.currentframe(), 2
         # идём вверх по стеку, чтобы source в логах указывал на реальный вызов, а не на этот хендлер
-        while frame and frame.f_code.co_filename == __file__:
+        while frame and frame.f_code.co_filename in _LOGGING_FILES:
             frame = frame.f_back
             depth += 1
 
         logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
 
 
+# ===== Сэмплирование для горячих путей =====
+
+# ключ -> [время последней записи, сколько подавили с тех пор]
+_SAMPLED: Dict[str, list] = {}
+
+
+def log_sampled(key: str, message: str, *args: Any, level: str = "DEBUG", every: float = 60.0) -> None:
+    """
+    Не чаще одного сообщения на key раз в every секунд (остальные считаем и
+    дописываем «+N подавлено»). Если уровень выключен — выходим сразу, без форматирования.
+    Для debug-логов в хендлерах, которые срабатывают на каждый апдейт.
+    """
+    if _LEVEL_NOS.get(level, logging.DEBUG) < _MIN_LEVEL_NO:
+        return
+    now = time.monotonic()
+    slot = _SAMPLED.get(key)
+    if slot is not None and now - slot[0] < every:
+        slot[1] += 1
+        return
+    suppressed = slot[1] if slot is not None else 0
+    _SAMPLED[key] = [now, 0]
+    if suppressed:
+        message += f" (+{suppressed} подавлено за {every:.0f}s)"
+    logger.opt(depth=1).log(level, message, *args)
+
+
+# ===== JSON-лог с пакетной записью =====
+
+class BatchedJsonSink:
+    """
+    Структурированный лог: одна JSON-строка на запись, пишем пачками —
+    по batch_size записей или раз в flush_interval секунд (фоновый поток).
+    Loguru вызывает write() из своего потока (enqueue=True), stop() — при logger.remove().
+    Метода flush() намеренно нет: loguru дёргал бы его после каждой записи.
+    """
+
+    def __init__(self, path: Path, batch_size: int = 256, flush_interval: float = 1.0) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = path.open("a", encoding="utf-8")
+        self._batch_size = batch_size
+        self._buf: List[str] = []
+        self._lock = threading.Lock()      # буфер
+        self._io_lock = threading.Lock()   # файл: пишут и поток loguru, и фоновый flusher
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, args=(flush_interval,), daemon=True)
+        self._flusher.start()
+
+    @staticmethod
+    def _serialize(message: Any) -> str:
+        r = message.record
+        item = {
+            "ts": r["time"].timestamp(),
+            "level": r["level"].name,
+            "logger": r["name"],
+            "func": r["function"],
+            "line": r["line"],
+            "msg": r["message"],
+        }
+        if r["extra"]:
+            item["extra"] = {k: str(v) for k, v in r["extra"].items()}
+        if r["exception"] is not None:
+            item["exc"] = repr(r["exception"].value)
+        return json.dumps(item, ensure_ascii=False)
+
+    def write(self, message: Any) -> None:
+        line = self._serialize(message)
+        with self._lock:
+            self._buf.append(line)
+            if len(self._buf) < self._batch_size:
+                return
+            batch, self._buf = self._buf, []
+        self._write(batch)
+
+    def _write(self, batch: List[str]) -> None:
+        if batch:
+            with self._io_lock:
+                self._fh.write("\n".join(batch) + "\n")
+                self._fh.flush()
+
+    def drain(self) -> None:
+        with self._lock:
+            batch, self._buf = self._buf, []
+        self._write(batch)
+
+    def _flush_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.drain()
+            except Exception:
+                pass
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.drain()
+        self._fh.close()
+
+
 def _std_to_loguru(level: str) -> int:
     """Преобразуем строковый уровень в int для std logging."""
     return getattr(logging, level.upper(), logging.INFO)
@@ -35,14 +154,16 @@ def _std_to_loguru(level: str) -> int:
 
 def setup_logging() -> None:
     """Единая настройка логов: stdout + файл с ротацией. Уровень берём из ENV."""
+    global _MIN_LEVEL_NO
     cfg = get_config()
+    _MIN_LEVEL_NO = _std_to_loguru(cfg.log_level)
 
     # 1) Глушим стандартные хендлеры
     logging.root.handlers = []
     logging.root.setLevel(_std_to_loguru(cfg.log_level))
 
     # 2) Перехват стандартного logging в loguru
-    intercept = InterceptHandler()
+    intercept = InterceptHandler(level=_MIN_LEVEL_NO)
     for name in ("aiogram", "aiohttp", "asyncio"):
         logging.getLogger(name).handlers = [intercept]
         logging.getLogger(name).propagate = False
@@ -78,4 +199,13 @@ def setup_logging() -> None:
         format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {name}:{function}:{line} | {message}",
     )
 
+    # 5) Опционально — структурированный JSON-лог с пакетной записью
+    if cfg.log_json_path:
+        logger.add(
+            BatchedJsonSink(Path(cfg.log_json_path), batch_size=cfg.log_json_batch),
+            level=cfg.log_level,
+            enqueue=True,
+            format="{message}",
+        )
+
     logger.debug("Логирование инициализировано. Уровень: {}", cfg.log_level)
@@ -0,0 +1,204 @@
+# app/utils/sql_profiler.py
+from __future__ import annotations
+
+import re
+import sqlite3
+import time
+import weakref
+from dataclasses import dataclass, field
+from functools import partial
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+
+import aiosqlite
+from loguru import logger
+
+from app.services.metrics import REGISTRY
+
+# Профилировщик SQL поверх aiosqlite.
+# Каждая операция уходит в поток соединения через очередь; мы меряем отдельно
+#   - ожидание в очереди (от постановки до старта в потоке)
+#   - само выполнение в потоке (execute + последующие fetch* того же курсора)
+#   - число возвращённых строк
+# и агрегируем по нормализованному тексту запроса.
+
+DB_QUEUE_WAIT = REGISTRY.histogram("db_queue_wait_seconds", "Time a DB operation waited for the aiosqlite thread")
+DB_EXEC = REGISTRY.histogram("db_exec_seconds", "Time a DB operation spent executing in the aiosqlite thread")
+
+_WS_RE = re.compile(r"\s+")
+_STR_RE = re.compile(r"'(?:[^']|'')*'")
+_NUM_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+
+_SQL_METHODS = frozenset({"execute", "executemany", "executescript", "_execute_fetchall", "_execute_insert"})
+_FETCH_METHODS = frozenset({"fetchone", "fetchmany", "fetchall"})
+
+
+def normalize_sql(sql: str) -> str:
+    """Схлопываем пробелы и литералы, чтобы одинаковые запросы попадали в одну строку статистики."""
+    s = _WS_RE.sub(" ", sql).strip().rstrip(";")
+    s = _STR_RE.sub("?", s)
+    s = _NUM_RE.sub("?", s)
+    return _IN_RE.sub("IN (?...)", s)
+
+
+@dataclass
+class StatementStats:
+    sql: str
+    calls: int = 0
+    wait_total: float = 0.0
+    exec_total: float = 0.0
+    exec_max: float = 0.0
+    rows: int = 0
+    slow: int = 0
+    plan: Optional[List[str]] = field(default=None)
+
+    @property
+    def total(self) -> float:
+        return self.wait_total + self.exec_total
+
+
+class SqlProfiler:
+    def __init__(self, slow_ms: float = 100.0) -> None:
+        self.slow_s = slow_ms / 1000.0
+        self._stats: Dict[str, StatementStats] = {}
+        self._lock = Lock()
+
+    def _get(self, key: str) -> StatementStats:
+        st = self._stats.get(key)
+        if st is None:
+            st = StatementStats(sql=key)
+            self._stats[key] = st
+        return st
+
+    def record(self, key: str, *, wait: float, exec_: float, rows: int, new_call: bool) -> StatementStats:
+        DB_QUEUE_WAIT.observe(wait)
+        DB_EXEC.observe(exec_)
+        with self._lock:
+            st = self._get(key)
+            if new_call:
+                st.calls += 1
+            st.wait_total += wait
+            st.exec_total += exec_
+            st.exec_max = max(st.exec_max, exec_)
+            st.rows += rows
+            return st
+
+    def top(self, n: int = 10) -> List[StatementStats]:
+        """Топ-N запросов по суммарному времени (ожидание + выполнение)."""
+        with self._lock:
+            items = list(self._stats.values())
+        return sorted(items, key=lambda s: s.total, reverse=True)[:n]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+PROFILER = SqlProfiler()
+
+
+class _CursorInfo:
+    __slots__ = ("key", "sql", "params", "exec_total", "flagged")
+
+    def __init__(self, key: str, sql: str, params: Any) -> None:
+        self.key = key
+        self.sql = sql
+        self.params = params
+        self.exec_total = 0.0
+        self.flagged = False
+
+
+def _rows_of(result: Any) -> int:
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple)) and (not result or isinstance(result[0], (tuple, sqlite3.Row))):
+        return len(result)
+    if isinstance(result, (tuple, sqlite3.Row)):
+        return 1
+    return 0
+
+
+class ProfiledConnection(aiosqlite.Connection):
+    """
+    aiosqlite.Connection, у которого каждая операция в потоке обёрнута замером.
+    Снаружи ведёт себя как обычное соединение.
+    """
+
+    def __init__(self, connector: Callable[[], sqlite3.Connection], iter_chunk_size: int, profiler: SqlProfiler) -> None:
+        super().__init__(connector, iter_chunk_size)
+        self._profiler = profiler
+        # курсор sqlite3 -> какой запрос он выполняет (только из потока соединения)
+        self._cursors: "weakref.WeakKeyDictionary[sqlite3.Cursor, _CursorInfo]" = weakref.WeakKeyDictionary()
+
+    async def _execute(self, fn, *args, **kwargs):
+        return await super()._execute(self._profiled, fn, time.perf_counter(), args, kwargs)
+
+    # --- всё ниже выполняется в потоке соединения ---
+
+    def _profiled(self, fn: Callable[..., Any], enqueued: float, args: tuple, kwargs: dict) -> Any:
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        try:
+            self._account(fn, args, result, started - enqueued, elapsed)
+        except Exception:
+            # статистика не должна ломать запросы
+            pass
+        return result
+
+    def _account(self, fn: Callable[..., Any], args: tuple, result: Any, wait: float, elapsed: float) -> None:
+        name = getattr(fn, "__name__", "call")
+        owner = getattr(fn, "__self__", None)
+
+        if name in _SQL_METHODS and args:
+            sql = args[0]
+            params = args[1] if len(args) > 1 and name != "executemany" else ()
+            info = _CursorInfo(normalize_sql(sql), sql, params)
+            info.exec_total = elapsed
+            if isinstance(result, sqlite3.Cursor):
+                self._cursors[result] = info
+            rows = _rows_of(result) if name == "_execute_fetchall" else 0
+            st = self._profiler.record(info.key, wait=wait, exec_=elapsed, rows=rows, new_call=True)
+            self._check_slow(st, info)
+            return
+
+        if name in _FETCH_METHODS and isinstance(owner, sqlite3.Cursor):
+            info = self._cursors.get(owner)
+            if info is not None:
+                info.exec_total += elapsed
+                st = self._profiler.record(info.key, wait=wait, exec_=elapsed, rows=_rows_of(result), new_call=False)
+                self._check_slow(st, info)
+                return
+
+        if name == "close" and isinstance(owner, sqlite3.Cursor):
+            self._cursors.pop(owner, None)
+            return
+
+        self._profiler.record(name.upper(), wait=wait, exec_=elapsed, rows=0, new_call=True)
+
+    def _check_slow(self, st: StatementStats, info: _CursorInfo) -> None:
+        # курсор, который читают порциями, логируем один раз
+        if info.flagged or info.exec_total < self._profiler.slow_s:
+            return
+        info.flagged = True
+        st.slow += 1
+        explainable = ";" not in info.sql.strip().rstrip(";") and not info.key.upper().startswith(("PRAGMA", "EXPLAIN"))
+        if st.plan is None and explainable:
+            st.plan = self._explain(info.sql, info.params)
+        logger.warning(
+            "Slow SQL {:.1f} ms (rows so far {}): {} | plan: {}",
+            info.exec_total * 1000, st.rows, info.key, "; ".join(st.plan or []) or "-",
+        )
+
+    def _explain(self, sql: str, params: Any) -> List[str]:
+        try:
+            rows = self._conn.execute("EXPLAIN QUERY PLAN " + sql, params or ()).fetchall()
+            return [str(r[-1]) for r in rows]
+        except Exception as e:
+            return [f"explain failed: {e}"]
+
+
+def connect(database: str, *, profiler: SqlProfiler = PROFILER, iter_chunk_size: int = 64, **kwargs: Any) -> ProfiledConnection:
+    """Аналог aiosqlite.connect(), но с профилированием запросов."""
+    return ProfiledConnection(partial(sqlite3.connect, database, **kwargs), iter_chunk_size, profiler)
@@ -0,0 +1,65 @@
+# app/utils/startup.py
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Iterator, List, Tuple, TypeVar
+
+from loguru import logger
+
+# Модуль импортируется первым в app/main.py: момент его импорта — точка отсчёта старта.
+_T0 = time.perf_counter()
+
+T = TypeVar("T")
+
+
+class StartupReport:
+    """
+    Разбивка старта по фазам: (имя, смещение от начала, длительность).
+    Фазы могут пересекаться — часть шагов идёт параллельно.
+    """
+
+    def __init__(self, t0: float = _T0) -> None:
+        self.t0 = t0
+        self.phases: List[Tuple[str, float, float]] = []
+
+    def record(self, name: str, started: float, finished: float) -> None:
+        self.phases.append((name, started - self.t0, finished - started))
+
+    def mark(self, name: str) -> None:
+        """Фаза от точки отсчёта до текущего момента (например, импорты)."""
+        self.record(name, self.t0, time.perf_counter())
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started, time.perf_counter())
+
+    async def timed(self, name: str, aw: Awaitable[T]) -> T:
+        started = time.perf_counter()
+        try:
+            return await aw
+        finally:
+            self.record(name, started, time.perf_counter())
+
+    def total(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def render(self) -> str:
+        phases = sorted(self.phases, key=lambda p: p[1])
+        lines = [f"  {name:<18} +{offset * 1000:7.1f} ms  {dur * 1000:8.1f} ms" for name, offset, dur in phases]
+        return "\n".join(lines)
+
+    def log(self, title: str = "Старт") -> None:
+        from app.services.metrics import REGISTRY
+
+        gauge = REGISTRY.gauge("startup_phase_seconds", "Duration of startup phases", ("phase",))
+        for name, _, dur in self.phases:
+            gauge.set(dur, name)
+        logger.info("{} за {:.0f} ms (фаза, смещение, длительность):\n{}", title, self.total() * 1000, self.render())
+
+
+STARTUP = StartupReport()
@@ -0,0 +1,80 @@
+# bench/__main__.py
+"""
+Бенчмарки app/db.py, i18n, клавиатур и полного пути /start (через фейковый Bot).
+
+  python -m bench run --sizes 10k,1m,5m --seed 42 --out bench_results/new.json
+  python -m bench run --only db.get_user,i18n.    # только кейсы с такими префиксами
+  python -m bench run --backends sqlite,memory   # те же кейсы на каждом бэкенде хранилища
+  python -m bench compare bench_results/base.json bench_results/new.json --threshold 0.1
+  python -m bench conformance --backends sqlite,memory   # одинаковое поведение бэкендов
+
+Синтетические БД кешируются в .bench/ (5m строится пару минут и весит ~1 ГБ).
+compare завершается с кодом 1, если есть регрессии больше порога, conformance — если есть провалы.
+"""
+from __future__ import annotations
+
+import bench.env  # noqa: F401  # заглушки .env до импорта app.*
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+from bench.runner import compare, load, run_sync, save
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_run = sub.add_parser("run", help="прогнать бенчмарки")
+    p_run.add_argument("--sizes", default="10k", help="размеры БД через запятую: 10k,100k,1m,5m")
+    p_run.add_argument("--seed", type=int, default=42)
+    p_run.add_argument("--backends", default="sqlite", help="бэкенды хранилища через запятую: sqlite,memory")
+    p_run.add_argument("--only", default="", help="префиксы имён кейсов через запятую")
+    p_run.add_argument("--min-time", type=float, default=0.5, help="секунд на кейс (минимум)")
+    p_run.add_argument("--max-iter", type=int, default=20_000)
+    p_run.add_argument("--out", type=Path, default=Path("bench_results/latest.json"))
+
+    p_cmp = sub.add_parser("compare", help="сравнить два прогона")
+    p_cmp.add_argument("base", type=Path)
+    p_cmp.add_argument("new", type=Path)
+    p_cmp.add_argument("--threshold", type=float, default=0.10, help="допустимый рост (0.1 = +10%%)")
+    p_cmp.add_argument("--metric", default="p50_us", choices=("p50_us", "p95_us", "mean_us", "min_us"))
+
+    p_conf = sub.add_parser("conformance", help="проверить бэкенды хранилища на одинаковое поведение")
+    p_conf.add_argument("--backends", default="sqlite,memory", help="бэкенды через запятую")
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "run":
+        data = run_sync(
+            [s for s in args.sizes.split(",") if s],
+            seed=args.seed,
+            backends=[b for b in args.backends.split(",") if b],
+            only=[p for p in args.only.split(",") if p] or None,
+            min_time=args.min_time,
+            max_iter=args.max_iter,
+        )
+        save(data, args.out)
+        print(f"saved -> {args.out}")
+        return 0
+
+    if args.cmd == "conformance":
+        from bench import conformance
+
+        failures = asyncio.run(conformance.run([b for b in args.backends.split(",") if b]))
+        return 1 if any(failures.values()) else 0
+
+    regressions = compare(load(args.base), load(args.new), threshold=args.threshold, metric=args.metric)
+    if regressions:
+        print("\nРегрессии:")
+        for line in regressions:
+            print("  " + line)
+        return 1
+    print("\nРегрессий нет.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
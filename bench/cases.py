@@ -0,0 +1,489 @@
+# bench/cases.py
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import json
+import random
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+from urllib.parse import parse_qsl, urlsplit
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Chat, Message, Update, User
+
+from app.config import SUPPORTED_LANGS
+from app.keyboards import lang_keyboard, main_menu_keyboard
+from app.services.exports import ExportStream, export_url, parse_export, parse_export_query
+from app.services.segments import Segment
+from app.storage import get_storage
+from app.utils import i18n
+from app.utils.i18n import _compile_template, locale_version, t
+
+from bench.synthetic import USER_ID_BASE
+
+
+@dataclass
+class Ctx:
+    """Общее состояние прогона на одной синтетической БД."""
+
+    rng: random.Random
+    n_users: int
+    bot: Bot
+    dp: Dispatcher
+    seq: int = 0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def existing_uid(self) -> int:
+        return USER_ID_BASE + self.rng.randrange(self.n_users)
+
+    def fresh_uid(self) -> int:
+        # новые пользователи — за пределами синтетического диапазона
+        self.seq += 1
+        return USER_ID_BASE + self.n_users + self.seq
+
+    def lang(self) -> str:
+        return SUPPORTED_LANGS[self.rng.randrange(len(SUPPORTED_LANGS))]
+
+
+CaseFn = Callable[[Ctx], Union[Awaitable[Any], Any]]
+
+
+@dataclass
+class Case:
+    name: str
+    fn: CaseFn
+    # для тяжёлых запросов (полные сканы) хватит нескольких итераций
+    max_iter: Optional[int] = None
+    # для sub-микросекундных синхронных кейсов меряем пачкой и делим
+    batch: int = 1
+
+
+CASES: List[Case] = []
+
+
+def case(name: str, *, max_iter: Optional[int] = None, batch: int = 1) -> Callable[[CaseFn], CaseFn]:
+    def deco(fn: CaseFn) -> CaseFn:
+        CASES.append(Case(name, fn, max_iter, batch))
+        return fn
+    return deco
+
+
+# ===== хранилище (app/storage) =====
+# имена db.* остались прежними — чтобы compare работал со старыми прогонами
+
+@case("db.get_setting")
+async def _get_setting(ctx: Ctx) -> None:
+    await get_storage().get_setting("support_url")
+
+
+@case("db.set_setting")
+async def _set_setting(ctx: Ctx) -> None:
+    await get_storage().set_setting("bench_key", str(ctx.rng.random()))
+
+
+@case("db.get_links")
+async def _get_links(ctx: Ctx) -> None:
+    await get_storage().get_links()
+
+
+@case("db.set_links")
+async def _set_links(ctx: Ctx) -> None:
+    await get_storage().set_links(support_url="https://example.com/support")
+
+
+@case("db.upsert_user.existing")
+async def _upsert_existing(ctx: Ctx) -> None:
+    await get_storage().upsert_user(
+        ctx.existing_uid(), username="u", first_name="F", last_name=None,
+        lang=None, ref_code=None, ts=1_800_000_000,
+    )
+
+
+@case("db.upsert_user.new")
+async def _upsert_new(ctx: Ctx) -> None:
+    await get_storage().upsert_user(
+        ctx.fresh_uid(), username="u", first_name="F", last_name=None,
+        lang=None, ref_code="bench", ts=1_800_000_000,
+    )
+
+
+@case("db.set_user_lang")
+async def _set_user_lang(ctx: Ctx) -> None:
+    await get_storage().set_user_lang(ctx.existing_uid(), ctx.lang(), 1_800_000_000)
+
+
+@case("db.get_user_lang")
+async def _get_user_lang(ctx: Ctx) -> None:
+    await get_storage().get_user_lang(ctx.existing_uid())
+
+
+@case("db.get_user")
+async def _get_user(ctx: Ctx) -> None:
+    await get_storage().get_user(ctx.existing_uid())
+
+
+@case("db.count_users_by_lang.all", max_iter=20)
+async def _count_all(ctx: Ctx) -> None:
+    await get_storage().count_users_by_lang(None)
+
+
+@case("db.count_users_by_lang.one", max_iter=20)
+async def _count_one(ctx: Ctx) -> None:
+    await get_storage().count_users_by_lang(ctx.lang())
+
+
+@case("db.set_blocked")
+async def _set_blocked(ctx: Ctx) -> None:
+    await get_storage().set_blocked(ctx.existing_uid(), False)
+
+
+@case("db.add_postback")
+async def _add_postback(ctx: Ctx) -> None:
+    uid = ctx.existing_uid()
+    await get_storage().add_postback(uid, "ftd", json.dumps({"event": "ftd", "user_id": str(uid)}), 1_800_000_000)
+
+
+@case("db.create_broadcast")
+async def _create_broadcast(ctx: Ctx) -> None:
+    bid = await get_storage().create_broadcast(1, "bench", "{}", "{}", 1_800_000_000)
+    ctx.extra["broadcast_id"] = bid
+
+
+@case("db.set_broadcast_status")
+async def _set_broadcast_status(ctx: Ctx) -> None:
+    bid = ctx.extra.get("broadcast_id") or await get_storage().create_broadcast(1, "bench", "{}", "{}", 1_800_000_000)
+    ctx.extra["broadcast_id"] = bid
+    await get_storage().set_broadcast_status(bid, "running", started_at=1_800_000_000)
+
+
+@case("db.upsert_user_profile")
+async def _upsert_profile(ctx: Ctx) -> None:
+    await get_storage().upsert_user_profile(ctx.existing_uid(), "Name", "acc", "@handle", "RU")
+
+
+@case("db.get_user_profile")
+async def _get_profile(ctx: Ctx) -> None:
+    await get_storage().get_user_profile(ctx.existing_uid())
+
+
+@case("db.top_ref_codes.users")
+async def _top_refs_users(ctx: Ctx) -> None:
+    await get_storage().top_ref_codes("users", 15)
+
+
+@case("db.top_ref_codes.ftd")
+async def _top_refs_ftd(ctx: Ctx) -> None:
+    await get_storage().top_ref_codes("uniq:ftd", 15)
+
+
+# ===== write-behind активности =====
+
+@case("activity.touch", batch=200)
+def _activity_touch(ctx: Ctx) -> None:
+    from app.services.activity import ACTIVITY
+
+    ACTIVITY.touch(ctx.existing_uid(), 1_800_000_000)
+
+
+@case("activity.flush_1k", max_iter=50)
+async def _activity_flush(ctx: Ctx) -> None:
+    from app.services.activity import ActivityTracker
+
+    tracker = ActivityTracker()
+    for _ in range(1_000):
+        tracker.touch(ctx.existing_uid(), 1_800_000_000)
+    await tracker.flush()
+
+
+# ===== спул постбэков =====
+
+@case("spool.append.x100", max_iter=200)
+async def _spool_append(ctx: Ctx) -> None:
+    # 100 одновременных постбэков — один-два групповых fsync
+    from app.services.spool import SPOOL
+
+    uid = ctx.existing_uid()
+    await asyncio.gather(*(SPOOL.append(uid, "ftd", "{}", 1_800_000_000) for _ in range(100)))
+
+
+@case("spool.add_postbacks_5k", max_iter=50)
+async def _spool_add_postbacks(ctx: Ctx) -> None:
+    rows = [
+        (ctx.rng.getrandbits(63), ctx.existing_uid(), "ftd", "{}", 1_800_000_000)
+        for _ in range(5_000)
+    ]
+    await get_storage().add_postbacks(rows)
+
+
+# ===== сегменты рассылок =====
+
+_SEGMENTS = {
+    "lang": Segment(langs=("ru", "en")),
+    "created_window": Segment(created_from=1_710_000_000, created_to=1_712_592_000),
+    "active_30d": Segment(seen_from=1_728_000_000),
+    "ref_has_ftd": Segment(ref_codes=("ref7", "ref42"), has_events=("ftd",)),
+    "geo_has_rtd": Segment(geos=("in", "br"), has_events=("rtd",)),
+}
+
+
+def _segment_case(label: str, segment: Segment) -> None:
+    @case(f"segments.count.{label}", max_iter=20)
+    async def _count(ctx: Ctx) -> None:
+        await get_storage().count_segment(segment)
+
+    @case(f"segments.stream.{label}", max_iter=5)
+    async def _stream(ctx: Ctx) -> None:
+        async for _ in get_storage().iter_segment_user_ids(segment, batch=1000):
+            pass
+
+
+for _label, _segment in _SEGMENTS.items():
+    _segment_case(_label, _segment)
+
+
+# ===== Выгрузки =====
+
+def _export_case(label: str, text: str) -> None:
+    request = parse_export(text)
+
+    @case(f"exports.{label}", max_iter=3)
+    async def _export(ctx: Ctx) -> None:
+        async with aclosing(ExportStream(request).chunks()) as chunks:
+            async for _ in chunks:
+                pass
+
+
+for _label, _text in {
+    "users.csv_gz": "users csv",
+    "users.ndjson_gz": "users ndjson",
+    "postbacks.ftd.csv_gz": "postbacks csv event=ftd",
+}.items():
+    _export_case(_label, _text)
+
+
+# ссылка на HTTP-выгрузку (слишком большой документ) должна разбираться обратно в тот же запрос
+_EXPORT_LINK_NOW = 1_800_000_000
+_EXPORT_LINKS = [
+    parse_export(text, now=_EXPORT_LINK_NOW) for text in (
+        "users csv date=2024-01-01..2024-01-31 lang=ru,en ref=abc blocked=0",
+        "postbacks ndjson date=2024-03-05 event=ftd,rtd user=123,456",
+        "profiles geo=in date=..2024-02-01",
+    )
+]
+
+
+@case("exports.url_roundtrip", batch=20)
+def _export_url_roundtrip(ctx: Ctx) -> None:
+    for request in _EXPORT_LINKS:
+        link = urlsplit(export_url(request) or "")
+        query = dict(parse_qsl(link.query))
+        back = parse_export_query(request.kind, query, now=_EXPORT_LINK_NOW)
+        assert back == request, (export_url(request), back)
+
+
+# ===== i18n =====
+
+@case("i18n.t.hit", batch=200)
+def _t_hit(ctx: Ctx) -> None:
+    t("menu.btn.support", lang="en")
+
+
+@case("i18n.t.fallback", batch=200)
+def _t_fallback(ctx: Ctx) -> None:
+    t("menu.btn.support", lang="xx")
+
+
+@case("i18n.t.missing", batch=200)
+def _t_missing(ctx: Ctx) -> None:
+    t("no.such.key", lang="de")
+
+
+# В локалях пока нет ключей с подстановками — для i18n.t.params подмешиваем
+# синтетический ключ в загруженный каталог (бенч локали не перезагружает).
+_TEMPLATE_RAW = "👤 {name}, ваш баланс: {amount} {currency}"
+_PARAMS_KEY = "bench.balance"
+locale_version()
+i18n._CATALOG["ru"][_PARAMS_KEY] = _compile_template(_TEMPLATE_RAW)
+
+
+@case("i18n.t.params", batch=200)
+def _t_params(ctx: Ctx) -> None:
+    t(_PARAMS_KEY, lang="ru", name="Bench", amount=100, currency="USD")
+
+
+# одиночные скобки в переводах: каталог должен собраться, t() — вернуть текст как есть
+_LONE_BRACES = {"ru": {"promo": "Скидка {50%", "arrow": "a } b", "ok": "{name}!"}}
+
+
+@case("i18n.compile.lone_brace", batch=20)
+def _t_lone_brace(ctx: Ctx) -> None:
+    catalog = i18n._compile(_LONE_BRACES)["ru"]
+    assert catalog["promo"] == "Скидка {50%" and catalog["arrow"] == "a } b", catalog
+    assert catalog["ok"].render({"name": "Bench"}) == "Bench!"
+
+
+@case("i18n.t.all_langs", batch=10)
+def _t_all_langs(ctx: Ctx) -> None:
+    # типичный апдейт: пачка ключей меню на языке пользователя
+    for lang in SUPPORTED_LANGS:
+        t("start.title", lang=lang)
+        t("menu.btn.open_app", lang=lang)
+        t("menu.btn.support", lang=lang)
+        t("menu.btn.site", lang=lang)
+        t("menu.btn.token", lang=lang)
+
+
+_TEMPLATE = _compile_template(_TEMPLATE_RAW)
+
+
+@case("i18n.template.compiled", batch=200)
+def _template_compiled(ctx: Ctx) -> None:
+    _TEMPLATE.render({"name": "Bench", "amount": 100, "currency": "USD"})
+
+
+@case("i18n.template.str_format", batch=200)
+def _template_str_format(ctx: Ctx) -> None:
+    # эталон для сравнения: то, что t() делал раньше на каждый вызов
+    _TEMPLATE_RAW.format(name="Bench", amount=100, currency="USD")
+
+
+# ===== keyboards =====
+
+@case("keyboards.lang_keyboard")
+def _lang_kb(ctx: Ctx) -> None:
+    lang_keyboard()
+
+
+@case("keyboards.main_menu_keyboard")
+async def _main_menu_kb(ctx: Ctx) -> None:
+    await main_menu_keyboard(ctx.lang(), ref_code="bench")
+
+
+# ===== полный путь /start через Dispatcher и фейковый Bot =====
+
+def _start_update(ctx: Ctx, uid: int) -> Update:
+    ctx.seq += 1
+    user = User(id=uid, is_bot=False, first_name="Bench", username="bench")
+    msg = Message(
+        message_id=ctx.seq,
+        date=dt.datetime.now(dt.timezone.utc),
+        chat=Chat(id=uid, type="private"),
+        from_user=user,
+        text="/start ref42",
+    )
+    return Update(update_id=ctx.seq, message=msg)
+
+
+@case("handlers.start.existing_user")
+async def _start_existing(ctx: Ctx) -> None:
+    await ctx.dp.feed_update(ctx.bot, _start_update(ctx, ctx.existing_uid()))
+
+
+@case("handlers.start.new_user")
+async def _start_new(ctx: Ctx) -> None:
+    await ctx.dp.feed_update(ctx.bot, _start_update(ctx, ctx.fresh_uid()))
+
+
+# ===== logging: стоимость одной записи =====
+
+def _log_env(ctx: Ctx) -> Dict[str, Any]:
+    """Один раз на прогон: loguru с null-sink'ом на INFO, перехватчик stdlib, JSON-sink во временный файл."""
+    env = ctx.extra.get("log_env")
+    if env is not None:
+        return env
+
+    import logging
+    import tempfile
+    from pathlib import Path
+
+    from loguru import logger
+
+    from app.utils import logging as app_logging
+
+    min_level = app_logging._MIN_LEVEL_NO
+    app_logging._MIN_LEVEL_NO = logging.INFO
+    null_sink = logger.add(
+        lambda _: None, level="INFO", format="{time} | {level} | {name}:{function}:{line} | {message}",
+    )
+
+    handler = app_logging.InterceptHandler(level=logging.INFO)
+    std = logging.getLogger("bench.intercept")
+    std.handlers = [handler]
+    std.propagate = False
+    std.setLevel(logging.DEBUG)  # пусть фильтрует сам перехватчик — меряем именно его быстрый путь
+
+    tmpdir = Path(tempfile.mkdtemp(prefix="bench-log-"))
+    sink = app_logging.BatchedJsonSink(tmpdir / "log.jsonl", batch_size=256)
+    json_logger = logger.bind(bench_json=True)
+    json_sink = logger.add(sink, level="INFO", format="{message}", filter=lambda r: "bench_json" in r["extra"])
+
+    env = {
+        "sinks": (null_sink, json_sink),
+        "min_level": min_level,
+        "tmpdir": tmpdir,
+        "handler": handler,
+        "std": std,
+        "debug_record": std.makeRecord("bench.intercept", logging.DEBUG, __file__, 1, "debug %s", ("x",), None),
+        "info_record": std.makeRecord("bench.intercept", logging.INFO, __file__, 1, "info %s", ("x",), None),
+        "json_logger": json_logger,
+    }
+    ctx.extra["log_env"] = env
+    return env
+
+
+def close_log_env(ctx: Ctx) -> None:
+    """Снять sink'и loguru, вернуть уровень и удалить временную папку _log_env (если он был)."""
+    env = ctx.extra.pop("log_env", None)
+    if env is None:
+        return
+
+    import shutil
+
+    from loguru import logger
+
+    from app.utils import logging as app_logging
+
+    for sink_id in env["sinks"]:
+        logger.remove(sink_id)  # BatchedJsonSink: stop() дописывает буфер и закрывает файл
+    app_logging._MIN_LEVEL_NO = env["min_level"]
+    shutil.rmtree(env["tmpdir"], ignore_errors=True)
+
+
+@case("logging.intercept.emit_filtered", batch=200)
+def _log_emit_filtered(ctx: Ctx) -> None:
+    env = _log_env(ctx)
+    env["handler"].emit(env["debug_record"])
+
+
+@case("logging.intercept.emit_enabled", batch=20)
+def _log_emit_enabled(ctx: Ctx) -> None:
+    env = _log_env(ctx)
+    env["handler"].emit(env["info_record"])
+
+
+@case("logging.stdlib.info_via_intercept", batch=20)
+def _log_std_info(ctx: Ctx) -> None:
+    _log_env(ctx)["std"].info("request %s handled", "/postback")
+
+
+@case("logging.sampled.disabled", batch=200)
+def _log_sampled_disabled(ctx: Ctx) -> None:
+    from app.utils.logging import log_sampled
+
+    _log_env(ctx)
+    log_sampled("bench:disabled", "MENU image: {}", "menu.png")
+
+
+@case("logging.sampled.suppressed", batch=200)
+def _log_sampled_suppressed(ctx: Ctx) -> None:
+    from app.utils.logging import log_sampled
+
+    _log_env(ctx)
+    log_sampled("bench:suppressed", "MENU image: {}", "menu.png", level="INFO", every=3600)
+
+
+@case("logging.json_sink.record", batch=20)
+def _log_json_sink(ctx: Ctx) -> None:
+    _log_env(ctx)["json_logger"].info("postback {} accepted", "ftd")
@@ -0,0 +1,419 @@
+# bench/conformance.py
+from __future__ import annotations
+
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import aclosing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from app.config import get_config
+from app.services.segments import Segment
+from app.storage import Storage, create_storage, export_columns, set_storage
+
+# Проверка бэкендов хранилища (app/storage) на одинаковое поведение:
+#   python -m bench conformance --backends sqlite,memory
+# Каждая проверка получает пустое хранилище (SQLite — новый файл во временной папке).
+
+TS = 1_800_000_000
+
+
+class ConformanceError(Exception):
+    pass
+
+
+def expect(actual: Any, expected: Any, what: str) -> None:
+    if actual != expected:
+        raise ConformanceError(f"{what}: ожидалось {expected!r}, получено {actual!r}")
+
+
+CheckFn = Callable[[Storage], Awaitable[None]]
+
+
+@dataclass
+class Check:
+    name: str
+    fn: CheckFn
+
+
+CHECKS: List[Check] = []
+
+
+def check(name: str) -> Callable[[CheckFn], CheckFn]:
+    def deco(fn: CheckFn) -> CheckFn:
+        CHECKS.append(Check(name, fn))
+        return fn
+    return deco
+
+
+async def _user(s: Storage, user_id: int, *, lang: str | None = "ru", ref: str | None = None, ts: int = TS) -> None:
+    await s.upsert_user(user_id, username=f"u{user_id}", first_name="F", last_name=None, lang=lang, ref_code=ref, ts=ts)
+
+
+async def _collect(it: Any) -> List[Any]:
+    out: List[Any] = []
+    async with aclosing(it) as batches:
+        async for batch in batches:
+            out.extend(batch)
+    return out
+
+
+# ===== настройки =====
+
+@check("settings.get_set")
+async def _settings(s: Storage) -> None:
+    expect(await s.get_setting("nope"), None, "нет ключа")
+    await s.set_setting("k", "v1")
+    await s.set_setting("k", "v2")
+    expect(await s.get_setting("k"), "v2", "перезапись")
+
+
+@check("settings.links")
+async def _links(s: Storage) -> None:
+    cfg = get_config()
+    links = await s.get_links()
+    expect(links["support_url"], cfg.support_url, "ссылка по умолчанию — из Config")
+    await s.set_links(ref_url="https://example.org/ref")
+    links = await s.get_links()
+    expect(links["ref_url"], "https://example.org/ref", "set_links")
+    expect(links["onewin_tok_url"], cfg.onewin_tok_url, "set_links не трогает остальные")
+
+
+# ===== пользователи =====
+
+@check("users.upsert_new")
+async def _upsert_new(s: Storage) -> None:
+    expect(await s.get_user(1), None, "нет пользователя")
+    await _user(s, 1, lang=None, ref="abc")
+    expect(await s.get_user(1), {
+        "user_id": 1, "username": "u1", "first_name": "F", "last_name": None, "lang": "ru",
+        "ref_code": "abc", "created_at": TS, "updated_at": TS, "blocked": 0,
+    }, "новый пользователь")
+
+
+@check("users.upsert_existing")
+async def _upsert_existing(s: Storage) -> None:
+    await _user(s, 1, lang="en", ref="abc")
+    await s.upsert_user(1, username="new", first_name="G", last_name="L", lang=None, ref_code="other", ts=TS + 5)
+    u = await s.get_user(1)
+    expect((u["username"], u["first_name"], u["last_name"]), ("new", "G", "L"), "имена обновились")
+    expect(u["lang"], "en", "lang=None не затирает язык")
+    expect(u["ref_code"], "abc", "ref_code не меняется")
+    expect((u["created_at"], u["updated_at"]), (TS, TS + 5), "created_at/updated_at")
+    await s.upsert_user(1, username="new", first_name="G", last_name="L", lang="de", ref_code=None, ts=TS + 6)
+    expect(await s.get_user_lang(1), "de", "lang из upsert")
+
+
+@check("users.lang")
+async def _lang(s: Storage) -> None:
+    expect(await s.get_user_lang(404), "ru", "язык неизвестного")
+    await _user(s, 1)
+    await s.set_user_lang(1, "es", TS + 1)
+    expect(await s.get_user_lang(1), "es", "set_user_lang")
+    expect((await s.get_user(1))["updated_at"], TS + 1, "updated_at")
+    await s.set_user_lang(404, "es", TS)   # неизвестный — без ошибки
+    expect(await s.get_user(404), None, "set_user_lang не создаёт пользователя")
+
+
+@check("users.count_by_lang")
+async def _count_by_lang(s: Storage) -> None:
+    for uid, lang in ((1, "ru"), (2, "ru"), (3, "en"), (4, "en")):
+        await _user(s, uid, lang=lang)
+    await s.set_blocked(4, True)
+    expect(await s.count_users_by_lang(None), 3, "все, кроме заблокировавших")
+    expect(await s.count_users_by_lang("en"), 1, "по языку")
+    await s.set_blocked(4, False)
+    expect(await s.count_users_by_lang("en"), 2, "разблокировали")
+
+
+@check("users.record_activity")
+async def _activity(s: Storage) -> None:
+    await _user(s, 1)
+    await _user(s, 2)
+    await s.record_activity([(1, TS + 10, 3), (2, TS + 5, 1), (404, TS, 1)])
+    await s.record_activity([(1, TS + 7, 2)], blocked=[(2, True)])
+    rows = {r[0]: r for r in await _collect(s.iter_export_rows("users"))}
+    cols = export_columns("users")
+    seen, inter, blocked = cols.index("last_seen_at"), cols.index("interactions"), cols.index("blocked")
+    expect((rows[1][seen], rows[1][inter]), (TS + 10, 5), "last_seen_at не откатывается, interactions копятся")
+    expect(rows[2][blocked], 1, "blocked из пачки")
+    expect(404 in rows, False, "неизвестный не создаётся")
+
+
+# ===== постбэки и анкеты =====
+
+@check("postbacks.add")
+async def _postbacks(s: Storage) -> None:
+    await _user(s, 1)
+    a = await s.add_postback(1, "ftd", '{"x": 1}', TS)
+    b = await s.add_postback(1, "rtd", "{}", TS + 1)
+    expect(b > a, True, "id растут")
+    rows = await _collect(s.iter_export_rows("postbacks"))
+    expect(rows, [(a, 1, "ftd", '{"x": 1}', TS), (b, 1, "rtd", "{}", TS + 1)], "строки постбэков")
+
+
+@check("postbacks.unknown_user")
+async def _postbacks_unknown_user(s: Storage) -> None:
+    await _user(s, 1)
+    try:
+        await s.add_postback(404, "ftd", "{}", TS)
+    except sqlite3.IntegrityError:
+        pass
+    else:
+        raise ConformanceError("постбэк неизвестного пользователя: ожидали IntegrityError")
+    rows = await _collect(s.iter_export_rows("postbacks"))
+    expect(rows, [], "постбэк неизвестного не сохраняется")
+
+
+@check("postbacks.add_batch")
+async def _postbacks_batch(s: Storage) -> None:
+    await _user(s, 1)
+    await _user(s, 2)
+    rows = [(11, 1, "ftd", "{}", TS), (12, 2, "rtd", "{}", TS + 1), (13, 404, "ftd", "{}", TS + 2)]
+    inserted, rejected = await s.add_postbacks(rows)
+    expect((inserted, rejected), (2, [rows[2]]), "вставлено и отвергнуто")
+    inserted, rejected = await s.add_postbacks(rows[:2] + [(14, 1, "rtd", "{}", TS + 3)])
+    expect((inserted, rejected), (1, []), "повтор spool_id пропускается")
+    got = [(r[1], r[2]) for r in await _collect(s.iter_export_rows("postbacks"))]
+    expect(got, [(1, "ftd"), (2, "rtd"), (1, "rtd")], "строки без дублей")
+    expect(await s.add_postbacks([]), (0, []), "пустая пачка")
+    top = {r["ref_code"]: r for r in await s.top_ref_codes("users", limit=10)}
+    expect(top[""]["uniq:ftd"], 1, "счётчики только по вставленным")
+
+
+@check("profiles.upsert")
+async def _profiles(s: Storage) -> None:
+    await _user(s, 1)
+    expect(await s.get_user_profile(1), None, "нет анкеты")
+    await s.upsert_user_profile(1, "Name", "acc", "@h", "in")
+    p = await s.get_user_profile(1)
+    expect((p["full_name"], p["geo"]), ("Name", "in"), "анкета")
+    await s.upsert_user_profile(1, "Other", "acc2", "@h2", "br")
+    p2 = await s.get_user_profile(1)
+    expect((p2["full_name"], p2["account_id"], p2["geo"]), ("Other", "acc2", "br"), "обновление анкеты")
+    expect(p2["created_at"], p["created_at"], "created_at не меняется")
+    expect(sorted(p2), sorted(export_columns("profiles")), "колонки анкеты")
+
+
+# ===== рассылки =====
+
+@check("broadcasts.create_get")
+async def _broadcast_create(s: Storage) -> None:
+    bid = await s.create_broadcast(
+        7, "hi", "{}", '{"langs": ["ru"]}', TS,
+        payload_json='{"kind": "text"}', variants=[("ru", "p-ru"), ("en", "p-en")], fallback_lang="en",
+        status="scheduled", scheduled_for=TS + 60, quiet_hours="23:00-08:00", max_rate=5.0,
+    )
+    row = await s.get_broadcast(bid)
+    expect(
+        {k: row[k] for k in ("author_id", "text", "filter_json", "payload_json", "fallback_lang", "status",
+                             "scheduled_for", "quiet_hours", "max_rate", "total", "sent", "failed", "created_at")},
+        {"author_id": 7, "text": "hi", "filter_json": '{"langs": ["ru"]}', "payload_json": '{"kind": "text"}',
+         "fallback_lang": "en", "status": "scheduled", "scheduled_for": TS + 60, "quiet_hours": "23:00-08:00",
+         "max_rate": 5.0, "total": 0, "sent": 0, "failed": 0, "created_at": TS},
+        "строка рассылки",
+    )
+    expect(await s.get_broadcast_variants(bid), {"ru": "p-ru", "en": "p-en"}, "варианты")
+    expect(await s.get_broadcast_variants(bid + 100), {}, "варианты чужой рассылки")
+    expect(await s.get_broadcast(bid + 100), None, "нет рассылки")
+
+
+@check("broadcasts.progress")
+async def _broadcast_progress(s: Storage) -> None:
+    bid = await s.create_broadcast(1, "t", "", "{}", TS)
+    await s.set_broadcast_status(bid, "running", started_at=TS + 1)
+    await s.set_broadcast_counts(bid, total=10, sent=9, failed=1, cursor=("en", 42))
+    await s.set_broadcast_counts(bid, total=11, sent=10, failed=1)
+    await s.set_broadcast_status(bid, "done", finished_at=TS + 2)
+    row = await s.get_broadcast(bid)
+    expect((row["total"], row["sent"], row["failed"]), (11, 10, 1), "счётчики")
+    expect((row["cursor_lang"], row["cursor_user_id"]), ("en", 42), "курсор без cursor= не сбрасывается")
+    expect((row["status"], row["started_at"], row["finished_at"]), ("done", TS + 1, TS + 2), "статус и время")
+
+
+@check("broadcasts.queue")
+async def _broadcast_queue(s: Storage) -> None:
+    late = await s.create_broadcast(1, "late", "", "{}", TS, status="scheduled", scheduled_for=TS + 100)
+    soon = await s.create_broadcast(1, "soon", "", "{}", TS, status="scheduled", scheduled_for=TS + 10)
+    running = await s.create_broadcast(1, "run", "", "{}", TS, status="running", scheduled_for=TS)
+    draft = await s.create_broadcast(1, "draft", "", "{}", TS)
+    expect([r["id"] for r in await s.due_broadcasts(TS + 50)], [soon], "подошедшие")
+    expect([r["id"] for r in await s.due_broadcasts(TS + 100)], [soon, late], "порядок по scheduled_for")
+    pending = await s.pending_broadcasts(limit=10)
+    expect([r["id"] for r in pending], [running, soon, late], "очередь для админки")
+    expect(sorted(pending[0]), sorted(("id", "status", "text", "scheduled_for", "quiet_hours", "max_rate", "total", "sent")),
+           "колонки очереди")
+    expect(len(await s.pending_broadcasts(limit=2)), 2, "limit")
+
+    expect(await s.requeue_interrupted_broadcasts(), 1, "прерванные")
+    expect((await s.get_broadcast(running))["status"], "scheduled", "running → scheduled")
+    await s.reschedule_broadcast(draft, TS + 5)
+    expect([r["id"] for r in await s.due_broadcasts(TS + 5)], [running, draft], "reschedule")
+
+    expect(await s.cancel_broadcast(late, TS + 1), True, "отмена")
+    expect(await s.cancel_broadcast(late, TS + 2), False, "повторная отмена")
+    row = await s.get_broadcast(late)
+    expect((row["status"], row["finished_at"]), ("cancelled", TS + 1), "отменённая")
+    await s.set_broadcast_status(soon, "done")
+    expect(await s.cancel_broadcast(soon, TS), False, "завершённую не отменить")
+    expect(await s.cancel_broadcast(999, TS), False, "несуществующую не отменить")
+
+
+# ===== ref-счётчики =====
+
+@check("refs.counters")
+async def _refs(s: Storage) -> None:
+    await _user(s, 1, ref="a", lang="ru")
+    await _user(s, 2, ref="a", lang="en")
+    await _user(s, 3, ref="b", lang="ru")
+    await _user(s, 4, ref=None, lang="ru")
+    await s.set_user_lang(2, "ru", TS)
+    await s.add_postback(1, "ftd", "{}", TS)
+    await s.add_postback(1, "ftd", "{}", TS)
+    await s.add_postback(3, "ftd", "{}", TS)
+
+    top = await s.top_ref_codes("users", limit=10)
+    expect(top[0], {"ref_code": "a", "users": 2, "lang:ru": 2, "lang:en": 0, "event:ftd": 2, "uniq:ftd": 1},
+           "счётчики рефа a")
+    expect(sorted(r["ref_code"] for r in top), ["", "a", "b"], "'' — без рефа")
+    expect([r["ref_code"] for r in await s.top_ref_codes("uniq:ftd", limit=10)], ["b", "a"], "по uniq:ftd")
+    expect([r["ref_code"] for r in await s.top_ref_codes("lang:en", limit=10)], [], "нулевые не попадают")
+    expect(len(await s.top_ref_codes("users", limit=1)), 1, "limit")
+
+
+# ===== сегменты =====
+
+async def _segment_fixture(s: Storage) -> None:
+    # user_id: (lang, ref, created_at, last_seen_at, blocked, события, гео)
+    users = {
+        1: ("ru", "a", TS, TS + 100, False, ("ftd",), "in"),
+        2: ("en", "a", TS + 10, None, False, (), None),
+        3: ("ru", "b", TS + 20, TS + 50, True, ("ftd", "rtd"), "br"),
+        4: ("de", None, TS + 30, TS + 200, False, ("rtd",), "in"),
+        5: ("en", "b", TS + 40, TS + 10, False, ("ftd", "rtd"), "br"),
+        6: ("ru", None, TS + 50, TS + 300, False, (), None),
+    }
+    for uid, (lang, ref, created, seen, blocked, events, geo) in users.items():
+        await _user(s, uid, lang=lang, ref=ref, ts=created)
+        if seen is not None:
+            await s.record_activity([(uid, seen, 1)])
+        if blocked:
+            await s.set_blocked(uid, True)
+        for ev in events:
+            await s.add_postback(uid, ev, "{}", TS)
+        if geo:
+            await s.upsert_user_profile(uid, "N", "acc", "@h", geo)
+
+
+_SEGMENT_CASES: Tuple[Tuple[str, Segment, List[int]], ...] = (
+    ("все активные", Segment(), [1, 2, 4, 5, 6]),
+    ("с заблокировавшими", Segment(include_blocked=True), [1, 2, 3, 4, 5, 6]),
+    ("язык", Segment(langs=("ru", "en")), [1, 2, 5, 6]),
+    ("created", Segment(created_from=TS + 10, created_to=TS + 40), [2, 4]),
+    ("active", Segment(seen_from=TS + 100), [1, 4, 6]),
+    ("inactive", Segment(seen_to=TS + 100), [2, 5]),
+    ("ref", Segment(ref_codes=("b",)), [5]),
+    ("has", Segment(has_events=("ftd", "rtd")), [5]),
+    ("geo", Segment(geos=("in",)), [1, 4]),
+    ("geo+has", Segment(geos=("br",), has_events=("ftd",), include_blocked=True), [3, 5]),
+)
+
+
+@check("segments.count_and_ids")
+async def _segments(s: Storage) -> None:
+    await _segment_fixture(s)
+    for label, segment, expected in _SEGMENT_CASES:
+        expect(await s.count_segment(segment), len(expected), f"count_segment: {label}")
+        expect(await _collect(s.iter_segment_user_ids(segment, batch=2)), expected, f"iter_segment_user_ids: {label}")
+    expect(await _collect(s.iter_segment_user_ids(Segment(), after_user_id=4)), [5, 6], "after_user_id")
+
+
+@check("segments.recipients")
+async def _recipients(s: Storage) -> None:
+    await _segment_fixture(s)
+    order = [(4, "de"), (2, "en"), (5, "en"), (1, "ru"), (6, "ru")]
+    expect(await _collect(s.iter_segment_recipients(Segment(), batch=2)), order, "по (lang, user_id)")
+    expect(await _collect(s.iter_segment_recipients(Segment(), after=("en", 2))), order[2:], "после курсора")
+    expect(await _collect(s.iter_segment_recipients(Segment(langs=("fr",)))), [], "пустой сегмент")
+
+
+# ===== выгрузки =====
+
+@check("exports.rows")
+async def _exports(s: Storage) -> None:
+    await _segment_fixture(s)
+    users = await _collect(s.iter_export_rows("users", batch=4))
+    expect([r[0] for r in users], [1, 2, 3, 4, 5, 6], "по порядку ключа")
+    expect(len(users[0]), len(export_columns("users")), "колонки users")
+    window = await _collect(s.iter_export_rows("users", date_from=TS + 10, date_to=TS + 30))
+    expect([r[0] for r in window], [2, 3], "date_from включительно, date_to — нет")
+    filtered = await _collect(s.iter_export_rows("users", filters={"lang": ["en", "de"], "blocked": [0]}))
+    expect([r[0] for r in filtered], [2, 4, 5], "фильтры")
+    geo = await _collect(s.iter_export_rows("profiles", filters={"geo": ["br"]}))
+    expect([r[0] for r in geo], [3, 5], "анкеты по гео")
+    ftd = await _collect(s.iter_export_rows("postbacks", filters={"event_type": ["ftd"], "user_id": [1, 3]}))
+    expect([(r[1], r[2]) for r in ftd], [(1, "ftd"), (3, "ftd")], "постбэки по событию и пользователю")
+    try:
+        await _collect(s.iter_export_rows("users", filters={"username": ["x"]}))
+    except ValueError:
+        pass
+    else:
+        raise ConformanceError("фильтр не из export_filter_columns должен давать ValueError")
+
+
+# ===== отчёты =====
+
+@check("reports.view")
+async def _reports(s: Storage) -> None:
+    await _segment_fixture(s)
+    before = int(time.time())
+    async with s.reports() as r:
+        expect(r.as_of >= before - 1, True, "as_of — не раньше начала проверки (без снимка)")
+        expect(await r.count_users_by_lang(None), await s.count_users_by_lang(None), "count_users_by_lang")
+        expect(await r.count_users_by_lang("en"), await s.count_users_by_lang("en"), "count_users_by_lang(en)")
+        expect(await r.top_ref_codes("users", 10), await s.top_ref_codes("users", 10), "top_ref_codes")
+        for label, segment, expected in _SEGMENT_CASES:
+            expect(await r.count_segment(segment), len(expected), f"count_segment: {label}")
+        expect(await _collect(r.iter_export_rows("users")), await _collect(s.iter_export_rows("users")), "выгрузка")
+
+
+# ===== запуск =====
+
+async def _fresh(backend: str, workdir: Path, n: int) -> Storage:
+    if backend == "sqlite":
+        from bench.runner import _use_db
+
+        await _use_db(workdir / f"conformance-{n}.db")
+    storage = create_storage(backend)
+    await storage.open()
+    set_storage(storage)
+    return storage
+
+
+async def run(backends: List[str]) -> Dict[str, List[str]]:
+    """Вернёт backend -> список провалов (пустой — бэкенд соответствует)."""
+    failures: Dict[str, List[str]] = {}
+    workdir = Path(tempfile.mkdtemp(prefix="bench-conformance-"))
+    try:
+        for backend in backends:
+            failures[backend] = []
+            started = time.perf_counter()
+            for i, c in enumerate(CHECKS):
+                storage = await _fresh(backend, workdir, i)
+                try:
+                    await c.fn(storage)
+                except Exception as e:
+                    failures[backend].append(f"{c.name}: {type(e).__name__}: {e}")
+                finally:
+                    await storage.close()
+                    set_storage(None)
+            status = "ok" if not failures[backend] else f"{len(failures[backend])} FAIL"
+            print(f"[{backend}] {len(CHECKS)} проверок за {time.perf_counter() - started:.2f}s — {status}")
+            for line in failures[backend]:
+                print("  " + line)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)  # storage.close() уже закрыл БД
+    return failures
@@ -0,0 +1,77 @@
+# bench/env.py
+from __future__ import annotations
+
+import datetime as dt
+import os
+import tempfile
+from pathlib import Path
+from typing import Any
+
+# Бенчмарки не должны требовать настоящий .env: выставляем заглушки ДО импорта app.*
+_DEFAULT_ENV = {
+    "BOT_TOKEN": "123456:bench",
+    "ADMIN_ID": "1",
+    "POSTBACK_CHANNEL_ID": "-1001",
+    "POSTBACK_SECRET": "bench",
+    "SUPPORT_URL": "https://example.com/support",
+    "REF_URL": "https://example.com/ref",
+    "ONEWIN_TOK_URL": "https://example.com/token",
+    "DB_PATH": str(Path(tempfile.gettempdir()) / "bench-bot" / "bot.db"),
+    "LOG_LEVEL": "WARNING",
+    # для ссылок на HTTP-выгрузку (exports.url_roundtrip)
+    "DOMAIN": "bench.example.com",
+    "EXPORT_TOKEN": "bench",
+}
+
+
+def prepare_env() -> None:
+    for k, v in _DEFAULT_ENV.items():
+        os.environ.setdefault(k, v)
+
+
+prepare_env()
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import TelegramMethod  # noqa: E402
+from aiogram.types import Chat, Message  # noqa: E402
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия Bot API без сети: send*/copy* возвращают правдоподобный Message,
+    остальные методы — True. Считает вызовы, чтобы бенчмарк видел, что путь дошёл до отправки.
+    """
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.calls = 0
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: int | None = None) -> Any:
+        self.calls += 1
+        name = method.__api_method__
+        if name.startswith(("send", "copy")):
+            chat_id = getattr(method, "chat_id", 0) or 0
+            return Message(
+                message_id=self.calls,
+                date=dt.datetime.now(dt.timezone.utc),
+                chat=Chat(id=int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, type="private"),
+            )
+        return True
+
+    async def stream_content(self, *args: Any, **kwargs: Any):  # pragma: no cover - не используется
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+def fake_bot() -> Bot:
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.enums import ParseMode
+
+    return Bot(
+        token=os.environ["BOT_TOKEN"],
+        session=FakeSession(),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
@@ -0,0 +1,193 @@
+# bench/runner.py
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import inspect
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+import app.config as app_config
+from app import db
+from app.storage import set_storage
+from app.storage.sqlite import SqliteStorage
+
+from bench.cases import CASES, Case, Ctx, close_log_env
+from bench.env import fake_bot
+from bench.synthetic import build_memory, ensure_db, parse_size
+
+
+async def _use_db(path: Path) -> None:
+    """Переключаем app.db на другую БД (закрываем текущее соединение)."""
+    if db._DB_CONN is not None:
+        await db._DB_CONN.close()
+        db._DB_CONN = None
+    app_config._config = dataclasses.replace(app_config.get_config(), db_path=path)
+    await db.get_db()
+
+
+async def _use_backend(backend: str, n_users: int, seed: int, workdir: Path) -> None:
+    """Поднять хранилище backend с синтетическими данными на n_users."""
+    if backend == "sqlite":
+        await _use_db(ensure_db(n_users, seed, workdir))
+        set_storage(SqliteStorage())
+    elif backend == "memory":
+        set_storage(build_memory(n_users, seed))
+    else:
+        raise ValueError(f"неизвестное хранилище: {backend}")
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    n = len(samples)
+    mean = statistics.fmean(samples)
+    return {
+        "n": n,
+        "min_us": samples[0] * 1e6,
+        "p50_us": samples[n // 2] * 1e6,
+        "p95_us": samples[min(n - 1, int(n * 0.95))] * 1e6,
+        "mean_us": mean * 1e6,
+        "ops_s": 1.0 / mean if mean > 0 else 0.0,
+    }
+
+
+async def _run_case(c: Case, ctx: Ctx, min_time: float, max_iter: int) -> Dict[str, float]:
+    is_async = inspect.iscoroutinefunction(c.fn)
+    limit = min(max_iter, c.max_iter or max_iter)
+
+    async def once() -> float:
+        started = time.perf_counter()
+        if is_async:
+            await c.fn(ctx)
+        elif c.batch > 1:
+            for _ in range(c.batch):
+                c.fn(ctx)
+        else:
+            c.fn(ctx)
+        return (time.perf_counter() - started) / c.batch
+
+    for _ in range(min(3, limit)):
+        await once()
+
+    samples: List[float] = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < limit and (len(samples) < 5 or time.perf_counter() < deadline):
+        samples.append(await once())
+    return _summary(samples)
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except Exception:
+        return None
+
+
+async def run(
+    sizes: List[str],
+    *,
+    seed: int = 42,
+    backends: Optional[List[str]] = None,
+    only: Optional[List[str]] = None,
+    min_time: float = 0.5,
+    max_iter: int = 20_000,
+) -> Dict[str, Any]:
+    logger.remove()  # debug-логи хендлеров искажают замеры
+
+    from app.main import _build_dispatcher
+
+    from app.services.spool import SPOOL
+
+    results: Dict[str, Any] = {}
+    workdir = Path(tempfile.mkdtemp(prefix="bench-"))
+    # спул постбэков — во временной папке прогона, не в ./data
+    app_config._config = dataclasses.replace(app_config.get_config(), postback_spool_dir=workdir / "spool")
+    # роутеры — синглтоны модулей, подключить их можно только к одному Dispatcher
+    dp = _build_dispatcher()
+    try:
+        for backend, label in [(b, s) for b in backends or ["sqlite"] for s in sizes]:
+            n_users = parse_size(label)
+            # sqlite — без префикса, чтобы compare работал со старыми прогонами
+            key = label if backend == "sqlite" else f"{backend}/{label}"
+            print(f"[{key}] {n_users} users")
+            await _use_backend(backend, n_users, seed, workdir / backend / label)
+
+            ctx = Ctx(rng=random.Random(seed), n_users=n_users, bot=fake_bot(), dp=dp)
+            per_size: Dict[str, Any] = {}
+            try:
+                for c in CASES:
+                    if only and not any(c.name.startswith(p) for p in only):
+                        continue
+                    res = await _run_case(c, ctx, min_time, max_iter)
+                    per_size[c.name] = res
+                    print(f"  {c.name:<36} p50 {res['p50_us']:>11.1f} us   p95 {res['p95_us']:>11.1f} us   n={res['n']}")
+            finally:
+                close_log_env(ctx)
+            results[key] = per_size
+    finally:
+        await SPOOL.stop()
+        if db._DB_CONN is not None:
+            await db._DB_CONN.close()
+            db._DB_CONN = None
+        set_storage(None)
+        # рабочие копии БД (на 5m — около гигабайта на размер) и спул прогона
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "seed": seed,
+            "backends": backends or ["sqlite"],
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": int(time.time()),
+        },
+        "results": results,
+    }
+
+
+def run_sync(sizes: List[str], **kwargs: Any) -> Dict[str, Any]:
+    return asyncio.run(run(sizes, **kwargs))
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], *, threshold: float = 0.10, metric: str = "p50_us") -> List[str]:
+    """
+    Сравниваем два прогона. Регрессия — если метрика выросла больше чем на threshold.
+    Вернёт список строк-регрессий (пустой — всё ок) и печатает полную таблицу.
+    """
+    regressions: List[str] = []
+    for size, cases in new.get("results", {}).items():
+        base_cases = base.get("results", {}).get(size, {})
+        for name, res in cases.items():
+            old = base_cases.get(name)
+            if not old or not old.get(metric):
+                continue
+            ratio = res[metric] / old[metric]
+            mark = ""
+            if ratio > 1.0 + threshold:
+                mark = "  REGRESSION"
+                regressions.append(f"{size} {name}: {old[metric]:.1f} -> {res[metric]:.1f} us (x{ratio:.2f})")
+            elif ratio < 1.0 - threshold:
+                mark = "  faster"
+            print(f"{size:>5} {name:<36} {old[metric]:>11.1f} -> {res[metric]:>11.1f} us  x{ratio:.2f}{mark}")
+    return regressions
+
+
+def load(path: Path) -> Dict[str, Any]:
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save(data: Dict[str, Any], path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
@@ -0,0 +1,131 @@
+# bench/synthetic.py
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterator, Tuple
+
+from app.config import SUPPORTED_LANGS
+from app.db import POST_MIGRATION_SQL, SCHEMA_SQL
+from app.storage.memory import MemoryStorage
+
+# Синтетическая БД: N пользователей, ~0.3N постбэков, ~0.2N анкет.
+# Генерация детерминирована seed'ом; готовые файлы кешируются в .bench/.
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "5m": 5_000_000}
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".bench"
+
+_EVENTS = ("register", "ftd", "rtd", "all_deposits", "income", "app_start")
+_EVENT_WEIGHTS = (50, 12, 15, 10, 8, 5)
+_GEOS = ("ru", "ww", "in", "br", "es", "ui", "tr", "id", "fr", "ozbek", "de")  # коды из мини-аппа
+_BASE_TS = 1_700_000_000
+_SPAN = 365 * 24 * 3600
+
+USER_ID_BASE = 100_000_000
+
+
+def parse_size(label: str) -> int:
+    label = label.strip().lower()
+    if label in SIZES:
+        return SIZES[label]
+    if label.endswith("k"):
+        return int(float(label[:-1]) * 1_000)
+    if label.endswith("m"):
+        return int(float(label[:-1]) * 1_000_000)
+    return int(label)
+
+
+def _users(rng: random.Random, n: int) -> Iterator[Tuple]:
+    langs = SUPPORTED_LANGS
+    for i in range(n):
+        uid = USER_ID_BASE + i
+        created = _BASE_TS + rng.randrange(_SPAN)
+        ref = f"ref{rng.randrange(500)}" if rng.random() < 0.6 else None
+        seen = created + rng.randrange(_BASE_TS + _SPAN - created + 1)
+        yield (
+            uid, f"user{i}", f"First{i}", None,
+            langs[rng.randrange(len(langs))], ref,
+            created, created + rng.randrange(3600 * 24),
+            1 if rng.random() < 0.05 else 0,
+            seen, 1 + rng.randrange(50),
+        )
+
+
+def _postbacks(rng: random.Random, n_users: int, n: int) -> Iterator[Tuple]:
+    for _ in range(n):
+        uid = USER_ID_BASE + rng.randrange(n_users)
+        ev = rng.choices(_EVENTS, _EVENT_WEIGHTS)[0]
+        payload = json.dumps({"event": ev, "user_id": str(uid), "amount": str(rng.randrange(10, 500))})
+        yield (uid, ev, payload, _BASE_TS + rng.randrange(_SPAN))
+
+
+def _profiles(rng: random.Random, n_users: int, n: int) -> Iterator[Tuple]:
+    for uid in rng.sample(range(USER_ID_BASE, USER_ID_BASE + n_users), n):
+        ts = _BASE_TS + rng.randrange(_SPAN)
+        yield (uid, f"Name {uid}", f"acc{uid}", f"@u{uid}", _GEOS[rng.randrange(len(_GEOS))], ts, ts)
+
+
+def build(path: Path, n_users: int, seed: int) -> None:
+    rng = random.Random(seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for suffix in ("", "-wal", "-shm"):
+        Path(str(path) + suffix).unlink(missing_ok=True)
+
+    conn = sqlite3.connect(path.as_posix())
+    conn.executescript(SCHEMA_SQL)
+    conn.executescript(POST_MIGRATION_SQL)
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executemany(
+        "INSERT INTO users(user_id, username, first_name, last_name, lang, ref_code, created_at, updated_at, blocked,"
+        " last_seen_at, interactions) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        _users(rng, n_users),
+    )
+    conn.executemany(
+        "INSERT INTO postbacks(user_id, event_type, payload, created_at) VALUES(?, ?, ?, ?)",
+        _postbacks(rng, n_users, int(n_users * 0.3)),
+    )
+    conn.executemany(
+        "INSERT INTO user_profiles(user_id, full_name, account_id, tg_handle, geo, created_at, updated_at)"
+        " VALUES(?, ?, ?, ?, ?, ?, ?)",
+        _profiles(rng, n_users, int(n_users * 0.2)),
+    )
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def build_memory(n_users: int, seed: int) -> MemoryStorage:
+    """Те же данные, что build(), в MemoryStorage (тот же порядок вызовов rng)."""
+    rng = random.Random(seed)
+    storage = MemoryStorage()
+    storage.load(users=_users(rng, n_users))
+    storage.load(postbacks=((i, *row) for i, row in enumerate(_postbacks(rng, n_users, int(n_users * 0.3)), 1)))
+    storage.load(profiles=_profiles(rng, n_users, int(n_users * 0.2)))
+    return storage
+
+
+def ensure_db(n_users: int, seed: int, workdir: Path) -> Path:
+    """
+    Вернёт путь к рабочей копии синтетической БД.
+    Эталон строится один раз на (n_users, seed) и потом копируется —
+    бенчмарки пишут в БД, и эталон не должен «плыть» между прогонами.
+    """
+    # схема в имени: после новых индексов/таблиц эталон пересобирается сам
+    schema = hashlib.sha1((SCHEMA_SQL + POST_MIGRATION_SQL).encode("utf-8")).hexdigest()[:8]
+    base = CACHE_DIR / f"synthetic_{n_users}_{seed}_{schema}.db"
+    if not base.exists():
+        started = time.perf_counter()
+        build(base, n_users, seed)
+        print(f"  built {base.name} in {time.perf_counter() - started:.1f}s")
+    workdir.mkdir(parents=True, exist_ok=True)
+    work = workdir / "bot.db"
+    for suffix in ("", "-wal", "-shm"):
+        Path(str(work) + suffix).unlink(missing_ok=True)
+    shutil.copyfile(base, work)
+    return work